@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from api.dependencies import get_current_admin
+from core import profiler
+from core.registry import model_registry
+from core.slowlog import slow_log
+from db.indexes import explain_query_shapes
+from db.mongodb import get_database
+from models.user_model import UserPublic
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+@router.get("/query_plans")
+async def query_plans(_admin: UserPublic = Depends(get_current_admin)) -> List[dict]:
+    """
+    Piano di esecuzione delle query usate dalle route; "flagged" indica una
+    collection scan inattesa (indice mancante).
+    """
+    db = await get_database()
+    return await explain_query_shapes(db)
+
+
+@router.get("/models")
+async def models(_admin: UserPublic = Depends(get_current_admin)) -> List[dict]:
+    """Modelli registrati e versione caricata in questo processo."""
+    return model_registry.describe()
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=profiler.PROFILER_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    loop_only: bool = Query(False, description="Campiona solo il thread dell'event loop"),
+    _admin: UserPublic = Depends(get_current_admin),
+):
+    """
+    Campiona gli stack di questo worker per seconds secondi e restituisce il
+    formato collapsed per flamegraph (flamegraph.pl, speedscope). Disponibile
+    solo con PROFILER_ENABLED=1; una sessione alla volta.
+    """
+    if not profiler.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler disabilitato")
+    thread_id: Optional[int] = threading.get_ident() if loop_only else None
+    try:
+        # Il campionatore gira in un thread: il loop continua a servire richieste
+        stacks = await asyncio.to_thread(profiler.sample, seconds, interval_ms / 1000, thread_id)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profilazione gia' in corso")
+    return PlainTextResponse(stacks)
+
+
+@router.get("/slow_requests")
+async def slow_requests(
+    limit: Optional[int] = Query(None, ge=1),
+    _admin: UserPublic = Depends(get_current_admin),
+) -> dict:
+    """Richieste e messaggi WebSocket oltre SLOW_REQUEST_THRESHOLD_MS, dal piu' recente."""
+    return {
+        "threshold_ms": slow_log.threshold * 1000,
+        "items": slow_log.recent(limit),
+    }
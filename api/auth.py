@@ -2,7 +2,7 @@ from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException, status
 from datetime import datetime, timezone
 
-from api.dependencies import get_current_user
+from api.dependencies import get_current_user, invalidate_user
 from core import security
 from db.mongodb import get_database
 from models.user_model import UserRegister, TokenResponse, UserPublic, UserLogin, TokenRefreshResponse, \
@@ -15,6 +15,15 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+
+def _password_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server occupato, riprovare tra poco",
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/register", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
 async def register(user_data: UserRegister):
     db = await get_database()
@@ -26,7 +35,10 @@ async def register(user_data: UserRegister):
             detail="Email gia registrata"
         )
 
-    hashed_pw = security.hash_password(user_data.password)
+    try:
+        hashed_pw = await security.hash_password_async(user_data.password)
+    except security.PasswordHashingBusy:
+        raise _password_busy()
     new_user_doc = {
         "email": user_data.email,
         "hashed_password": hashed_pw,
@@ -69,7 +81,11 @@ async def login(creds: UserLogin):
         )
 
     hashed_pw = user_doc["hashed_password"]
-    if not security.verify_password(creds.password, hashed_pw):
+    try:
+        valid = await security.verify_password_async(creds.password, hashed_pw)
+    except security.PasswordHashingBusy:
+        raise _password_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o password non valide",
@@ -142,17 +158,22 @@ async def change_password(
     if not user_doc:
         raise HTTPException(status_code=404, detail="Utente non trovato")
 
-    if not security.verify_password(req.old_password, user_doc["hashed_password"]):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Password attuale non corretta"
-        )
-
-    new_hashed = security.hash_password(req.new_password)
+    try:
+        valid = await security.verify_password_async(req.old_password, user_doc["hashed_password"])
+        if not valid:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Password attuale non corretta"
+            )
+
+        new_hashed = await security.hash_password_async(req.new_password)
+    except security.PasswordHashingBusy:
+        raise _password_busy()
     await db.users.update_one(
         {"_id": ObjectId(current_user.id)},
         {"$set": {"hashed_password": new_hashed}}
     )
+    invalidate_user(current_user.id)
 
     updated = await db.users.find_one({"_id": ObjectId(current_user.id)})
 
@@ -1,89 +1,308 @@
+import asyncio
+import json
+import os
+
+import numpy as np
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-import joblib
-import numpy as np
-import pandas as pd
-from typing import List
 
+from core.batching import MicroBatcher
+from core.executor import ExecutorBusy, classify_windows_timed, inference_executor
+from core.features import window_to_array
+from core.metrics import STAGE_SECONDS, WS_CONNECTIONS, Counter
+from core.protocol import BINARY_SUBPROTOCOL, FLAG_CHUNK, decode_frame
+from core.pubsub import FLEET_TOPIC, live_hub, user_topic
+from core.registry import BEHAVIOR_MODEL, ModelUnavailable, model_registry
+from core.ringbuffer import SlidingWindow
+from core.slowlog import slow_log
+from db.behavior_store import (
+    WindowAccumulator,
+    encode_window,
+    to_epoch_ms,
+    window_increments,
+    window_insert_ops,
+)
 from db.mongodb import get_database
+from db.rollups import window_rollup_ops
+from db.writer import bulk_writer
+
+import logging
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/behavior", tags=["behavior"])
 
-MODEL_PATH = "ml_models/rf_driving_behavior_windows.joblib"
-model_bundle = joblib.load(MODEL_PATH)
-model = model_bundle['model']
-class_mapping = model_bundle['class_mapping']
-sampling_rate = model_bundle['sampling_rate']
-window_duration_sec = model_bundle['window_duration_sec']
-expected_window_len = sampling_rate * window_duration_sec
+# Finestre scorrevoli: una classificazione ogni SLIDING_HOP_SEC secondi di campioni
+SLIDING_HOP_SEC = float(os.getenv("SLIDING_HOP_SEC", "0.5"))
+
+
+async def _window_params():
+    """
+    (lunghezza finestra, passo delle finestre scorrevoli) in campioni, dai
+    metadati del modello corrente: il modello viene caricato al primo uso.
+    """
+    bundle = (await model_registry.aget(BEHAVIOR_MODEL)).bundle
+    sampling_rate = bundle['sampling_rate']
+    expected_window_len = sampling_rate * bundle['window_duration_sec']
+    hop_len = max(1, round(SLIDING_HOP_SEC * sampling_rate))
+    return expected_window_len, hop_len
+
+
+_PIPELINE = "predict_behavior"
+
+WINDOWS_PROCESSED = Counter(
+    "behavior_windows_processed_total", "Finestre classificate (rate() = finestre/s)", ["mode"],
+)
+WINDOWS_DROPPED = Counter("behavior_windows_dropped_total", "Messaggi o finestre scartati", ["reason"])
+
+
+async def _classify_batch(windows):
+    # Feature e predict dell'intero micro-batch girano nel pool di inferenza;
+    # i tempi delle due fasi arrivano dal worker insieme alle label
+    results, timings = await inference_executor.run(classify_windows_timed, windows)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, pipeline=_PIPELINE, stage=stage)
+    return results
+
+# Coda di inferenza condivisa da tutte le connessioni WebSocket
+inference_batcher = MicroBatcher(
+    _classify_batch,
+    name="driving_behavior",
+    max_inflight=max(1, inference_executor.workers),
+)
+
+def _parse_json_window(message: dict):
+    """
+    (session_id, timestamp ms, campioni (N, 6), chunk) da un messaggio JSON,
+    o None se da ignorare. chunk indica un blocco di finestra scorrevole.
+    """
+    if message.get("type") not in ("window", "chunk"):
+        return None
+
+    payload = message.get("payload", [])
+    session_id = message.get("session_id")
+
+    if not isinstance(payload, list) or not payload or not session_id:
+        return None
+
+    timestamps = [to_epoch_ms(p["timestamp"]) for p in payload]
+    return ObjectId(session_id), timestamps, window_to_array(payload), message["type"] == "chunk"
+
+
+async def _session_owner(owners: dict, sid: ObjectId):
+    """Proprietario della sessione, cercato una volta per sessione e connessione."""
+    if sid not in owners:
+        db = await get_database()
+        doc = await db.sessions.find_one({"_id": sid}, {"user_id": 1})
+        owners[sid] = doc["user_id"] if doc else None
+    return owners[sid]
+
+
+async def _inc_sessions(increments: dict) -> None:
+    try:
+        db = await get_database()
+        for sid, inc in increments.items():
+            await db.sessions.update_one({"_id": sid}, {"$inc": inc})
+    except Exception:
+        logger.exception("Aggiornamento degli aggregati di sessione non riuscito")
+
+
+async def _store_windows(docs, owners: dict, pending: set):
+    by_owner = {}
+    increments = {}
+    for doc in docs:
+        # behavior_windows o time-series collection, secondo BEHAVIOR_STORAGE
+        await bulk_writer.write(*window_insert_ops(doc))
+        session_inc = increments.setdefault(doc["session_id"], {})
+        for field, value in window_increments(doc).items():
+            session_inc[field] = session_inc.get(field, 0) + value
+        user_id = await _session_owner(owners, doc["session_id"])
+        if user_id is not None:
+            by_owner.setdefault(user_id, []).append(doc)
+    # Gli aggregati incrementali della sessione, letti da stop_session, non
+    # passano dal buffer: con piu' worker quello della connessione non viene
+    # svuotato dallo stop. Li scrive un task, per non ritardare la risposta
+    # all'app; la disconnessione attende i task in pending. Le finestre che
+    # arrivano dopo lo stop aggiornano i conteggi ma non urgenza e rollup.
+    if increments:
+        task = asyncio.create_task(_inc_sessions(increments))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    # Rollup orari e giornalieri dell'utente (db.rollups)
+    for user_id, user_docs in by_owner.items():
+        for collection, ops in window_rollup_ops(user_id, user_docs).items():
+            await bulk_writer.write(collection, ops)
+
+
+async def _classify_chunk(streams: dict, owners: dict, pending: set, sid: ObjectId, timestamps, data):
+    """
+    Aggiunge un blocco alla finestra scorrevole della sessione e classifica
+    le finestre completate; restituisce l'ultima label o None.
+    """
+    state = streams.get(sid)
+    if state is None:
+        expected_window_len, hop_len = await _window_params()
+        state = streams[sid] = (
+            SlidingWindow(expected_window_len, hop_len),
+            WindowAccumulator(sid, expected_window_len),
+        )
+    ring, acc = state
+
+    with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="sliding_window"):
+        emitted = ring.push(timestamps, data)
+    if not emitted:
+        return None
+    try:
+        with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="inference"):
+            results = await asyncio.gather(*(inference_batcher.submit(features) for features, _, _ in emitted))
+    except (ExecutorBusy, ModelUnavailable):
+        # I campioni gia' tolti dal ring non vanno persi: prendono l'ultima
+        # label della sessione, come alla chiusura, o tornano in attesa della
+        # prossima finestra classificata
+        ts = np.concatenate([t for _, t, _ in emitted])
+        samples = np.concatenate([d for _, _, d in emitted])
+        if acc.last_label is not None:
+            await _store_windows(acc.add(ts, samples, acc.last_label, acc.last_version), owners, pending)
+        else:
+            ring.requeue(ts, samples)
+        raise
+    WINDOWS_PROCESSED.inc(len(results), mode="chunk")
+
+    # I campioni arrivati tra due finestre prendono la label della seconda
+    docs = []
+    for (_, ts, samples), (label, model_version) in zip(emitted, results):
+        docs.extend(acc.add(ts, samples, label, model_version))
+    with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="store"):
+        await _store_windows(docs, owners, pending)
+    return results[-1][0]
+
+
+async def _publish_live(owners: dict, sid: ObjectId, label: str, timestamp_ms) -> None:
+    """Pubblica la label sul bus live, per la flotta e per il proprietario della sessione."""
+    owner = await _session_owner(owners, sid)
+    user_id = str(owner) if owner is not None else None
+    topics = [FLEET_TOPIC] if user_id is None else [FLEET_TOPIC, user_topic(user_id)]
+    live_hub.publish(topics, str(sid), {
+        "session_id": str(sid),
+        "user_id": user_id,
+        "label": label,
+        "timestamp": int(timestamp_ms),
+    })
+
+
+async def _close_streams(streams: dict, owners: dict, pending: set):
+    docs = []
+    for ring, acc in streams.values():
+        ts, samples = ring.drain()
+        if len(ts) and acc.last_label is not None:
+            docs.extend(acc.add(ts, samples, acc.last_label, acc.last_version))
+        docs.extend(acc.flush())
+    await _store_windows(docs, owners, pending)
+    if pending:
+        await asyncio.gather(*pending)
+
 
 @router.websocket("/")
 async def predict_behavior(websocket: WebSocket):
-    await websocket.accept()
-    db = await get_database()
+    # Il formato binario (core.protocol) si negozia con il subprotocol;
+    # i messaggi JSON restano sempre accettati
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+    try:
+        expected_window_len, _ = await _window_params()
+    except ModelUnavailable:
+        logger.error("Modello di classificazione non disponibile")
+        await websocket.close(code=1011)
+        return
+    # Finestre scorrevoli della connessione, per sessione
+    streams = {}
+    # Proprietario di ciascuna sessione vista dalla connessione, per rollup e bus live
+    owners = {}
+    # Task di aggiornamento degli aggregati di sessione ancora in corso
+    pending = set()
+    WS_CONNECTIONS.inc(endpoint="behavior")
     try:
         while True:
-            message = await websocket.receive_json()
-
-            if message.get("type") != "window":
-                continue
-
-            payload = message.get("payload", [])
-            session_id = message.get("session_id")
-
-            if not isinstance(payload, list) or not session_id:
-                continue
-
-            if len(payload) < expected_window_len:
-                continue
-
-            # Predizione
-            X = extract_features_from_window(payload)
-            prediction = model.predict([X])[0]
-            label = class_mapping[prediction]
-
-            # Salvataggio dei dati
-            sid = ObjectId(session_id)
-            docs = []
-            for p in payload:
-                docs.append({
-                    "session_id": sid,
-                    "timestamp":  p["timestamp"],
-                    "label":      label,
-                    "AccX":       p["AccX"],
-                    "AccY":       p["AccY"],
-                    "AccZ":       p["AccZ"],
-                    "GyroX":      p["GyroX"],
-                    "GyroY":      p["GyroY"],
-                    "GyroZ":      p["GyroZ"],
-                })
-            if docs:
-                await db.behaviors.insert_many(docs)
-
-            # Invia la label all'app
-            await websocket.send_json({
-                "type": "prediction",
-                "label": label
-            })
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            # Ogni messaggio e' tracciato come richiesta: se supera la soglia
+            # finisce nel log delle richieste lente con le sue fasi
+            with slow_log.track("websocket", "WS /api/behavior/"):
+                with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="decode"):
+                    if message.get("bytes") is not None:
+                        if not binary:
+                            WINDOWS_DROPPED.inc(reason="invalid")
+                            continue
+                        try:
+                            sid, timestamps, data, flags = decode_frame(message["bytes"])
+                        except ValueError:
+                            WINDOWS_DROPPED.inc(reason="invalid")
+                            continue
+                        chunk = bool(flags & FLAG_CHUNK)
+                    else:
+                        try:
+                            parsed = _parse_json_window(json.loads(message["text"]))
+                        except (ValueError, KeyError, TypeError, InvalidId):
+                            parsed = None
+                        if parsed is None:
+                            WINDOWS_DROPPED.inc(reason="invalid")
+                            continue
+                        sid, timestamps, data, chunk = parsed
+
+                if chunk:
+                    try:
+                        label = await _classify_chunk(streams, owners, pending, sid, timestamps, data)
+                    except ExecutorBusy:
+                        WINDOWS_DROPPED.inc(reason="busy")
+                        continue
+                    except ModelUnavailable:
+                        WINDOWS_DROPPED.inc(reason="model_unavailable")
+                        continue
+                    if label is not None:
+                        with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="send"):
+                            await websocket.send_json({"type": "prediction", "label": label})
+                        await _publish_live(owners, sid, label, timestamps[-1])
+                    continue
+
+                if len(data) < expected_window_len:
+                    WINDOWS_DROPPED.inc(reason="short")
+                    continue
+
+                # Predizione
+                try:
+                    with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="inference"):
+                        label, model_version = await inference_batcher.submit(data)
+                except ExecutorBusy:
+                    WINDOWS_DROPPED.inc(reason="busy")
+                    continue
+                except ModelUnavailable:
+                    WINDOWS_DROPPED.inc(reason="model_unavailable")
+                    continue
+                WINDOWS_PROCESSED.inc(mode="window")
+
+                # Salvataggio della finestra tramite il buffer write-behind e
+                # aggregati di sessione in un task: nessuna scrittura su Mongo
+                # ritarda la risposta
+                with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="store"):
+                    await _store_windows([encode_window(sid, timestamps, data, label, model_version)], owners, pending)
+
+                # Invia la label all'app
+                with STAGE_SECONDS.time(pipeline=_PIPELINE, stage="send"):
+                    await websocket.send_json({
+                        "type": "prediction",
+                        "label": label
+                    })
+                await _publish_live(owners, sid, label, timestamps[-1])
 
     except WebSocketDisconnect:
-        print("Connessione WebSocket chiusa")
-
-def extract_features_from_window(window: List[dict]) -> List[float]:
-    df = pd.DataFrame(window)
-
-    df["Acc_Mag"] = np.sqrt(df["AccX"]**2 + df["AccY"]**2 + df["AccZ"]**2)
-    df["Gyro_Mag"] = np.sqrt(df["GyroX"]**2 + df["GyroY"]**2 + df["GyroZ"]**2)
-
-    cols = ["AccX", "AccY", "AccZ", "GyroX", "GyroY", "GyroZ", "Acc_Mag", "Gyro_Mag"]
-    features = []
-
-    for col in cols:
-        arr = df[col].values
-        features.extend([
-            arr.mean(),
-            arr.std(),
-            arr.min(),
-            arr.max()
-        ])
-    return features
\ No newline at end of file
+        logger.info("Connessione WebSocket chiusa")
+    finally:
+        WS_CONNECTIONS.dec(endpoint="behavior")
+        await _close_streams(streams, owners, pending)
+        try:
+            await bulk_writer.flush()
+        except ConnectionError:
+            # I dati restano nel buffer e verranno ritentati in background
+            logger.warning("Flush alla disconnessione non riuscito")
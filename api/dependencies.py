@@ -1,8 +1,14 @@
+import hashlib
+import os
+import time
+
 from bson import ObjectId
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 from core import security
+from core.cache import TTLCache
+from core.metrics import STAGE_SECONDS
 from db.mongodb import get_database
 from models.user_model import UserPublic
 
@@ -10,9 +16,38 @@ import jwt
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SEC = float(os.getenv("USER_CACHE_TTL_SEC", "30"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SEC = float(os.getenv("TOKEN_CACHE_TTL_SEC", "300"))
+
+# UserPublic per user id: evita una find_one su users a ogni richiesta protetta.
+# Le scritture sull'utente devono chiamare invalidate_user.
+_user_cache = TTLCache("users", USER_CACHE_SIZE, USER_CACHE_TTL_SEC)
+# Payload dei token gia' verificati, per hash del token; mai oltre la scadenza del token
+_token_cache = TTLCache("tokens", TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SEC)
+
+
+def invalidate_user(user_id: str) -> None:
+    _user_cache.invalidate(user_id)
+
+
+def _decode_token_cached(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    payload = _token_cache.get(key)
+    if payload is not None and payload.get("exp", float("inf")) > time.time():
+        return payload
+    payload = security.decode_token(token)
+    ttl = min(TOKEN_CACHE_TTL_SEC, payload.get("exp", float("inf")) - time.time())
+    if ttl > 0:
+        _token_cache.set(key, payload, ttl)
+    return payload
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserPublic:
     try:
-        payload = security.decode_token(token)
+        with STAGE_SECONDS.time(pipeline="auth", stage="token"):
+            payload = _decode_token_cached(token)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(
@@ -33,18 +68,36 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserPublic:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
     db = await get_database()
-    user_doc = await db.users.find_one({"_id": ObjectId(user_id)})
+    with STAGE_SECONDS.time(pipeline="auth", stage="user_lookup"):
+        user_doc = await db.users.find_one({"_id": ObjectId(user_id)})
     if not user_doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Utente non trovato"
         )
 
-    return UserPublic(
+    user = UserPublic(
         id=str(user_doc["_id"]),
         email=user_doc["email"],
         full_name=user_doc["full_name"],
         registration_date=user_doc["registration_date"],
         maintenance_urgency=user_doc.get("maintenance_urgency"),
     )
+    _user_cache.set(user_id, user)
+    return user
+
+
+ADMIN_EMAIL = "admin@admin.com"
+
+async def get_current_admin(current_user: UserPublic = Depends(get_current_user)) -> UserPublic:
+    if current_user.email != ADMIN_EMAIL:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Operazione riservata all'amministratore"
+        )
+    return current_user
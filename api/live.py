@@ -0,0 +1,55 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+
+from api.dependencies import ADMIN_EMAIL, get_current_user
+from core.metrics import WS_CONNECTIONS
+from core.pubsub import FLEET_TOPIC, live_hub, user_topic
+
+import logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/live", tags=["live"])
+
+
+@router.websocket("/")
+async def live_labels(websocket: WebSocket, token: str, user_id: str = None):
+    """
+    Stream delle label live per la dashboard. Senza user_id riceve tutta la
+    flotta (solo amministratore); con user_id le sessioni di quell'utente
+    (l'utente stesso o l'amministratore). Il token va nella query string
+    perche' i browser non permettono header sui WebSocket.
+    """
+    try:
+        current_user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    is_admin = current_user.email == ADMIN_EMAIL
+    if not (is_admin or user_id == current_user.id):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    WS_CONNECTIONS.inc(endpoint="live")
+    sub = live_hub.subscribe([FLEET_TOPIC if user_id is None else user_topic(user_id)])
+    # La receive serve solo ad accorgersi della chiusura: i messaggi del client sono ignorati
+    incoming = asyncio.create_task(websocket.receive())
+    batch = asyncio.create_task(sub.get_batch())
+    try:
+        while True:
+            done, _ = await asyncio.wait({batch, incoming}, return_when=asyncio.FIRST_COMPLETED)
+            if incoming in done:
+                if incoming.result()["type"] == "websocket.disconnect":
+                    break
+                incoming = asyncio.create_task(websocket.receive())
+            if batch in done:
+                await websocket.send_json({"type": "live", "events": batch.result()})
+                batch = asyncio.create_task(sub.get_batch())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        incoming.cancel()
+        batch.cancel()
+        live_hub.unsubscribe(sub)
+        WS_CONNECTIONS.dec(endpoint="live")
@@ -1,39 +1,25 @@
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from bson import ObjectId
+from bson.errors import InvalidId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from api.dependencies import get_current_user
+from api.dependencies import ADMIN_EMAIL, get_current_admin, get_current_user
 from db.mongodb import get_database
+from db.rollups import naive_utc, rollup_by_user, rollup_series
+from db.views import USER_COUNTS_COLLECTION
+from models.report_model import RollupBucket, UserRollup
 from models.user_model import UserPublic, UserAvgBehavior
 
 router = APIRouter(prefix="/api/report", tags=["report"])
 
 @router.post("/update_maintenance", response_model=UserPublic)
 async def update_user_maintenance_urgency(current_user: UserPublic = Depends(get_current_user)):
+    # L'urgenza e' ricalcolata in background da db.maintenance_job: qui si
+    # legge il valore gia' calcolato, senza passare dalla cache utenti
     db = await get_database()
-
-    sessions = db.sessions.find({"user_id": ObjectId(current_user.id)})
-
-    total = 0.0
-    count = 0
-    async for s in sessions:
-        urg = s.get("maintenance_urgency")
-        if urg is not None:
-            total += float(urg)
-            count += 1
-
-    if count == 0:
-        score = None
-    else:
-        score = total / count
-
-    await db.users.update_one(
-        {"_id": ObjectId(current_user.id)},
-        {"$set": {"maintenance_urgency": score}}
-    )
-
     user_doc = await db.users.find_one({"_id": ObjectId(current_user.id)})
 
     return UserPublic(
@@ -41,7 +27,7 @@ async def update_user_maintenance_urgency(current_user: UserPublic = Depends(get
         email=user_doc["email"],
         full_name=user_doc["full_name"],
         registration_date=user_doc["registration_date"],
-        maintenance_urgency=score
+        maintenance_urgency=user_doc.get("maintenance_urgency")
     )
 
 @router.get(
@@ -51,55 +37,102 @@ async def update_user_maintenance_urgency(current_user: UserPublic = Depends(get
 async def avg_behavior_by_user(_current_user: UserPublic = Depends(get_current_user)) -> List[UserAvgBehavior]:
     db: AsyncIOMotorDatabase = await get_database()
 
-    # Filtra utenti diversi da admin
-    users_cursor = db.users.find({
-        "email": {"$ne": "admin@admin.com"},
-        "full_name": {"$ne": "admin"}
-    }, {
-        "_id": 1,
-        "full_name": 1
-    })
-    users = await users_cursor.to_list(length=None)
-    if not users:
-        return []
-
-    # Per ogni utente, aggrega tutti i comportamenti
-    results = []
-    for u in users:
-        uid = u["_id"]
-
-        pipeline = [
-            {"$match": {"user_id": uid}},
-            {"$lookup": {
-                "from": "behaviors",
-                "localField": "_id",
-                "foreignField": "session_id",
-                "as": "bs"
-            }},
-            {"$unwind": "$bs"},
-            {"$group": {
-                "_id": None,
-                "avg": {
-                    "$avg": {
-                        "$switch": {
-                            "branches": [
-                                {"case": {"$eq": ["$bs.label", "SLOW"]},     "then": 0.0},
-                                {"case": {"$eq": ["$bs.label", "NORMAL"]},   "then": 1.0},
-                                {"case": {"$eq": ["$bs.label", "AGGRESSIVE"]},"then": 2.0},
-                            ],
-                            "default": 0.0
-                        }
-                    }
-                }
-            }}
-        ]
-
-        agg = await db.sessions.aggregate(pipeline).to_list(length=1)
-        avg_val = agg[0]["avg"] if agg else 0.0
-
-        results.append(UserAvgBehavior(
-            full_name = u["full_name"],
-            avg_behavior = round(avg_val, 3)
-        ))
-
-    return results
\ No newline at end of file
+    # Un'unica aggregazione sulla flotta: utenti diversi da admin uniti ai
+    # conteggi per label materializzati in user_behavior_counts
+    pipeline = [
+        {"$match": {
+            "email": {"$ne": "admin@admin.com"},
+            "full_name": {"$ne": "admin"}
+        }},
+        {"$project": {"_id": 1, "full_name": 1}},
+        {"$lookup": {
+            "from": USER_COUNTS_COLLECTION,
+            "localField": "_id",
+            "foreignField": "_id",
+            "as": "counts"
+        }},
+        {"$set": {"counts": {"$ifNull": [{"$first": "$counts"}, {}]}}},
+        {"$set": {
+            "n": {"$add": [
+                {"$ifNull": ["$counts.count_slow", 0]},
+                {"$ifNull": ["$counts.count_normal", 0]},
+                {"$ifNull": ["$counts.count_aggressive", 0]},
+            ]},
+            # SLOW = 0, NORMAL = 1, AGGRESSIVE = 2
+            "score": {"$add": [
+                {"$ifNull": ["$counts.count_normal", 0]},
+                {"$multiply": [2, {"$ifNull": ["$counts.count_aggressive", 0]}]},
+            ]},
+        }},
+        {"$project": {
+            "_id": 0,
+            "full_name": 1,
+            "avg_behavior": {"$cond": [
+                {"$gt": ["$n", 0]},
+                {"$round": [{"$divide": ["$score", "$n"]}, 3]},
+                0.0
+            ]},
+        }},
+    ]
+
+    rows = await db.users.aggregate(pipeline).to_list(length=None)
+    return [UserAvgBehavior(**r) for r in rows]
+
+
+def _date_range(start: Optional[datetime], end: Optional[datetime]):
+    """Intervallo [start, end) in UTC naive; di default gli ultimi 30 giorni."""
+    end = naive_utc(end) if end else datetime.utcnow()
+    start = naive_utc(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Intervallo di date non valido")
+    return start, end
+
+
+@router.get("/rollups", response_model=List[RollupBucket])
+async def rollups(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    fleet: bool = False,
+    current_user: UserPublic = Depends(get_current_user),
+) -> List[RollupBucket]:
+    """
+    Serie oraria o giornaliera dai rollup: dell'utente corrente, di un altro
+    utente o dell'intera flotta (fleet=true); gli ultimi due solo per l'admin.
+    """
+    is_admin = current_user.email == ADMIN_EMAIL
+    if fleet or (user_id is not None and user_id != current_user.id):
+        if not is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Operazione riservata all'amministratore"
+            )
+    start, end = _date_range(start, end)
+    try:
+        uid = None if fleet else ObjectId(user_id or current_user.id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="user_id non valido")
+
+    db = await get_database()
+    rows = await rollup_series(db, granularity, start, end, uid)
+    return [RollupBucket(**r) for r in rows]
+
+
+@router.get("/rollups/users", response_model=List[UserRollup])
+async def rollups_by_user(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    _admin: UserPublic = Depends(get_current_admin),
+) -> List[UserRollup]:
+    """Totali per utente nell'intervallo, per la dashboard dell'admin."""
+    start, end = _date_range(start, end)
+    db = await get_database()
+    rows = await rollup_by_user(db, granularity, start, end)
+
+    names = {
+        u["_id"]: u.get("full_name")
+        async for u in db.users.find({"_id": {"$in": [r["user_id"] for r in rows]}}, {"full_name": 1})
+    }
+    return [UserRollup(**{**r, "user_id": str(r["user_id"]), "full_name": names.get(r["user_id"])}) for r in rows]
@@ -1,26 +1,60 @@
-from typing import List
+import asyncio
+import os
+from typing import List, Optional
 
-import joblib
-import numpy as np
-import pandas as pd
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReturnDocument
 
 from api.dependencies import get_current_user
+from core.cache import TTLCache
+from core.downsample import downsample_indices
+from core.metrics import STAGE_SECONDS
+from core.responses import FastJSONResponse, dumps
+from core.executor import ExecutorBusy, inference_executor, predict_maintenance
+from core.registry import ModelUnavailable
 from models.behavior_model import BehaviorCreate
 from models.user_model    import UserPublic
 from models.session_model import (
     SessionCreate,
     SessionStop,
     SessionResp,
+    session_row,
 )
 from db.mongodb    import get_database
+from db.archive import iter_archive_chunks, open_archive
+from db.behavior_store import (
+    LABEL_COUNT_FIELDS,
+    decode_cursor,
+    empty_session_aggregates,
+    encode_cursor,
+    from_epoch_ms,
+    iter_session_chunks,
+    load_session_samples,
+    magnitude_moments,
+    session_summary,
+    summary_from_session,
+)
+from db.rollups import session_rollup_ops
+from db.views import refresh_user_behavior_counts
+from db.writer import bulk_writer
 
-_maint_model = joblib.load("ml_models/rf_maintenance_regressor.joblib")
+import logging
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/sessions", tags=["sessions"])
 
+# Nomi dei campi di BehaviorCreate nell'ordine di SENSOR_COLUMNS
+_BEHAVIOR_FIELDS = ["accelX", "accelY", "accelZ", "gyroX", "gyroY", "gyroZ"]
+
+# Serie sottocampionate di sessioni concluse, per (session_id, max_points, method)
+DOWNSAMPLE_CACHE_SIZE = int(os.getenv("DOWNSAMPLE_CACHE_SIZE", "256"))
+_downsample_cache = TTLCache("downsample", DOWNSAMPLE_CACHE_SIZE)
+
+_STOP_PIPELINE = "stop_session"
+
 @router.post("/", response_model=SessionResp, status_code=status.HTTP_201_CREATED)
 async def start_session(
     _: SessionCreate,
@@ -30,7 +64,8 @@ async def start_session(
     doc = {
         "user_id": ObjectId(current_user.id),
         "start_time": datetime.utcnow(),
-        "end_time": None
+        "end_time": None,
+        **empty_session_aggregates(),
     }
     res = await db.sessions.insert_one(doc)
     return SessionResp(
@@ -49,91 +84,247 @@ async def stop_session(
     db = await get_database()
     sid = ObjectId(body.session_id)
 
-    # Aggiorna end_time
+    # Gli aggregati della sessione sono scritti direttamente dal WebSocket;
+    # le finestre ancora nel buffer di questo worker servono solo al
+    # ricalcolo lato Mongo delle sessioni senza aggregati
+    try:
+        with STAGE_SECONDS.time(pipeline=_STOP_PIPELINE, stage="flush"):
+            await bulk_writer.flush()
+    except ConnectionError:
+        logger.warning("Flush prima dello stop non riuscito")
+
+    # Chiude la sessione (end_time) e poi la finalizza: urgenza, segnalazione
+    # al job di manutenzione, vista e rollup. finalized_at viene scritto solo
+    # quando urgenza, segnalazione e vista sono riuscite, cosi' uno stop
+    # ripetuto dopo un errore (es. 503 con ExecutorBusy) completa il lavoro mancante.
+    # Troncato ai millisecondi come le date BSON: lo stop ripetuto restituisce lo stesso valore
+    end_time = datetime.utcnow()
+    end_time = end_time.replace(microsecond=end_time.microsecond // 1000 * 1000)
     updated = await db.sessions.find_one_and_update(
-        {"_id": sid, "user_id": ObjectId(current_user.id)},
-        {"$set": {"end_time": datetime.utcnow()}},
-        return_document=True
+        {"_id": sid, "user_id": ObjectId(current_user.id), "end_time": None},
+        {"$set": {"end_time": end_time}},
+        return_document=ReturnDocument.AFTER,
     )
     if not updated:
-        raise HTTPException(status_code=404, detail="Sessione non trovata")
+        updated = await db.sessions.find_one({"_id": sid, "user_id": ObjectId(current_user.id)})
+        if not updated:
+            raise HTTPException(status_code=404, detail="Sessione non trovata")
+        if updated.get("finalized_at") is not None:
+            # Stop ripetuto: restituisce i valori gia' salvati
+            return SessionResp(**session_row(updated))
 
-    behs = await db.behaviors.find({"session_id": sid}).to_list(length=None)
-
-    # Conta le label
-    count_agg = sum(1 for b in behs if b["label"] == "AGGRESSIVE")
-    count_nor = sum(1 for b in behs if b["label"] == "NORMAL")
-    count_slo = sum(1 for b in behs if b["label"] == "SLOW")
-
-    # Aggiorna sessione con i conteggi
-    await db.sessions.update_one(
-        {"_id": sid},
-        {"$set": {
-            "count_aggressive": count_agg,
-            "count_normal":     count_nor,
-            "count_slow":       count_slo
-        }}
-    )
+    # Conteggi e somme delle magnitudo sono mantenuti incrementalmente dal
+    # WebSocket; le sessioni senza aggregati vengono ricalcolate lato Mongo
+    summary = summary_from_session(updated)
+    if summary is None:
+        with STAGE_SECONDS.time(pipeline=_STOP_PIPELINE, stage="summary"):
+            summary = await session_summary(db, sid)
+            counts = {
+                field: summary["counts"].get(label, 0)
+                for label, field in LABEL_COUNT_FIELDS.items()
+            }
+            await db.sessions.update_one({"_id": sid}, {"$set": counts})
+        updated.update(counts)
+
+    try:
+        with STAGE_SECONDS.time(pipeline=_STOP_PIPELINE, stage="maintenance_predict"):
+            maintenance_score, model_version = await _predict_maintenance(db, updated, summary)
+    except ExecutorBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server occupato, riprovare",
+            headers={"Retry-After": "1"},
+        )
+    except ModelUnavailable:
+        # Senza regressore la sessione si chiude comunque, senza urgenza
+        logger.warning("Modello di manutenzione non disponibile, urgenza non calcolata")
+        maintenance_score, model_version = None, None
 
-    # Ricarica la sessione aggiornata per la predizione
-    final_doc = await db.sessions.find_one({"_id": sid})
+    with STAGE_SECONDS.time(pipeline=_STOP_PIPELINE, stage="write"):
+        # Aggiorna il campo maintenance_urgency e la versione del modello che l'ha prodotto
+        await db.sessions.update_one(
+            {"_id": sid},
+            {"$set": {
+                "maintenance_urgency": maintenance_score,
+                "maintenance_model_version": model_version,
+            }}
+        )
+        # Segnala al job l'urgenza dell'utente da ricalcolare (db.maintenance_job),
+        # dopo che quella della sessione e' stata scritta; ripeterlo costa solo un ricalcolo
+        await db.users.update_one({"_id": updated["user_id"]}, {"$inc": {"urgency_dirty": 1}})
 
-    maintenance_score = await _predict_maintenance(db, final_doc, behs)
+    # Aggiorna la vista dei conteggi per utente usata dalla dashboard
+    with STAGE_SECONDS.time(pipeline=_STOP_PIPELINE, stage="views_refresh"):
+        await refresh_user_behavior_counts(db, [updated["user_id"]])
 
-    # Aggiorna il campo maintenance_urgency
-    await db.sessions.update_one(
-        {"_id": sid},
-        {"$set": {"maintenance_urgency": maintenance_score}}
+    # Tutto quanto sopra si puo' ripetere; gli $inc dei rollup no: li accoda
+    # solo lo stop che marca la sessione come finalizzata
+    finalized = await db.sessions.update_one(
+        {"_id": sid, "finalized_at": {"$exists": False}},
+        {"$set": {"finalized_at": datetime.utcnow()}},
     )
+    if finalized.modified_count:
+        # Durata e urgenza della sessione nei rollup dell'utente (db.rollups)
+        rollup = session_rollup_ops(updated["user_id"], updated["start_time"], updated["end_time"], maintenance_score)
+        for collection, ops in rollup.items():
+            await bulk_writer.write(collection, ops)
 
     return SessionResp(
-        id=str(final_doc["_id"]),
-        user_id=str(final_doc["user_id"]),
-        start_time=final_doc["start_time"],
-        end_time=final_doc["end_time"],
-        count_aggressive=final_doc.get("count_aggressive", 0),
-        count_normal=final_doc.get("count_normal", 0),
-        count_slow=final_doc.get("count_slow", 0),
-        maintenance_urgency=final_doc.get("maintenance_urgency", 0.0)
+        id=str(updated["_id"]),
+        user_id=str(updated["user_id"]),
+        start_time=updated["start_time"],
+        end_time=updated["end_time"],
+        count_aggressive=updated.get("count_aggressive", 0),
+        count_normal=updated.get("count_normal", 0),
+        count_slow=updated.get("count_slow", 0),
+        maintenance_urgency=maintenance_score
     )
 
 @router.get("/", response_model=List[SessionResp])
 async def list_sessions(current_user: UserPublic = Depends(get_current_user)):
     db = await get_database()
-    docs = await db.sessions.find({"user_id": ObjectId(current_user.id)}).to_list(1000)
-    return [
-        SessionResp(
-          id=str(d["_id"]),
-          user_id=str(d["user_id"]),
-          start_time=d["start_time"],
-          end_time=d["end_time"] or d["start_time"],
-        )
+    docs = await db.sessions.find(
+        {"user_id": ObjectId(current_user.id)},
+        {"user_id": 1, "start_time": 1, "end_time": 1},
+    ).to_list(1000)
+    return FastJSONResponse([
+        {
+            "id": str(d["_id"]),
+            "user_id": str(d["user_id"]),
+            "start_time": d["start_time"],
+            "end_time": d["end_time"] or d["start_time"],
+            "count_aggressive": None,
+            "count_normal": None,
+            "count_slow": None,
+            "maintenance_urgency": None,
+        }
         for d in docs
-    ]
+    ])
 
 @router.get("/{session_id}/behaviors", response_model=List[BehaviorCreate])
 async def get_behaviors(
     session_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=100_000),
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    max_points: Optional[int] = Query(None, ge=4, le=100_000),
+    method: str = Query("lttb", pattern="^(lttb|minmax)$"),
     _current_user: UserPublic = Depends(get_current_user)
 ):
+    """
+    Campioni della sessione in ordine temporale.
+
+    Con limit la risposta JSON e' paginata: contiene blocchi interi di
+    campioni (finestre), fermandosi appena si raggiungono limit campioni e,
+    se ne restano altri, l'header X-Next-Cursor da
+    passare come cursor alla richiesta successiva. Con format=ndjson o
+    format=csv i campioni (dal cursor in poi) vengono inviati in streaming,
+    a blocchi, con memoria costante.
+
+    Con max_points restituisce al massimo max_points campioni scelti per
+    preservare la forma del grafico (method=lttb o method=minmax).
+
+    Le sessioni archiviate (db.archive) sono servite dal file di archivio.
+    """
     db = await get_database()
     sid = ObjectId(session_id)
-    docs = await db.behaviors.find({"session_id": sid}).sort("timestamp", 1).to_list(length=None)
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cursor non valido")
+    session = await db.sessions.find_one({"_id": sid}, {"end_time": 1, "archive": 1}) or {}
+    if after is not None and after["s"] == "archive" and not session.get("archive"):
+        # Sessione ripristinata da db.archive tra due pagine
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cursor non piu' valido")
+
+    if max_points is not None:
+        body = await _downsampled_behaviors(db, sid, session, session_id, max_points, method)
+        return Response(body, media_type="application/json")
+
+    if format != "json":
+        media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+        return StreamingResponse(_stream_behaviors(db, sid, session, session_id, after, format), media_type=media_type)
+
+    results = []
+    headers = {}
+    chunks = _session_chunks(db, sid, session, after)
+    try:
+        async for ts, data, labels, position in chunks:
+            results.extend(_behavior_rows(session_id, ts, data, labels))
+            if limit is not None and len(results) >= limit:
+                # Il cursore solo se resta almeno un altro blocco
+                try:
+                    await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+                headers["X-Next-Cursor"] = encode_cursor(position)
+                break
+    finally:
+        await chunks.aclose()
+    return FastJSONResponse(results, headers=headers)
+
+
+def _behavior_rows(session_id, ts, data, labels):
+    """Campioni come dict con i campi di BehaviorCreate, senza validazione."""
     return [
-      BehaviorCreate(
-        session_id=session_id,
-        timestamp=d["timestamp"],
-        label=d["label"],
-        accelX=d["AccX"],
-        accelY=d["AccY"],
-        accelZ=d["AccZ"],
-        gyroX=d["GyroX"],
-        gyroY=d["GyroY"],
-        gyroZ=d["GyroZ"],
-      )
-      for d in docs
+        {
+            "session_id": session_id,
+            "timestamp": from_epoch_ms(t),
+            "label": label,
+            **dict(zip(_BEHAVIOR_FIELDS, row)),
+        }
+        for t, row, label in zip(ts.tolist(), data.tolist(), labels.tolist())
     ]
 
+
+def _session_chunks(db, sid, session, after):
+    """Blocchi di campioni dall'archivio della sessione, se archiviata, altrimenti da Mongo."""
+    if session.get("archive"):
+        return iter_archive_chunks(session["archive"], sid, after)
+    return iter_session_chunks(db, sid, after)
+
+
+async def _downsampled_behaviors(db, sid, session, session_id, max_points, method):
+    key = (sid, max_points, method)
+    cached = _downsample_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if session.get("archive"):
+        archive = await asyncio.to_thread(open_archive, session["archive"])
+        ts, data, labels = archive.ts, archive.data, archive.labels()
+    else:
+        ts, data, labels = await load_session_samples(db, sid)
+    idx = downsample_indices(ts, data, max_points, method)
+    # Le sessioni concluse non cambiano piu': si tiene in cache il JSON gia' serializzato
+    body = dumps(_behavior_rows(session_id, ts[idx], data[idx], labels[idx]))
+    if session.get("end_time"):
+        _downsample_cache.set(key, body)
+    return body
+
+
+def _iso(ms: int) -> str:
+    return from_epoch_ms(ms).isoformat().replace("+00:00", "Z")
+
+
+async def _stream_behaviors(db, sid, session, session_id, after, format):
+    if format == "csv":
+        yield ("timestamp,label," + ",".join(_BEHAVIOR_FIELDS) + "\n").encode()
+    async for ts, data, labels, _ in _session_chunks(db, sid, session, after):
+        if format == "csv":
+            lines = [
+                f"{_iso(t)},{label},{','.join(map(str, row))}\n"
+                for t, row, label in zip(ts.tolist(), data, labels)
+            ]
+        else:
+            lines = [
+                f'{{"session_id":"{session_id}","timestamp":"{_iso(t)}","label":"{label}",'
+                + ",".join(f'"{k}":{v!s}' for k, v in zip(_BEHAVIOR_FIELDS, row))
+                + "}\n"
+                for t, row, label in zip(ts.tolist(), data, labels)
+            ]
+        yield "".join(lines).encode()
+
 @router.get("/{session_id}", response_model=SessionResp)
 async def get_session_detail(
     session_id: str,
@@ -159,29 +350,23 @@ async def get_session_detail(
         maintenance_urgency=doc.get("maintenance_urgency"),
     )
 
-async def _predict_maintenance(db, session_doc, behs):
+async def _predict_maintenance(db, session_doc, summary):
     count_agg = session_doc.get("count_aggressive", 0)
     count_nor = session_doc.get("count_normal", 0)
     count_slo = session_doc.get("count_slow", 0)
     duration_minutes = (session_doc["end_time"] - session_doc["start_time"]).total_seconds() / 60.0
 
-    acc_mags = [np.sqrt(b["AccX"]**2 + b["AccY"]**2 + b["AccZ"]**2) for b in behs]
-    gyro_mags = [np.sqrt(b["GyroX"]**2 + b["GyroY"]**2 + b["GyroZ"]**2) for b in behs]
-
-    accel_mag_mean = float(np.mean(acc_mags)) if acc_mags else 0.0
-    accel_mag_std  = float(np.std(acc_mags))  if acc_mags else 0.0
-    gyro_mag_mean  = float(np.mean(gyro_mags)) if gyro_mags else 0.0
-    gyro_mag_std   = float(np.std(gyro_mags))  if gyro_mags else 0.0
-
-    X = pd.DataFrame([{
-        "count_aggressive": count_agg,
-        "count_normal": count_nor,
-        "count_slow": count_slo,
-        "duration_minutes": duration_minutes,
-        "accel_mag_mean": accel_mag_mean,
-        "accel_mag_std": accel_mag_std,
-        "gyro_mag_mean": gyro_mag_mean,
-        "gyro_mag_std": gyro_mag_std
-    }])
-    pred = _maint_model.predict(X)[0]
-    return float(pred)
\ No newline at end of file
+    accel_mag_mean, accel_mag_std, gyro_mag_mean, gyro_mag_std = magnitude_moments(summary)
+
+    # La predict gira nel pool di inferenza, fuori dall'event loop
+    return await inference_executor.run(
+        predict_maintenance,
+        count_agg,
+        count_nor,
+        count_slo,
+        duration_minutes,
+        accel_mag_mean,
+        accel_mag_std,
+        gyro_mag_mean,
+        gyro_mag_std,
+    )
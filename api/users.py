@@ -4,15 +4,27 @@ from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException, status
 
 from api.dependencies import get_current_user
+from core.responses import FastJSONResponse
 from db.mongodb import get_database
-from models.session_model import SessionResp
-from models.user_model import UserPublic
+from models.session_model import SessionResp, session_row
+from models.user_model import UserPublic, user_row
 
 router = APIRouter(
     prefix="/api/users",
     tags=["users"]
 )
 
+# Solo i campi di SessionResp: i documenti di sessione hanno anche gli aggregati
+_SESSION_PROJECTION = {
+    "user_id": 1,
+    "start_time": 1,
+    "end_time": 1,
+    "count_aggressive": 1,
+    "count_normal": 1,
+    "count_slow": 1,
+    "maintenance_urgency": 1,
+}
+
 @router.get("/", response_model=List[UserPublic])
 async def list_users(_current_user: UserPublic = Depends(get_current_user)):
     db = await get_database()
@@ -30,19 +42,9 @@ async def list_users(_current_user: UserPublic = Depends(get_current_user)):
 
     cursor = db.users.find(query, projection)
 
-    users: List[UserPublic] = []
-    async for u in cursor:
-        users.append(
-            UserPublic(
-                id=str(u["_id"]),
-                email=u["email"],
-                full_name=u["full_name"],
-                registration_date=u["registration_date"],
-                maintenance_urgency=u.get("maintenance_urgency")
-            )
-        )
-
-    return users
+    # Dati letti dal DB: serializzati direttamente, senza un UserPublic per riga
+    users = [user_row(u) async for u in cursor]
+    return FastJSONResponse(users)
 
 @router.get("/{user_id}/sessions", response_model=List[SessionResp])
 async def list_user_sessions(
@@ -58,17 +60,6 @@ async def list_user_sessions(
             detail="user_id non valido"
         )
 
-    cursor = db.sessions.find({"user_id": uid}).sort("start_time", 1)
-    sessions: List[SessionResp] = []
-    async for doc in cursor:
-        sessions.append(SessionResp(
-            id=str(doc["_id"]),
-            user_id=str(doc["user_id"]),
-            start_time=doc["start_time"],
-            end_time=doc.get("end_time"),
-            count_aggressive=doc.get("count_aggressive"),
-            count_normal=doc.get("count_normal"),
-            count_slow=doc.get("count_slow"),
-            maintenance_urgency=doc.get("maintenance_urgency"),
-        ))
-    return sessions
\ No newline at end of file
+    cursor = db.sessions.find({"user_id": uid}, _SESSION_PROJECTION).sort("start_time", 1)
+    sessions = [session_row(doc) async for doc in cursor]
+    return FastJSONResponse(sessions)
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark dell'estrazione feature per finestra.
+
+Confronta l'implementazione NumPy di core.features con quella originale
+basata su pandas, verificando prima la parita' delle feature e delle
+predizioni del modello.
+
+    python -m benchmarks.bench_features [--windows 2000] [--len 20]
+"""
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from core.features import SENSOR_COLUMNS, extract_features_from_window
+
+
+def pandas_reference(window):
+    df = pd.DataFrame(window)
+
+    df["Acc_Mag"] = np.sqrt(df["AccX"]**2 + df["AccY"]**2 + df["AccZ"]**2)
+    df["Gyro_Mag"] = np.sqrt(df["GyroX"]**2 + df["GyroY"]**2 + df["GyroZ"]**2)
+
+    cols = ["AccX", "AccY", "AccZ", "GyroX", "GyroY", "GyroZ", "Acc_Mag", "Gyro_Mag"]
+    features = []
+
+    for col in cols:
+        arr = df[col].values
+        features.extend([
+            arr.mean(),
+            arr.std(),
+            arr.min(),
+            arr.max()
+        ])
+    return features
+
+
+def random_window(rng, n):
+    acc = rng.normal(0.0, 0.3, size=(n, 3)) + [0.0, 0.0, 1.0]
+    gyro = rng.normal(0.0, 20.0, size=(n, 3))
+    values = np.hstack([acc, gyro])
+    return [
+        {"timestamp": 1_700_000_000_000 + i * 500, **dict(zip(SENSOR_COLUMNS, map(float, row)))}
+        for i, row in enumerate(values)
+    ]
+
+
+def check_parity(windows, model_path=None):
+    ref = np.array([pandas_reference(w) for w in windows])
+    new = np.array([extract_features_from_window(w) for w in windows])
+    max_err = float(np.max(np.abs(ref - new)))
+    assert np.allclose(ref, new, rtol=1e-12, atol=1e-12), f"feature diverse (max err {max_err})"
+    print(f"parita' feature: ok (max abs err {max_err:.3e})")
+
+    if model_path:
+        import joblib
+        model = joblib.load(model_path)["model"]
+        assert (model.predict(ref) == model.predict(new)).all(), "predizioni diverse"
+        print("parita' predizioni: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=int, default=2000)
+    parser.add_argument("--len", type=int, default=20, dest="window_len")
+    parser.add_argument("--model", default="ml_models/rf_driving_behavior_windows.joblib")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    windows = [random_window(rng, args.window_len) for _ in range(args.windows)]
+
+    check_parity(windows, args.model)
+
+    for name, fn in (("pandas", pandas_reference), ("numpy", extract_features_from_window)):
+        elapsed = min(timeit.repeat(lambda: [fn(w) for w in windows], number=1, repeat=3))
+        print(f"{name:>7}: {elapsed / len(windows) * 1e6:8.1f} us/finestra")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Micro-benchmark dell'inferenza Random Forest: sklearn contro la foresta
+compilata di core.forest, a parita' di input. Prima dei tempi verifica che
+le predizioni coincidano.
+
+    python -m benchmarks.bench_forest [--batch 1 8 64 256] [--repeat 50]
+"""
+import argparse
+import timeit
+
+import joblib
+
+from core.forest import FlatForest, _probe_inputs, compile_forest, compiled_path, load_compiled, verify
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="ml_models/rf_driving_behavior_windows.joblib")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    sk_model = joblib.load(args.model)["model"]
+    try:
+        flat, _ = load_compiled(compiled_path(args.model), mmap_mode="r")
+        compiled = {"arrays": {k: getattr(flat, k) for k in ("feature", "threshold")},
+                    "meta": flat.meta}
+    except FileNotFoundError:
+        compiled = compile_forest(sk_model)
+        flat = FlatForest(compiled["arrays"], compiled["meta"])
+
+    X = _probe_inputs(compiled, max(args.batch) * 4)
+    verify(sk_model, flat, X)
+    print(f"Parita' predizioni OK su {len(X)} input")
+
+    print(f"{'batch':>6} {'sklearn (ms)':>14} {'compilata (ms)':>16} {'speedup':>8}")
+    for size in args.batch:
+        xb = X[:size]
+        t_sk = timeit.timeit(lambda: sk_model.predict(xb), number=args.repeat) / args.repeat
+        t_flat = timeit.timeit(lambda: flat.predict(xb), number=args.repeat) / args.repeat
+        print(f"{size:>6} {t_sk * 1e3:>14.3f} {t_flat * 1e3:>16.3f} {t_sk / t_flat:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Micro-benchmark della serializzazione delle liste: percorso pydantic
+(un modello per riga, validazione del response_model e JSONResponse)
+contro il percorso veloce di core.responses (dict proiettati e orjson).
+Prima dei tempi verifica che i due percorsi producano lo stesso JSON
+(a meno della notazione dei float, es. 7.9e-05 contro 0.000079).
+
+    python -m benchmarks.bench_responses [--rows 1000 10000 100000]
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import numpy as np
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from core.responses import dumps
+from db.behavior_store import from_epoch_ms
+from models.behavior_model import BehaviorCreate
+from models.session_model import SessionResp, session_row
+from models.user_model import UserPublic, user_row
+
+_BEHAVIOR_FIELDS = ["accelX", "accelY", "accelZ", "gyroX", "gyroY", "gyroZ"]
+
+
+def make_users(n, rng):
+    base = datetime(2024, 1, 1)
+    return [{
+        "_id": ObjectId(),
+        "email": f"user{i}@example.com",
+        "full_name": f"Utente {i}",
+        "registration_date": base + timedelta(seconds=int(rng.integers(0, 10**7)), microseconds=int(rng.integers(0, 10**6))),
+        "maintenance_urgency": float(rng.random()) if i % 3 else None,
+    } for i in range(n)]
+
+
+def make_sessions(n, rng):
+    base = datetime(2024, 1, 1)
+    uid = ObjectId()
+    docs = []
+    for i in range(n):
+        start = base + timedelta(minutes=i * 30, microseconds=int(rng.integers(0, 10**6)))
+        docs.append({
+            "_id": ObjectId(),
+            "user_id": uid,
+            "start_time": start,
+            "end_time": start + timedelta(minutes=20) if i % 10 else None,
+            "count_aggressive": int(rng.integers(0, 500)),
+            "count_normal": int(rng.integers(0, 500)),
+            "count_slow": int(rng.integers(0, 500)),
+            "maintenance_urgency": float(rng.random()),
+        })
+    return docs
+
+
+def make_behaviors(n, rng):
+    ts = 1_700_000_000_000 + np.arange(n, dtype=np.int64) * 500
+    data = rng.normal(size=(n, 6)).astype(np.float32)
+    labels = np.array(["SLOW", "NORMAL", "AGGRESSIVE"], dtype=object)[rng.integers(0, 3, n)]
+    return ts, data, labels
+
+
+def pydantic_path(model, rows) -> bytes:
+    """Come FastAPI con response_model: validazione, serializzazione, JSONResponse."""
+    field = create_model_field(name="Response", type_=List[model], mode="serialization")
+    content = asyncio.run(serialize_response(field=field, response_content=rows))
+    return JSONResponse(content).body
+
+
+def scenarios(n, rng):
+    users = make_users(n, rng)
+    sessions = make_sessions(n, rng)
+    ts, data, labels = make_behaviors(n, rng)
+    sid = str(ObjectId())
+
+    yield (
+        "list_users",
+        lambda: pydantic_path(UserPublic, [UserPublic(**user_row(u)) for u in users]),
+        lambda: dumps([user_row(u) for u in users]),
+    )
+    yield (
+        "list_user_sessions",
+        lambda: pydantic_path(SessionResp, [SessionResp(**session_row(d)) for d in sessions]),
+        lambda: dumps([session_row(d) for d in sessions]),
+    )
+    yield (
+        "get_behaviors",
+        lambda: pydantic_path(BehaviorCreate, [
+            BehaviorCreate(
+                session_id=sid,
+                timestamp=from_epoch_ms(t),
+                label=label,
+                **dict(zip(_BEHAVIOR_FIELDS, map(float, row))),
+            )
+            for t, row, label in zip(ts.tolist(), data, labels)
+        ]),
+        lambda: dumps([
+            {"session_id": sid, "timestamp": from_epoch_ms(t), "label": label, **dict(zip(_BEHAVIOR_FIELDS, row))}
+            for t, row, label in zip(ts.tolist(), data.tolist(), labels.tolist())
+        ]),
+    )
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'endpoint':<20} {'righe':>7} {'pydantic (ms)':>14} {'orjson (ms)':>12} {'speedup':>8}")
+    for n in args.rows:
+        for name, slow, fast in scenarios(n, rng):
+            t_slow, ref = timed(slow, args.repeat)
+            t_fast, out = timed(fast, args.repeat)
+            assert json.loads(ref) == json.loads(out), f"{name}: output diverso dal percorso pydantic"
+            print(f"{name:<20} {n:>7} {t_slow * 1e3:>14.1f} {t_fast * 1e3:>12.1f} {t_slow / t_fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
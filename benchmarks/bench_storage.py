@@ -0,0 +1,156 @@
+"""
+Confronto dei formati di archiviazione dei campioni:
+  - legacy:     un documento per campione nella collection normale behaviors;
+  - windows:    un documento per finestra in behavior_windows (default);
+  - timeseries: un documento per campione nella time-series collection
+                behavior_samples (BEHAVIOR_STORAGE=timeseries).
+
+Per ciascuno misura spazio su disco (dati + indici), throughput di
+inserimento e velocita' di lettura di una sessione intera (range scan usato
+da get_behaviors e dal downsampling). Ogni formato usa un database a parte.
+
+    python -m benchmarks.bench_storage [--mongo mongod|mongodb://...] [--sessions 20] [--samples 7200]
+
+Serve un mongod >= 5.0 (time-series collection): mongomock non e' supportato.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+
+from benchmarks import mongo_standin
+from benchmarks.synthetic import SensorStream
+from core.features import SENSOR_COLUMNS
+from db.behavior_store import (
+    LEGACY_COLLECTION,
+    TIMESERIES_COLLECTION,
+    WINDOWS_COLLECTION,
+    encode_window,
+    ensure_timeseries_collection,
+    from_epoch_ms,
+    load_session_samples,
+    window_to_samples,
+)
+from db.indexes import INDEXES
+from db.mongodb import get_database
+
+SAMPLING_RATE = 2
+WINDOW_LEN = 20
+_LABELS = np.array(["SLOW", "NORMAL", "AGGRESSIVE"], dtype=object)
+
+
+def make_sessions(n_sessions, n_samples, seed=0):
+    """(session_id, finestre (timestamp, campioni, label)) per ogni sessione."""
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for i in range(n_sessions):
+        stream = SensorStream(SAMPLING_RATE, seed=seed + i, start_ms=1_700_000_000_000 + i * 86_400_000)
+        windows = []
+        for _ in range(n_samples // WINDOW_LEN):
+            ts, data = stream.next(WINDOW_LEN)
+            windows.append((ts, data, _LABELS[rng.integers(0, 3)]))
+        sessions.append((ObjectId(), windows))
+    return sessions
+
+
+def legacy_docs(sid, windows):
+    return [
+        {"session_id": sid, "timestamp": from_epoch_ms(t), "label": label, **dict(zip(SENSOR_COLUMNS, row))}
+        for ts, data, label in windows
+        for t, row in zip(ts.tolist(), data.astype(np.float32).tolist())
+    ]
+
+
+def window_docs(sid, windows):
+    return [encode_window(sid, ts, data, label) for ts, data, label in windows]
+
+
+def timeseries_docs(sid, windows):
+    return [sample for doc in window_docs(sid, windows) for sample in window_to_samples(doc)]
+
+
+LAYOUTS = {
+    "legacy": (LEGACY_COLLECTION, legacy_docs),
+    "windows": (WINDOWS_COLLECTION, window_docs),
+    "timeseries": (TIMESERIES_COLLECTION, timeseries_docs),
+}
+
+
+async def _storage(db, collection):
+    stats = await db.command("collStats", collection)
+    return stats.get("storageSize", 0), stats.get("totalIndexSize", 0)
+
+
+async def bench_layout(client, layout, sessions, batch):
+    collection, to_docs = LAYOUTS[layout]
+    db = client[f"bench_storage_{layout}"]
+    await client.drop_database(db.name)
+    if layout == "timeseries":
+        await ensure_timeseries_collection(db, SAMPLING_RATE)
+        await db[collection].create_indexes([
+            IndexModel([("meta.session_id", ASCENDING), ("timestamp", ASCENDING)], name="meta_session_id_timestamp"),
+        ])
+    else:
+        await db[collection].create_indexes(INDEXES[collection])
+
+    docs = [to_docs(sid, windows) for sid, windows in sessions]
+    n_samples = sum(len(ts) for _, windows in sessions for ts, _, _ in windows)
+    start = time.perf_counter()
+    for session_docs in docs:
+        for i in range(0, len(session_docs), batch):
+            await db[collection].insert_many(session_docs[i:i + batch], ordered=False)
+    insert_s = time.perf_counter() - start
+
+    # Checkpoint: le statistiche riflettono i dati compressi su disco
+    await client.admin.command("fsync")
+    storage, indexes = await _storage(db, collection)
+
+    start = time.perf_counter()
+    for sid, _ in sessions:
+        ts, _, _ = await load_session_samples(db, sid)
+    scan_s = (time.perf_counter() - start) / len(sessions)
+    assert len(ts) == n_samples // len(sessions)
+
+    await client.drop_database(db.name)
+    return {
+        "samples": n_samples,
+        "insert_per_s": n_samples / insert_s,
+        "storage_mb": storage / 2**20,
+        "index_mb": indexes / 2**20,
+        "bytes_per_sample": (storage + indexes) / n_samples,
+        "scan_ms": scan_s * 1e3,
+    }
+
+
+async def run(args):
+    backend = mongo_standin.install(args.mongo)
+    if backend == "mongomock":
+        raise SystemExit("Serve un mongod (--mongo mongod o un URI): mongomock non ha le time-series collection")
+    client = (await get_database()).client
+    sessions = make_sessions(args.sessions, args.samples)
+    print(f"backend {backend}: {args.sessions} sessioni x {args.samples} campioni")
+    print(f"{'formato':<11} {'ins/s':>10} {'dati MB':>8} {'indici MB':>9} {'B/campione':>10} {'scan/sessione ms':>17}")
+    for layout in args.layouts:
+        r = await bench_layout(client, layout, sessions, args.batch)
+        print(
+            f"{layout:<11} {r['insert_per_s']:>10.0f} {r['storage_mb']:>8.2f} {r['index_mb']:>9.2f} "
+            f"{r['bytes_per_sample']:>10.1f} {r['scan_ms']:>17.1f}"
+        )
+    mongo_standin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", default="mongod", help="mongod (istanza effimera) o URI")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=7200, help="campioni per sessione (7200 = 1 ora a 2 Hz)")
+    parser.add_argument("--batch", type=int, default=1000, help="documenti per insert_many")
+    parser.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Load test dei percorsi caldi: ingestione WebSocket e route REST della dashboard.
+
+Per ogni veicolo simulato il test registra un utente, apre una sessione,
+invia finestre sintetiche (benchmarks.synthetic) sul WebSocket misurando il
+tempo fino alla predizione, poi chiude la sessione. Segue una serie di
+scenari REST della dashboard. Per ogni scenario riporta throughput e
+latenze p50/p95/p99 e salva i risultati in JSON per confrontare i run.
+
+    python -m benchmarks.loadtest [--vehicles 20] [--windows 50] [--binary]
+    python -m benchmarks.loadtest --url http://localhost:8000   # server gia' avviato
+    python -m benchmarks.loadtest --compare vecchio.json nuovo.json
+
+Senza --url l'app gira in questo processo (uvicorn su una porta libera) con
+il Mongo scelto da --mongo: mongomock (default), mongod effimero o un URI.
+Richiede httpx e, per il default, mongomock-motor.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.synthetic import SensorStream
+from core.protocol import BINARY_SUBPROTOCOL
+
+ADMIN_EMAIL = "admin@admin.com"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class Recorder:
+    """Latenze ed errori per scenario."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.last_error: Dict[str, str] = {}
+        self.elapsed: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.latencies[name].append(seconds)
+
+    def error(self, name: str, exc: Optional[BaseException] = None) -> None:
+        self.errors[name] += 1
+        if exc is not None:
+            self.last_error[name] = f"{type(exc).__name__}: {exc}"
+
+    def summary(self) -> Dict[str, dict]:
+        out = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            lat = np.asarray(self.latencies[name]) * 1e3
+            elapsed = self.elapsed.get(name)
+            out[name] = {
+                "count": int(len(lat)),
+                "errors": self.errors[name],
+                "throughput_per_sec": len(lat) / elapsed if elapsed else None,
+                "mean_ms": float(lat.mean()) if len(lat) else None,
+                **{
+                    f"p{q}_ms": float(np.percentile(lat, q)) if len(lat) else None
+                    for q in (50, 95, 99)
+                },
+                "max_ms": float(lat.max()) if len(lat) else None,
+                "last_error": self.last_error.get(name),
+            }
+        return out
+
+
+async def _timed(rec: Recorder, name: str, coro):
+    start = time.perf_counter()
+    try:
+        result = await coro
+    except Exception as exc:
+        rec.error(name, exc)
+        return None
+    rec.add(name, time.perf_counter() - start)
+    return result
+
+
+async def _register(client, rec: Recorder, email: str, full_name: str) -> Optional[dict]:
+    async def call():
+        r = await client.post("/api/auth/register", json={"email": email, "password": "benchmark", "full_name": full_name})
+        if r.status_code == 400:
+            r = await client.post("/api/auth/login", json={"email": email, "password": "benchmark"})
+        r.raise_for_status()
+        return r.json()
+    return await _timed(rec, "auth_register", call())
+
+
+async def _vehicle(client, ws_url: str, rec: Recorder, index: int, args, sampling_rate: float, window_len: int):
+    auth = await _register(client, rec, f"vehicle{index}-{args.run_id}@example.com", f"Veicolo {index}")
+    if auth is None:
+        return None
+    headers = {"Authorization": f"Bearer {auth['access_token']}"}
+
+    async def start():
+        r = await client.post("/api/sessions/", json={}, headers=headers)
+        r.raise_for_status()
+        return r.json()["id"]
+    session_id = await _timed(rec, "start_session", start())
+    if session_id is None:
+        return None
+
+    import websockets
+    stream = SensorStream(sampling_rate, seed=index)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    subprotocols = [BINARY_SUBPROTOCOL] if args.binary else None
+    try:
+        async with websockets.connect(ws_url, subprotocols=subprotocols) as ws:
+            for _ in range(args.windows):
+                message = (
+                    stream.binary_frame(session_id, window_len) if args.binary
+                    else json.dumps(stream.json_message(session_id, window_len))
+                )
+                start_t = time.perf_counter()
+                await ws.send(message)
+                try:
+                    await asyncio.wait_for(ws.recv(), timeout=args.timeout)
+                except asyncio.TimeoutError:
+                    rec.error("ws_window")
+                    continue
+                took = time.perf_counter() - start_t
+                rec.add("ws_window", took)
+                if interval > took:
+                    await asyncio.sleep(interval - took)
+    except Exception as exc:
+        rec.error("ws_connection", exc)
+
+    async def stop():
+        r = await client.patch("/api/sessions/stop", json={"session_id": session_id}, headers=headers)
+        r.raise_for_status()
+    await _timed(rec, "stop_session", stop())
+    return auth["user"]["id"], session_id, headers
+
+
+def _rest_scenarios(vehicles, admin_headers) -> Dict[str, Callable[[int], tuple]]:
+    """Nome -> funzione che, dato un indice, restituisce (path, headers)."""
+    def pick(i):
+        return vehicles[i % len(vehicles)]
+    return {
+        "GET avg_behavior_by_user": lambda i: ("/api/report/avg_behavior_by_user", admin_headers),
+        "GET users": lambda i: ("/api/users/", admin_headers),
+        "GET user sessions": lambda i: (f"/api/users/{pick(i)[0]}/sessions", admin_headers),
+        "GET sessions": lambda i: ("/api/sessions/", pick(i)[2]),
+        "GET behaviors page": lambda i: (f"/api/sessions/{pick(i)[1]}/behaviors?limit=1000", pick(i)[2]),
+        "GET behaviors downsampled": lambda i: (f"/api/sessions/{pick(i)[1]}/behaviors?max_points=500", pick(i)[2]),
+        "GET rollups fleet": lambda i: ("/api/report/rollups?granularity=hour&fleet=true", admin_headers),
+    }
+
+
+async def _run_rest(client, rec: Recorder, name: str, target: Callable[[int], tuple], requests: int, concurrency: int):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        path, headers = target(i)
+        async with slots:
+            async def call():
+                r = await client.get(path, headers=headers)
+                r.raise_for_status()
+            await _timed(rec, name, call())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    rec.elapsed[name] = time.perf_counter() - start
+
+
+async def run(base_url: str, args) -> Dict[str, dict]:
+    import httpx
+
+    from core.registry import BEHAVIOR_MODEL, model_registry
+    bundle = model_registry.get(BEHAVIOR_MODEL).bundle
+    sampling_rate = bundle["sampling_rate"]
+    window_len = sampling_rate * bundle["window_duration_sec"]
+
+    rec = Recorder()
+    ws_url = base_url.replace("http", "ws", 1) + "/api/behavior/"
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        admin = await _register(client, rec, ADMIN_EMAIL, "admin")
+        if admin is None:
+            raise RuntimeError("Login dell'amministratore non riuscito")
+        admin_headers = {"Authorization": f"Bearer {admin['access_token']}"}
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            _vehicle(client, ws_url, rec, i, args, sampling_rate, window_len) for i in range(args.vehicles)
+        ))
+        ingest_elapsed = time.perf_counter() - start
+        for name in ("ws_window", "auth_register", "start_session", "stop_session"):
+            rec.elapsed[name] = ingest_elapsed
+
+        vehicles = [v for v in results if v is not None]
+        if vehicles:
+            for name, target in _rest_scenarios(vehicles, admin_headers).items():
+                await _run_rest(client, rec, name, target, args.rest_requests, args.concurrency)
+    return rec.summary()
+
+
+async def _serve_in_process(args):
+    """Avvia l'app con uvicorn in questo processo e restituisce (server, task, url)."""
+    import uvicorn
+
+    from benchmarks import mongo_standin
+    args.mongo_backend = mongo_standin.install(args.mongo)
+
+    from main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_table(results: Dict[str, dict]) -> None:
+    print(f"{'scenario':<28} {'n':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        def fmt(v, spec):
+            return format(v, spec) if v is not None else "-"
+        print(
+            f"{name:<28} {r['count']:>6} {r['errors']:>4} {fmt(r['throughput_per_sec'], '>8.1f')} "
+            f"{fmt(r['p50_ms'], '>8.2f')} {fmt(r['p95_ms'], '>8.2f')} {fmt(r['p99_ms'], '>8.2f')}"
+        )
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'scenario':<28} {'p50':>18} {'p95':>18} {'req/s':>18}")
+    for name in sorted(set(old) & set(new)):
+        cells = []
+        for key in ("p50_ms", "p95_ms", "throughput_per_sec"):
+            a, b = old[name][key], new[name][key]
+            if a and b:
+                cells.append(f"{a:8.2f}->{b:8.2f}" + f" ({(b - a) / a * 100:+.0f}%)")
+            else:
+                cells.append("-")
+        print(f"{name:<28} " + " ".join(f"{c:>18}" for c in cells))
+
+
+async def _main(args) -> None:
+    server = task = None
+    if args.url:
+        base_url, args.mongo_backend = args.url.rstrip("/"), "esterno"
+    else:
+        server, task, base_url = await _serve_in_process(args)
+    try:
+        results = await run(base_url, args)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await task
+
+    _print_table(results)
+    for name, r in results.items():
+        if r["last_error"]:
+            print(f"{name}: ultimo errore {r['last_error']}")
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "target": args.url or "in-process",
+                "mongo": args.mongo_backend,
+                "args": {k: v for k, v in vars(args).items() if k not in ("compare", "mongo_backend")},
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"Risultati salvati in {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server gia' avviato (default: app in-process)")
+    parser.add_argument("--mongo", default="mongomock", help="mongomock, mongod o un URI (solo in-process)")
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--windows", type=int, default=50, help="finestre per veicolo")
+    parser.add_argument("--rate", type=float, default=0.0, help="finestre/s per veicolo (0 = appena arriva la risposta)")
+    parser.add_argument("--binary", action="store_true", help="frame binari invece di JSON")
+    parser.add_argument("--rest-requests", type=int, default=100, help="richieste per scenario REST")
+    parser.add_argument("--concurrency", type=int, default=10, help="richieste REST in parallelo")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--out", help="file JSON dei risultati (default: benchmarks/results/<data>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("VECCHIO", "NUOVO"), help="confronta due risultati salvati")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    # Utenti distinti per run, anche contro un server con dati di run precedenti
+    args.run_id = uuid.uuid4().hex[:8]
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
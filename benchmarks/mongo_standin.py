@@ -0,0 +1,119 @@
+"""
+Mongo locale per benchmark e load test, senza server esterno.
+
+install() sostituisce il client di db.mongodb prima che l'app lo crei:
+  - "mongomock": database in memoria (mongomock-motor), con adattamenti
+    per cio' che mongomock non implementa: bulk_write con le UpdateOne di
+    pymongo 4.x, lo stage $merge e l'operatore $round delle aggregazioni;
+  - "mongod": avvia un mongod effimero (binario nel PATH) su una directory
+    temporanea e una porta libera, fermato da stop();
+  - un URI mongodb://...: usa quel server.
+
+I numeri ottenuti con mongomock misurano l'app, non Mongo: confrontare solo
+run con lo stesso backend.
+"""
+import atexit
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from typing import Optional
+
+import db.mongodb as mongodb
+
+_mongod: Optional[subprocess.Popen] = None
+
+
+def _patch_mongomock() -> None:
+    from mongomock.collection import Collection
+    from mongomock_motor import AsyncMongoMockCollection
+    from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+
+    async def bulk_write(self, requests, ordered=True, **_kwargs):
+        for op in requests:
+            if isinstance(op, InsertOne):
+                await self.insert_one(op._doc)
+            elif isinstance(op, UpdateOne):
+                await self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
+            elif isinstance(op, ReplaceOne):
+                await self.replace_one(op._filter, op._doc, upsert=bool(op._upsert))
+            elif isinstance(op, DeleteOne):
+                await self.delete_one(op._filter)
+            else:
+                raise NotImplementedError(type(op).__name__)
+
+    aggregate = Collection.aggregate
+
+    def aggregate_with_merge(self, pipeline, session=None, **kwargs):
+        pipeline = _without_round(pipeline)
+        if pipeline and "$merge" in pipeline[-1]:
+            target = self.database[pipeline[-1]["$merge"]["into"]]
+            for doc in aggregate(self, pipeline[:-1], session, **kwargs):
+                target.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            return aggregate(self, [{"$match": {"_id": {"$exists": False}}}], session)
+        return aggregate(self, pipeline, session, **kwargs)
+
+    AsyncMongoMockCollection.bulk_write = bulk_write
+    Collection.aggregate = aggregate_with_merge
+
+
+def _without_round(expr):
+    """mongomock non conosce $round: l'espressione resta non arrotondata."""
+    if isinstance(expr, dict):
+        if set(expr) == {"$round"}:
+            return _without_round(expr["$round"][0])
+        return {k: _without_round(v) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [_without_round(v) for v in expr]
+    return expr
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_mongod() -> str:
+    global _mongod
+    binary = shutil.which("mongod")
+    if binary is None:
+        raise RuntimeError("mongod non trovato nel PATH")
+    dbpath = tempfile.mkdtemp(prefix="drivemood-bench-")
+    port = _free_port()
+    _mongod = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    atexit.register(stop)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return f"mongodb://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("mongod non raggiungibile")
+
+
+def install(backend: str = "mongomock") -> str:
+    """Configura il client Mongo dell'app; restituisce una descrizione del backend."""
+    if backend == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+        _patch_mongomock()
+        mongodb._client = AsyncMongoMockClient()
+        return "mongomock"
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    uri = _start_mongod() if backend == "mongod" else backend
+    mongodb._client = AsyncIOMotorClient(uri)
+    return uri
+
+
+def stop() -> None:
+    global _mongod
+    if _mongod is not None:
+        _mongod.terminate()
+        _mongod.wait(timeout=10)
+        _mongod = None
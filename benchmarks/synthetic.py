@@ -0,0 +1,76 @@
+"""
+Generatore di stream sensoriali sintetici simili a quelli del Thingy:52:
+accelerometro in g con la gravita' sull'asse Z e giroscopio in gradi/s,
+con rumore correlato nel tempo (AR(1)) di ampiezza dipendente dallo stile
+di guida. Serve ai benchmark e al load test, non all'addestramento.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from core.features import SENSOR_COLUMNS
+from core.protocol import encode_frame
+
+# Deviazione standard di accelerazione (g) e velocita' angolare (gradi/s) per stile
+STYLES = {
+    "SLOW": (0.04, 4.0),
+    "NORMAL": (0.12, 12.0),
+    "AGGRESSIVE": (0.40, 40.0),
+}
+# Correlazione tra campioni consecutivi del rumore
+_AR_COEF = 0.8
+
+
+class SensorStream:
+    """Stream di un veicolo: ogni chiamata a next() continua dal campione precedente."""
+
+    def __init__(
+        self,
+        sampling_rate: float,
+        style: str = "NORMAL",
+        seed: Optional[int] = None,
+        start_ms: int = 1_700_000_000_000,
+        switch_prob: float = 0.05,
+    ):
+        self.period_ms = 1000.0 / sampling_rate
+        self.style = style
+        self.switch_prob = switch_prob
+        self._rng = np.random.default_rng(seed)
+        self._t = float(start_ms)
+        self._state = np.zeros(6)
+
+    def next(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(timestamp ms (n,), campioni (n, 6)) con le colonne di SENSOR_COLUMNS."""
+        # Ogni tanto il veicolo cambia stile di guida
+        if self._rng.random() < self.switch_prob:
+            self.style = self._rng.choice(list(STYLES))
+        acc_std, gyro_std = STYLES[self.style]
+        scale = np.array([acc_std] * 3 + [gyro_std] * 3)
+        innovation_std = scale * np.sqrt(1 - _AR_COEF ** 2)
+
+        data = np.empty((n, 6))
+        state = self._state
+        for i in range(n):
+            state = _AR_COEF * state + self._rng.normal(size=6) * innovation_std
+            data[i] = state
+        self._state = state
+        data[:, 2] += 1.0
+
+        ts = (self._t + np.arange(n) * self.period_ms).astype(np.int64)
+        self._t += n * self.period_ms
+        return ts, data
+
+    def json_message(self, session_id: str, n: int, kind: str = "window") -> dict:
+        """Messaggio JSON del protocollo WebSocket ("window" o "chunk")."""
+        ts, data = self.next(n)
+        payload: List[dict] = [
+            {"timestamp": int(t), **dict(zip(SENSOR_COLUMNS, row))}
+            for t, row in zip(ts.tolist(), data.tolist())
+        ]
+        return {"type": kind, "session_id": session_id, "payload": payload}
+
+    def binary_frame(self, session_id: str, n: int, flags: int = 0) -> bytes:
+        """Frame binario di core.protocol."""
+        ts, data = self.next(n)
+        return encode_frame(ObjectId(session_id), int(ts[0]), self.period_ms, data, flags)
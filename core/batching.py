@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional, Sequence
+
+from core.metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "1024"))
+
+BATCH_SIZE = Histogram(
+    "inference_batch_size", "Righe per chiamata predict", ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+BATCH_LATENCY = Histogram(
+    "inference_latency_seconds", "Tempo tra submit e risultato disponibile", ["model"],
+)
+PREDICT_TIME = Histogram(
+    "inference_predict_seconds", "Durata della singola predict sul micro-batch", ["model"],
+)
+QUEUE_DEPTH = Gauge("inference_queue_depth", "Richieste in attesa di inferenza", ["model"])
+
+
+class MicroBatcher:
+    """
+    Coda di inferenza condivisa: raccoglie i vettori di feature inviati da
+    tutte le connessioni ed esegue una sola predict per micro-batch, chiusa
+    quando si raggiunge max_batch_size oppure dopo max_wait_ms dal primo
+    elemento.
+
+    predict_fn riceve la lista degli elementi del batch e restituisce un
+    risultato per elemento. Se e' una coroutine function viene attesa
+    (es. per delegarla a un pool di processi), altrimenti gira in un thread
+    per non bloccare l'event loop. Fino a max_inflight batch possono essere
+    in esecuzione contemporaneamente.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List], Sequence],
+        name: str = "default",
+        max_batch_size: int = INFERENCE_BATCH_SIZE,
+        max_wait_ms: float = INFERENCE_MAX_WAIT_MS,
+        max_queue: int = INFERENCE_QUEUE_SIZE,
+        max_inflight: int = 1,
+    ):
+        self.predict_fn = predict_fn
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue = max_queue
+        self.max_inflight = max(1, max_inflight)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._batches = set()
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, x):
+        """Accoda un elemento e attende la relativa predizione."""
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        # Se la coda e' piena l'attesa qui fa da backpressure sul chiamante
+        await self._queue.put((x, fut, time.perf_counter()))
+        QUEUE_DEPTH.set(self._queue.qsize(), model=self.name)
+        return await fut
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for task in list(self._batches):
+            task.cancel()
+        # Le richieste rimaste in coda non riceveranno risposta
+        while self._queue is not None and not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.cancel()
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._inflight.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._inflight.release()
+                raise
+            QUEUE_DEPTH.set(self._queue.qsize(), model=self.name)
+            task = asyncio.create_task(self._execute(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _execute(self, batch: list) -> None:
+        try:
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                return
+
+            items = [x for x, _, _ in batch]
+            BATCH_SIZE.observe(len(batch), model=self.name)
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(self.predict_fn):
+                    results = await self.predict_fn(items)
+                else:
+                    loop = asyncio.get_running_loop()
+                    results = await loop.run_in_executor(None, self.predict_fn, items)
+            except Exception as exc:
+                logger.exception("Errore durante l'inferenza del batch %s", self.name)
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                return
+            done = time.perf_counter()
+            PREDICT_TIME.observe(done - start, model=self.name)
+
+            for (_, fut, enqueued), result in zip(batch, results):
+                BATCH_LATENCY.observe(done - enqueued, model=self.name)
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._inflight.release()
@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from core.metrics import Counter
+
+CACHE_HITS = Counter("cache_hits_total", "Letture servite dalla cache", ["cache"])
+CACHE_MISSES = Counter("cache_misses_total", "Letture non trovate in cache", ["cache"])
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU in-process limitata a maxsize elementi, con scadenza opzionale
+    per elemento. Pensata per l'uso dall'event loop (nessun lock).
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            value, expires = entry
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                CACHE_HITS.inc(cache=self.name)
+                return value
+            del self._data[key]
+        CACHE_MISSES.inc(cache=self.name)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
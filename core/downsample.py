@@ -0,0 +1,76 @@
+"""
+Sottocampionamento delle serie temporali per i grafici.
+
+Entrambi i metodi restituiscono gli indici dei campioni da mantenere, cosi'
+i punti restituiti sono campioni reali con tutti e sei gli assi.
+"""
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: primo e ultimo punto piu', per ciascuno
+    degli n_out - 2 bucket interni, il punto che forma il triangolo di area
+    massima con il punto scelto nel bucket precedente e la media del
+    successivo. Il calcolo delle aree di ogni bucket e' vettorizzato.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.array([0, n - 1])[:max(n_out, 0)]
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Confini dei bucket interni su [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Medie dei bucket calcolate in blocco; l'ultimo "bucket successivo" e' il punto finale
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Indici del minimo e del massimo di y in ciascuno degli n_buckets bucket."""
+    n = len(y)
+    if n_buckets * 2 >= n:
+        return np.arange(n)
+    bucket = (np.arange(n) * n_buckets) // n
+    # Ordinando per (bucket, y) minimo e massimo sono il primo e l'ultimo di ogni bucket
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def downsample_indices(ts: np.ndarray, data: np.ndarray, max_points: int, method: str = "lttb") -> np.ndarray:
+    """
+    Indici ordinati (al massimo max_points) dei campioni da mantenere. La
+    scelta avviene sulle magnitudo di accelerazione e giroscopio, che si
+    dividono a meta' il budget di punti.
+    """
+    n = len(ts)
+    if n <= max_points:
+        return np.arange(n)
+    data = np.asarray(data, dtype=np.float64)
+    mags = np.sqrt(np.square(data).reshape(-1, 2, 3).sum(axis=2))
+    if method == "minmax":
+        # Fino a 4 punti per bucket: min e max di ciascuna magnitudo
+        n_buckets = max(1, max_points // 4)
+        parts = [minmax_indices(mags[:, 0], n_buckets), minmax_indices(mags[:, 1], n_buckets)]
+    else:
+        half = max(3, max_points // 2)
+        x = ts.astype(np.float64)
+        parts = [lttb_indices(x, mags[:, 0], half), lttb_indices(x, mags[:, 1], half)]
+    return np.unique(np.concatenate(parts))[:max_points]
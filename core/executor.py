@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.features import extract_features
+from core.registry import BEHAVIOR_MODEL, MAINTENANCE_MODEL, model_registry
+
+logger = logging.getLogger(__name__)
+
+# 0 = nessun processo dedicato, l'inferenza usa il thread pool dell'event loop
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "256"))
+# "wait": chi arriva oltre INFERENCE_MAX_PENDING attende; "reject": ExecutorBusy immediato
+INFERENCE_BACKPRESSURE = os.getenv("INFERENCE_BACKPRESSURE", "wait")
+
+
+def classify_windows(windows: List[np.ndarray]) -> List[Tuple[str, str]]:
+    """
+    Classifica un batch di finestre. Gira nel worker. Ogni elemento e' una
+    finestra (N, 6), da cui vengono estratte le feature, oppure un vettore
+    di feature gia' calcolato (es. dalle finestre scorrevoli).
+    Restituisce (label, versione del modello) per finestra.
+    """
+    return classify_windows_timed(windows)[0]
+
+
+def classify_windows_timed(windows: List[np.ndarray]) -> Tuple[List[Tuple[str, str]], Dict[str, float]]:
+    """
+    Come classify_windows, con in piu' la durata (s) di estrazione feature e
+    predict del batch: le metriche del worker non sono visibili da /metrics,
+    quindi i tempi vengono restituiti al processo principale.
+    """
+    handle = model_registry.get(BEHAVIOR_MODEL)
+    start = time.perf_counter()
+    X = np.vstack([w if w.ndim == 1 else extract_features(w) for w in windows])
+    features_done = time.perf_counter()
+    mapping = handle.bundle["class_mapping"]
+    results = [(mapping[p], handle.version) for p in handle.model.predict(X)]
+    timings = {"features": features_done - start, "predict": time.perf_counter() - features_done}
+    return results, timings
+
+
+def predict_maintenance(
+    count_aggressive: int,
+    count_normal: int,
+    count_slow: int,
+    duration_minutes: float,
+    accel_mag_mean: float,
+    accel_mag_std: float,
+    gyro_mag_mean: float,
+    gyro_mag_std: float,
+) -> Tuple[float, str]:
+    """
+    Stima l'urgenza di manutenzione dalle feature di sessione. Gira nel
+    worker. Restituisce (urgenza, versione del modello).
+    """
+    handle = model_registry.get(MAINTENANCE_MODEL)
+
+    X = pd.DataFrame([{
+        "count_aggressive": count_aggressive,
+        "count_normal": count_normal,
+        "count_slow": count_slow,
+        "duration_minutes": duration_minutes,
+        "accel_mag_mean": accel_mag_mean,
+        "accel_mag_std": accel_mag_std,
+        "gyro_mag_mean": gyro_mag_mean,
+        "gyro_mag_std": gyro_mag_std,
+    }])
+    return float(handle.model.predict(X)[0]), handle.version
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class InferenceExecutor:
+    """
+    Esegue il lavoro CPU-bound (feature e modelli) fuori dall'event loop, in
+    un pool di processi; ogni processo carica i modelli al primo uso tramite
+    il registro (core.registry).
+    Al massimo max_pending richieste sono in volo; oltre, a seconda della
+    policy, si attende uno slot oppure si solleva ExecutorBusy.
+    """
+
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        max_pending: int = INFERENCE_MAX_PENDING,
+        policy: str = INFERENCE_BACKPRESSURE,
+    ):
+        if policy not in ("wait", "reject"):
+            raise ValueError(f"Policy di backpressure non valida: {policy}")
+        self.workers = max(0, workers)
+        self.max_pending = max(1, max_pending)
+        self.policy = policy
+        self._pool: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_pool(self) -> Optional[Executor]:
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def run(self, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self.policy == "reject" and self._slots.locked():
+            raise ExecutorBusy()
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            pool = self._get_pool()
+            try:
+                return await loop.run_in_executor(pool, partial(fn, *args))
+            except BrokenProcessPool:
+                # Un worker e' morto: il pool verra' ricreato alla prossima richiesta
+                logger.error("Pool di inferenza non piu' utilizzabile, verra' ricreato")
+                if self._pool is pool:
+                    self._pool = None
+                raise
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+inference_executor = InferenceExecutor()
@@ -0,0 +1,44 @@
+from typing import List
+
+import numpy as np
+
+SENSOR_COLUMNS = ["AccX", "AccY", "AccZ", "GyroX", "GyroY", "GyroZ"]
+FEATURE_COLUMNS = SENSOR_COLUMNS + ["Acc_Mag", "Gyro_Mag"]
+N_FEATURES = len(FEATURE_COLUMNS) * 4
+
+
+def window_to_array(window: List[dict]) -> np.ndarray:
+    """
+    Impacchetta la finestra (lista di dict) in un array contiguo (N, 6)
+    con le colonne nell'ordine di SENSOR_COLUMNS.
+    """
+    n = len(window)
+    flat = np.fromiter(
+        (p[c] for p in window for c in SENSOR_COLUMNS),
+        dtype=np.float64,
+        count=n * len(SENSOR_COLUMNS),
+    )
+    return flat.reshape(n, len(SENSOR_COLUMNS))
+
+
+def extract_features(data: np.ndarray) -> np.ndarray:
+    """
+    Calcola le 32 feature attese dal modello a partire da un array (N, 6):
+    per ogni colonna di FEATURE_COLUMNS, nell'ordine, mean, std, min, max.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    full = np.empty((data.shape[0], len(FEATURE_COLUMNS)), dtype=np.float64)
+    full[:, :6] = data
+    # Magnitudo di accelerazione e giroscopio in un'unica riduzione
+    np.sqrt(np.square(data).reshape(-1, 2, 3).sum(axis=2), out=full[:, 6:])
+
+    stats = np.empty((len(FEATURE_COLUMNS), 4), dtype=np.float64)
+    stats[:, 0] = full.mean(axis=0)
+    stats[:, 1] = full.std(axis=0)
+    stats[:, 2] = full.min(axis=0)
+    stats[:, 3] = full.max(axis=0)
+    return stats.ravel()
+
+
+def extract_features_from_window(window: List[dict]) -> np.ndarray:
+    return extract_features(window_to_array(window))
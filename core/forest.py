@@ -0,0 +1,236 @@
+"""
+Compilazione delle Random Forest sklearn in array NumPy piatti e loro
+valutazione vettorizzata, senza sklearn nel processo di serving.
+
+    python -m core.forest ml_models/rf_driving_behavior_windows.joblib
+
+scrive accanto al bundle la directory <nome>.forest/ con un file .npy per
+array e meta.json con i metadati del bundle. Prima di scrivere, le
+predizioni del modello compilato vengono confrontate con quelle di sklearn
+su input casuali costruiti attorno alle soglie degli alberi.
+"""
+import argparse
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from core.files import file_sha256
+
+_ARRAYS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+def compile_forest(estimator) -> dict:
+    """
+    Concatena i nodi di tutti gli alberi in array unici. I figli delle foglie
+    puntano alla foglia stessa, cosi' l'attraversamento puo' fare sempre
+    max_depth passi su tutti gli alberi insieme.
+    """
+    is_classifier = hasattr(estimator, "classes_")
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in estimator.estimators_:
+        t = tree.tree_
+        n = t.node_count
+        idx = np.arange(n) + offset
+        leaf = t.children_left == -1
+        lefts.append(np.where(leaf, idx, t.children_left + offset))
+        rights.append(np.where(leaf, idx, t.children_right + offset))
+        features.append(np.where(leaf, 0, t.feature))
+        thresholds.append(np.where(leaf, np.inf, t.threshold))
+        if is_classifier:
+            v = t.value[:, 0, :]
+            values.append(v / v.sum(axis=1, keepdims=True))
+        else:
+            values.append(t.value[:, 0, :1])
+        roots.append(offset)
+        max_depth = max(max_depth, t.max_depth)
+        offset += n
+
+    arrays = {
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate(thresholds).astype(np.float64),
+        "left": np.concatenate(lefts).astype(np.int32),
+        "right": np.concatenate(rights).astype(np.int32),
+        "value": np.concatenate(values).astype(np.float64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    meta = {
+        "kind": "classifier" if is_classifier else "regressor",
+        "n_features": int(estimator.n_features_in_),
+        "max_depth": int(max_depth),
+        "classes": estimator.classes_.tolist() if is_classifier else None,
+        "feature_names": list(getattr(estimator, "feature_names_in_", [])) or None,
+    }
+    return {"arrays": arrays, "meta": meta}
+
+
+class FlatForest:
+    """Valutatore di una foresta compilata: attraversa tutti gli alberi in blocco."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.max_depth = meta["max_depth"]
+        self.n_features_in_ = meta["n_features"]
+        self.classes_ = np.asarray(meta["classes"]) if meta["classes"] is not None else None
+        self.feature_names = meta.get("feature_names")
+        # Figli interleaved [sinistro, destro] per un solo gather per livello
+        self._children = np.stack([self.left, self.right], axis=1).ravel()
+        self._is_leaf = self.left == np.arange(len(self.left))
+
+    def _as_matrix(self, X) -> np.ndarray:
+        if self.feature_names is not None and hasattr(X, "columns"):
+            X = X[self.feature_names]
+        # Come sklearn, gli input vengono confrontati con le soglie in float32
+        return np.asarray(X, dtype=np.float32).reshape(-1, self.n_features_in_)
+
+    def apply(self, X) -> np.ndarray:
+        """Indici (globali) delle foglie raggiunte, array (n_campioni, n_alberi)."""
+        X = self._as_matrix(X)
+        n, n_trees = len(X), len(self.roots)
+        flat_x = X.astype(np.float64).ravel()
+        # Tutto su array 1-D: meno costoso del fancy indexing 2-D
+        row_offset = np.repeat(np.arange(n) * self.n_features_in_, n_trees)
+        nodes = np.tile(self.roots, n)
+        for depth in range(self.max_depth):
+            x = flat_x.take(row_offset + self.feature.take(nodes))
+            go_right = x > self.threshold.take(nodes)
+            nodes = self._children.take(2 * nodes + go_right)
+            if depth % 4 == 3 and self._is_leaf.take(nodes).all():
+                break
+        return nodes.reshape(n, n_trees)
+
+    def _mean_leaf_value(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        # Somma albero per albero nello stesso ordine di sklearn
+        total = np.zeros((len(leaves), self.value.shape[1]))
+        for t in range(leaves.shape[1]):
+            total += self.value[leaves[:, t]]
+        return total / leaves.shape[1]
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self._mean_leaf_value(X)
+
+    def predict(self, X) -> np.ndarray:
+        values = self._mean_leaf_value(X)
+        if self.classes_ is not None:
+            return self.classes_[values.argmax(axis=1)]
+        return values[:, 0]
+
+
+def compiled_path(bundle_path: str) -> str:
+    return os.path.splitext(bundle_path)[0] + ".forest"
+
+
+def save_compiled(compiled: dict, bundle_meta: dict, out_dir: str, source_sha256: Optional[str] = None) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in compiled["arrays"].items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = dict(compiled["meta"], bundle=bundle_meta, source_sha256=source_sha256)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_compiled(out_dir: str, mmap_mode: Optional[str] = None):
+    """Restituisce (FlatForest, metadati del bundle originale)."""
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in _ARRAYS}
+    meta.pop("source_sha256", None)
+    bundle_meta = meta.pop("bundle", {})
+    if "class_mapping" in bundle_meta:
+        # JSON ha solo chiavi stringa: la mappa e' salvata come lista di coppie
+        bundle_meta["class_mapping"] = {k: v for k, v in bundle_meta["class_mapping"]}
+    return FlatForest(arrays, meta), bundle_meta
+
+
+def _is_current(compiled: str, path: str) -> bool:
+    """La versione compilata vale solo se generata dal joblib attuale."""
+    if not os.path.isdir(compiled):
+        return False
+    with open(os.path.join(compiled, "meta.json")) as f:
+        source = json.load(f).get("source_sha256")
+    return not os.path.exists(path) or source == file_sha256(path)
+
+
+def load_bundle(path: str, mmap_mode: Optional[str] = None) -> dict:
+    """
+    Bundle del modello nella forma {"model": ..., **metadati}: usa la
+    versione compilata se presente e allineata al joblib, altrimenti il
+    joblib con sklearn.
+    """
+    compiled = compiled_path(path)
+    if _is_current(compiled, path):
+        forest, bundle_meta = load_compiled(compiled, mmap_mode=mmap_mode)
+        return {"model": forest, **bundle_meta}
+    import joblib
+    bundle = joblib.load(path, mmap_mode=mmap_mode)
+    return bundle if isinstance(bundle, dict) else {"model": bundle}
+
+
+def _bundle_meta(bundle: dict) -> dict:
+    meta = {}
+    for key, value in bundle.items():
+        if key == "model":
+            continue
+        if key == "class_mapping":
+            value = [[int(k), v] for k, v in value.items()]
+        json.dumps(value)
+        meta[key] = value
+    return meta
+
+
+def _probe_inputs(compiled: dict, n: int, seed: int = 0) -> np.ndarray:
+    """Input casuali attorno alle soglie effettivamente usate da ciascuna feature."""
+    rng = np.random.default_rng(seed)
+    arrays, n_features = compiled["arrays"], compiled["meta"]["n_features"]
+    split = np.isfinite(arrays["threshold"])
+    X = rng.normal(size=(n, n_features))
+    for f in range(n_features):
+        thr = arrays["threshold"][split & (arrays["feature"] == f)]
+        if len(thr):
+            X[:, f] = rng.choice(thr, n) + rng.normal(scale=np.std(thr) * 0.05 + 1e-6, size=n)
+    return X
+
+
+def verify(estimator, forest: FlatForest, X: np.ndarray) -> None:
+    """Solleva AssertionError se la foresta compilata diverge da sklearn su X."""
+    expected = estimator.predict(X)
+    got = forest.predict(X)
+    if forest.classes_ is not None:
+        assert (expected == got).all(), f"{int((expected != got).sum())} predizioni diverse"
+        assert np.allclose(estimator.predict_proba(X), forest.predict_proba(X), rtol=0, atol=1e-12)
+    else:
+        assert np.allclose(expected, got, rtol=1e-12, atol=1e-12), "predizioni diverse"
+
+
+def main():
+    import joblib
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bundle")
+    parser.add_argument("--out")
+    parser.add_argument("--check-samples", type=int, default=20000)
+    args = parser.parse_args()
+
+    bundle = joblib.load(args.bundle)
+    if not isinstance(bundle, dict):
+        bundle = {"model": bundle}
+    compiled = compile_forest(bundle["model"])
+    forest = FlatForest(compiled["arrays"], compiled["meta"])
+
+    X = _probe_inputs(compiled, args.check_samples)
+    verify(bundle["model"], forest, X)
+    print(f"Equivalenza con sklearn verificata su {len(X)} input")
+
+    out = args.out or compiled_path(args.bundle)
+    save_compiled(compiled, _bundle_meta(bundle), out, source_sha256=file_sha256(args.bundle))
+    print(f"Foresta compilata in {out} ({len(compiled['arrays']['feature'])} nodi)")
+
+
+if __name__ == "__main__":
+    main()
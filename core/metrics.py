@@ -0,0 +1,165 @@
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Bucket di default (secondi), adatti sia a operazioni sub-ms che a richieste lente
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in list(self._values.items())]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in list(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Istogramma a bucket fissi: observe() costa una bisect e due somme,
+    abbastanza poco da poter restare attivo in produzione.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # chiave -> [conteggi per bucket (+Inf in coda), somma, conteggio]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Osserva la durata del blocco with."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> dict:
+        state = self._values.get(self._key(labels))
+        if state is None:
+            return {"count": 0, "sum": 0.0, "buckets": {}}
+        cumulative, acc = {}, 0
+        for bound, c in zip(self.buckets + (float("inf"),), state[0]):
+            acc += c
+            cumulative[bound] = acc
+        return {"count": state[2], "sum": state[1], "buckets": cumulative}
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in list(self._values.items()):
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {acc}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+# Fasi osservate durante la richiesta corrente, se tracciata (core.slowlog)
+current_stages: ContextVar[Optional[list]] = ContextVar("current_stages", default=None)
+
+
+class StageHistogram(Histogram):
+    """Histogram delle fasi che registra anche nella traccia della richiesta corrente."""
+
+    def observe(self, value: float, **labels) -> None:
+        super().observe(value, **labels)
+        stages = current_stages.get()
+        if stages is not None:
+            stages.append((labels.get("pipeline"), labels.get("stage"), value))
+
+
+# Durata delle fasi delle richieste (predict_behavior, stop_session, auth...)
+STAGE_SECONDS = StageHistogram("pipeline_stage_seconds", "Durata delle fasi di elaborazione", ["pipeline", "stage"])
+WS_CONNECTIONS = Gauge("websocket_connections", "Connessioni WebSocket aperte", ["endpoint"])
+
+
+def render_latest() -> str:
+    """Esposizione in formato testo Prometheus di tutte le metriche registrate."""
+    return "\n".join(m.render() for m in _registry) + "\n"
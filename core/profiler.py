@@ -0,0 +1,66 @@
+"""
+Profiler a campionamento per un worker in esecuzione.
+
+Un thread legge gli stack di tutti i thread del processo (sys._current_frames)
+ogni interval secondi per duration secondi e li aggrega nel formato
+"collapsed" (una riga "frame;frame;... conteggio"), leggibile da
+flamegraph.pl, speedscope o inferno. Non richiede estensioni native e non
+tocca l'event loop, quindi funziona anche quando il loop e' bloccato.
+Il tempo passato in attesa di I/O (await su Motor) appare come il loop
+fermo nel selector.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.relpath(code.co_filename) if not code.co_filename.startswith("<") else code.co_filename
+    # ";" separa i frame nel formato collapsed, lo spazio precede il conteggio
+    return f"{code.co_name} ({filename}:{frame.f_lineno})".replace(";", ":").replace(" ", "_")
+
+
+def _collapsed_stack(frame, thread_name: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(labels))
+
+
+def sample(duration: float, interval: float = 0.005, thread_id: Optional[int] = None) -> str:
+    """
+    Campiona gli stack per duration secondi (bloccante: va eseguito in un
+    thread). Con thread_id solo quel thread, altrimenti tutti tranne il
+    campionatore. Solleva ProfilerBusy se un'altra sessione e' in corso.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        deadline = time.monotonic() + min(duration, PROFILER_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (thread_id is not None and ident != thread_id):
+                    continue
+                counts[_collapsed_stack(frame, names.get(ident, str(ident)))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+    finally:
+        _running.release()
@@ -0,0 +1,61 @@
+"""
+Formato binario dei frame WebSocket con le finestre sensoriali, negoziato
+per connessione con il subprotocol BINARY_SUBPROTOCOL.
+
+Header little-endian di 32 byte:
+
+    offset  tipo      campo
+    0       2s        magic b"DM"
+    2       uint8     versione (1)
+    3       uint8     flag (FLAG_CHUNK: blocco di una finestra scorrevole)
+    4       uint32    numero di campioni N
+    8       int64     timestamp del primo campione (ms epoch)
+    16      float32   periodo di campionamento (ms)
+    20      12s       session_id (ObjectId binario)
+
+seguito da N * 6 float32 little-endian, riga per campione nell'ordine
+AccX, AccY, AccZ, GyroX, GyroY, GyroZ.
+"""
+import struct
+from typing import Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from core.features import SENSOR_COLUMNS
+
+BINARY_SUBPROTOCOL = "drivemood.bin.v1"
+
+FLAG_CHUNK = 0x01
+
+MAGIC = b"DM"
+VERSION = 1
+HEADER = struct.Struct("<2sBBIqf12s")
+_SAMPLE_DTYPE = np.dtype("<f4")
+
+
+def decode_frame(buf: bytes) -> Tuple[ObjectId, np.ndarray, np.ndarray, int]:
+    """
+    Restituisce (session_id, timestamp ms (N,), campioni float32 (N, 6), flag).
+    I campioni sono una vista sul buffer ricevuto, senza copie.
+    Solleva ValueError se il frame non e' valido.
+    """
+    if len(buf) < HEADER.size:
+        raise ValueError("Frame troppo corto")
+    magic, version, flags, n, start_ms, period_ms, sid = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Magic o versione non supportati")
+    expected = HEADER.size + n * len(SENSOR_COLUMNS) * _SAMPLE_DTYPE.itemsize
+    if len(buf) != expected:
+        raise ValueError(f"Lunghezza {len(buf)} diversa da {expected}")
+
+    data = np.frombuffer(buf, dtype=_SAMPLE_DTYPE, count=n * len(SENSOR_COLUMNS), offset=HEADER.size)
+    timestamps = start_ms + np.rint(np.arange(n) * period_ms).astype(np.int64)
+    return ObjectId(sid), timestamps, data.reshape(n, len(SENSOR_COLUMNS)), flags
+
+
+def encode_frame(session_id, start_ms: int, period_ms: float, data: np.ndarray, flags: int = 0) -> bytes:
+    """Codifica una finestra (N, 6) nel formato binario (lato client, test e benchmark)."""
+    samples = np.ascontiguousarray(data, dtype=_SAMPLE_DTYPE)
+    header = HEADER.pack(MAGIC, VERSION, flags, len(samples), int(start_ms), float(period_ms), ObjectId(session_id).binary)
+    return header + samples.tobytes()
@@ -0,0 +1,200 @@
+"""
+Bus pub/sub per lo stato live delle sessioni (label predette), condiviso
+tra i worker uvicorn.
+
+Backend (PUBSUB_BACKEND):
+  - "memory": in-process, vede solo le connessioni del proprio worker;
+  - "mongo": gli eventi passano da una capped collection che ogni worker
+    legge con un cursore tailable, quindi ogni dashboard vede tutta la flotta.
+
+publish() non blocca mai: con il backend mongo l'evento va in una coda
+limitata scritta in background, e se la coda e' piena viene scartato.
+Ogni iscritto ha una coda con coalescenza per chiave (la sessione): un
+consumatore lento riceve solo l'ultimo evento di ciascuna sessione.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Set
+
+from pymongo import CursorType
+
+from core.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "memory")
+# Sessioni distinte tenute in coda per iscritto prima di scartare le piu' vecchie
+PUBSUB_SUBSCRIBER_QUEUE = int(os.getenv("PUBSUB_SUBSCRIBER_QUEUE", "1000"))
+# Backend mongo: eventi in attesa di scrittura e dimensione della capped collection
+PUBSUB_OUTBOX_SIZE = int(os.getenv("PUBSUB_OUTBOX_SIZE", "10000"))
+PUBSUB_CAPPED_BYTES = int(os.getenv("PUBSUB_CAPPED_BYTES", str(16 * 1024 * 1024)))
+PUBSUB_COLLECTION = "live_events"
+
+FLEET_TOPIC = "fleet"
+
+PUBLISHED = Counter("pubsub_published_total", "Eventi pubblicati sul bus live", ["backend"])
+DROPPED = Counter("pubsub_dropped_total", "Eventi scartati (coda piena o coalescenza)", ["reason"])
+SUBSCRIBERS = Gauge("pubsub_subscribers", "Iscritti al bus live in questo processo")
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """Coda di un iscritto: per ogni chiave resta solo l'evento piu' recente."""
+
+    def __init__(self, topics: Iterable[str], maxsize: int = PUBSUB_SUBSCRIBER_QUEUE):
+        self.topics = frozenset(topics)
+        self.maxsize = max(1, maxsize)
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def put(self, key: str, event: dict) -> None:
+        if self._pending.pop(key, None) is not None:
+            DROPPED.inc(reason="coalesced")
+        self._pending[key] = event
+        if len(self._pending) > self.maxsize:
+            self._pending.popitem(last=False)
+            DROPPED.inc(reason="subscriber_full")
+        self._ready.set()
+
+    async def get_batch(self) -> List[dict]:
+        """Attende almeno un evento e restituisce tutti quelli in coda."""
+        await self._ready.wait()
+        events = list(self._pending.values())
+        self._pending.clear()
+        self._ready.clear()
+        return events
+
+
+class PubSubHub:
+    """Backend in-process: publish consegna direttamente agli iscritti locali."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._subs: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        sub = Subscription(topics)
+        for topic in sub.topics:
+            self._subs.setdefault(topic, set()).add(sub)
+        SUBSCRIBERS.inc()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for topic in sub.topics:
+            subs = self._subs.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[topic]
+        SUBSCRIBERS.dec()
+
+    def _dispatch(self, topics: Iterable[str], key: str, event: dict) -> None:
+        delivered = set()
+        for topic in topics:
+            for sub in self._subs.get(topic, ()):
+                if sub not in delivered:
+                    delivered.add(sub)
+                    sub.put(key, event)
+
+    def publish(self, topics: List[str], key: str, event: dict) -> None:
+        PUBLISHED.inc(backend=self.name)
+        self._dispatch(topics, key, event)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MongoPubSubHub(PubSubHub):
+    """
+    Backend su capped collection: un task scrive gli eventi pubblicati da
+    questo worker, un altro segue la collection e li consegna agli iscritti
+    locali, inclusi quelli pubblicati dagli altri worker.
+    """
+
+    name = "mongo"
+
+    def __init__(self, outbox_size: int = PUBSUB_OUTBOX_SIZE, capped_bytes: int = PUBSUB_CAPPED_BYTES):
+        super().__init__()
+        self.capped_bytes = capped_bytes
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=outbox_size)
+        self._tasks: List[asyncio.Task] = []
+
+    def publish(self, topics: List[str], key: str, event: dict) -> None:
+        try:
+            self._outbox.put_nowait({"topics": topics, "key": key, "event": event})
+        except asyncio.QueueFull:
+            DROPPED.inc(reason="outbox_full")
+            return
+        PUBLISHED.inc(backend=self.name)
+
+    async def _collection(self):
+        from db.mongodb import get_database
+        db = await get_database()
+        if PUBSUB_COLLECTION not in await db.list_collection_names():
+            try:
+                await db.create_collection(PUBSUB_COLLECTION, capped=True, size=self.capped_bytes)
+            except Exception:
+                # Creata nel frattempo da un altro worker
+                pass
+        return db[PUBSUB_COLLECTION]
+
+    async def _writer(self, coll) -> None:
+        while True:
+            docs = [await self._outbox.get()]
+            while not self._outbox.empty() and len(docs) < 500:
+                docs.append(self._outbox.get_nowait())
+            try:
+                await coll.insert_many(docs, ordered=False)
+            except Exception:
+                DROPPED.inc(len(docs), reason="write_error")
+                logger.exception("Scrittura eventi live non riuscita")
+                await asyncio.sleep(1)
+
+    async def _tailer(self, coll) -> None:
+        last = await coll.find_one(sort=[("$natural", -1)], projection={"_id": 1})
+        last_id = last["_id"] if last else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            cursor = coll.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        self._dispatch(doc["topics"], doc["key"], doc["event"])
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cursore sugli eventi live interrotto")
+            # Cursore morto (collection vuota all'apertura o errore): si riapre
+            await asyncio.sleep(0.5)
+
+    async def start(self) -> None:
+        coll = await self._collection()
+        self._tasks = [asyncio.create_task(self._writer(coll)), asyncio.create_task(self._tailer(coll))]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def _make_hub(backend: str) -> PubSubHub:
+    if backend == "memory":
+        return PubSubHub()
+    if backend == "mongo":
+        return MongoPubSubHub()
+    raise ValueError(f"Backend pub/sub non valido: {backend}")
+
+
+live_hub = _make_hub(PUBSUB_BACKEND)
@@ -0,0 +1,154 @@
+"""
+Registro dei modelli ML: caricamento lazy al primo uso, versione dal sha256
+del file e hot reload quando il file su disco cambia.
+
+Per sostituire un modello a caldo basta copiare il nuovo joblib (ed
+eventualmente la sua versione compilata, vedi core.forest) accanto al
+vecchio e rinominarlo sopra l'originale: ogni processo se ne accorge entro
+MODEL_RELOAD_INTERVAL_SEC e passa al nuovo modello con un solo scambio di
+riferimento. Le richieste gia' in corso terminano con il modello precedente.
+
+Nell'event loop va usato aget: il controllo del file e il reload (sha256 e
+joblib.load) girano in un thread invece di bloccare le altre richieste.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from core.files import file_sha256
+from core.forest import compiled_path, load_bundle
+
+logger = logging.getLogger(__name__)
+
+BEHAVIOR_MODEL = "driving_behavior"
+MAINTENANCE_MODEL = "maintenance"
+
+BEHAVIOR_MODEL_PATH = os.getenv("BEHAVIOR_MODEL_PATH", "ml_models/rf_driving_behavior_windows.joblib")
+MAINTENANCE_MODEL_PATH = os.getenv("MAINTENANCE_MODEL_PATH", "ml_models/rf_maintenance_regressor.joblib")
+
+# Ogni quanto (al massimo) si controlla se il file del modello e' cambiato
+MODEL_RELOAD_INTERVAL_SEC = float(os.getenv("MODEL_RELOAD_INTERVAL_SEC", "5"))
+# Gli array dei modelli compilati vengono mappati in memoria: i worker
+# dello stesso host condividono le pagine invece di averne una copia ciascuno
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE", "r") or None
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class ModelHandle:
+    """Un modello caricato, immutabile: un reload crea un nuovo handle."""
+
+    def __init__(self, name: str, path: str, bundle: dict, version: str, signature: tuple):
+        self.name = name
+        self.path = path
+        self.bundle = bundle
+        self.model = bundle["model"]
+        self.version = version
+        self.signature = signature
+        self.loaded_at = time.time()
+
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _signature(path: str) -> Optional[tuple]:
+    """Impronta economica (mtime, dimensione) del joblib e della versione compilata."""
+    sig = (_stat(path), _stat(os.path.join(compiled_path(path), "meta.json")))
+    return sig if sig != (None, None) else None
+
+
+def _version(path: str) -> str:
+    if os.path.exists(path):
+        return file_sha256(path)[:12]
+    # Solo la versione compilata: la versione e' quella del joblib d'origine
+    import json
+    with open(os.path.join(compiled_path(path), "meta.json")) as f:
+        return (json.load(f).get("source_sha256") or "unknown")[:12]
+
+
+class ModelRegistry:
+    def __init__(self, reload_interval: float = MODEL_RELOAD_INTERVAL_SEC, mmap_mode: Optional[str] = MODEL_MMAP_MODE):
+        self.reload_interval = reload_interval
+        self.mmap_mode = mmap_mode
+        self._paths: Dict[str, str] = {}
+        self._handles: Dict[str, ModelHandle] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, path: str) -> None:
+        self._paths[name] = path
+
+    def get(self, name: str) -> ModelHandle:
+        """
+        Handle del modello, caricato al primo uso. Solleva ModelUnavailable se
+        il file non c'e' e non e' mai stato caricato; se un reload fallisce
+        resta in uso la versione precedente.
+        """
+        handle = self._handles.get(name)
+        if handle is not None and time.monotonic() - self._checked[name] < self.reload_interval:
+            return handle
+
+        with self._lock:
+            path = self._paths.get(name)
+            if path is None:
+                raise ModelUnavailable(f"Modello non registrato: {name}")
+            handle = self._handles.get(name)
+            self._checked[name] = time.monotonic()
+            sig = _signature(path)
+            if sig is None:
+                if handle is not None:
+                    return handle
+                raise ModelUnavailable(f"Modello {name} non trovato in {path}")
+            if handle is not None and handle.signature == sig:
+                return handle
+
+            try:
+                bundle = load_bundle(path, mmap_mode=self.mmap_mode)
+                new = ModelHandle(name, path, bundle, _version(path), sig)
+            except Exception:
+                if handle is None:
+                    raise
+                # Es. file copiato a meta': si riprova al prossimo controllo
+                logger.exception("Reload del modello %s fallito, resta la versione %s", name, handle.version)
+                return handle
+
+            self._handles[name] = new
+            if handle is not None:
+                logger.info("Modello %s aggiornato: %s -> %s", name, handle.version, new.version)
+            return new
+
+    async def aget(self, name: str) -> ModelHandle:
+        """Come get, ma controllo e reload del modello girano in un thread."""
+        handle = self._handles.get(name)
+        if handle is not None and time.monotonic() - self._checked[name] < self.reload_interval:
+            return handle
+        return await asyncio.to_thread(self.get, name)
+
+    def describe(self) -> List[dict]:
+        """Stato dei modelli in questo processo, senza forzarne il caricamento."""
+        out = []
+        for name, path in self._paths.items():
+            handle = self._handles.get(name)
+            out.append({
+                "name": name,
+                "path": path,
+                "available": _signature(path) is not None,
+                "loaded_version": handle.version if handle else None,
+                "loaded_at": handle.loaded_at if handle else None,
+            })
+        return out
+
+
+model_registry = ModelRegistry()
+model_registry.register(BEHAVIOR_MODEL, BEHAVIOR_MODEL_PATH)
+model_registry.register(MAINTENANCE_MODEL, MAINTENANCE_MODEL_PATH)
@@ -0,0 +1,30 @@
+"""
+Risposte JSON veloci per le liste lette da Mongo.
+
+Le route costruiscono dict gia' proiettati sui campi del response_model e
+li restituiscono in una FastJSONResponse: FastAPI non rivalida i dati e
+orjson serializza direttamente ObjectId, datetime e scalari NumPy.
+Il response_model della route resta per la documentazione OpenAPI.
+Il JSON e' equivalente a quello del percorso pydantic (datetime UTC con
+"Z"); cambia solo la notazione di alcuni float (7.9e-05 contro 0.000079).
+"""
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Tipo non serializzabile: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
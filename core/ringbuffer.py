@@ -0,0 +1,106 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from core.features import FEATURE_COLUMNS, SENSOR_COLUMNS
+
+
+class SlidingWindow:
+    """
+    Finestra scorrevole per connessione su un ring buffer NumPy.
+
+    I campioni arrivano a blocchi di qualsiasi lunghezza; ogni hop campioni,
+    a finestra piena, vengono prodotte le feature (stesso ordine di
+    core.features.extract_features) dell'ultima finestra di window_len
+    campioni. Media e deviazione standard derivano da somme correnti
+    aggiornate in modo incrementale, min e max da una riduzione sul ring.
+    """
+
+    # Ogni quanti campioni ricalcolare da zero le somme correnti, per non
+    # accumulare errori di arrotondamento
+    RESYNC_EVERY = 4096
+
+    def __init__(self, window_len: int, hop: int):
+        self.window_len = int(window_len)
+        self.hop = max(1, min(int(hop), self.window_len))
+        n_cols = len(FEATURE_COLUMNS)
+        self._buf = np.zeros((self.window_len, n_cols), dtype=np.float64)
+        self._pos = 0
+        self._count = 0
+        self._sum = np.zeros(n_cols)
+        self._sumsq = np.zeros(n_cols)
+        self._since_emit = 0
+        self._since_resync = 0
+        # Campioni ricevuti dopo l'ultima emissione, non ancora etichettati
+        self._pending_ts: List[np.ndarray] = []
+        self._pending_data: List[np.ndarray] = []
+
+    def push(self, timestamps: np.ndarray, data: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Aggiunge un blocco (N, 6) e restituisce, per ogni finestra completata,
+        (feature, timestamp e campioni arrivati dalla finestra precedente).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        data = np.asarray(data, dtype=np.float64)
+        rows = np.empty((len(data), len(FEATURE_COLUMNS)))
+        rows[:, :6] = data
+        np.sqrt(np.square(data).reshape(-1, 2, 3).sum(axis=2), out=rows[:, 6:])
+
+        emitted = []
+        start = 0
+        while start < len(rows):
+            # Segmenti che terminano esattamente al prossimo hop
+            step = min(self.hop - self._since_emit, len(rows) - start)
+            end = start + step
+            self._append(rows[start:end])
+            self._pending_ts.append(timestamps[start:end])
+            self._pending_data.append(data[start:end])
+            self._since_emit += step
+            if self._since_emit >= self.hop:
+                if self._count == self.window_len:
+                    ts, samples = self.drain()
+                    emitted.append((self.features(), ts, samples))
+                # Prima di riempire la finestra i campioni restano in attesa
+                self._since_emit = 0
+            start = end
+        return emitted
+
+    def _append(self, rows: np.ndarray) -> None:
+        idx = (self._pos + np.arange(len(rows))) % self.window_len
+        # Le righe mai scritte valgono zero e non alterano le somme
+        evicted = self._buf[idx]
+        self._sum += rows.sum(axis=0) - evicted.sum(axis=0)
+        self._sumsq += np.square(rows).sum(axis=0) - np.square(evicted).sum(axis=0)
+        self._buf[idx] = rows
+        self._pos = (self._pos + len(rows)) % self.window_len
+        self._count = min(self._count + len(rows), self.window_len)
+
+        self._since_resync += len(rows)
+        if self._since_resync >= self.RESYNC_EVERY:
+            self._sum = self._buf.sum(axis=0)
+            self._sumsq = np.square(self._buf).sum(axis=0)
+            self._since_resync = 0
+
+    def features(self) -> np.ndarray:
+        window = self._buf if self._count == self.window_len else self._buf[:self._count]
+        n = len(window)
+        stats = np.empty((len(FEATURE_COLUMNS), 4))
+        stats[:, 0] = self._sum / n
+        stats[:, 1] = np.sqrt(np.maximum(self._sumsq / n - np.square(stats[:, 0]), 0.0))
+        stats[:, 2] = window.min(axis=0)
+        stats[:, 3] = window.max(axis=0)
+        return stats.ravel()
+
+    def drain(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Restituisce e svuota i campioni in attesa di etichetta."""
+        if not self._pending_ts:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(SENSOR_COLUMNS)))
+        ts = np.concatenate(self._pending_ts)
+        data = np.concatenate(self._pending_data)
+        self._pending_ts, self._pending_data = [], []
+        return ts, data
+
+    def requeue(self, timestamps: np.ndarray, data: np.ndarray) -> None:
+        """Rimette in testa ai campioni in attesa quelli restituiti da push e non etichettati."""
+        self._pending_ts.insert(0, np.asarray(timestamps, dtype=np.int64))
+        self._pending_data.insert(0, np.asarray(data, dtype=np.float64))
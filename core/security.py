@@ -1,8 +1,13 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 import jwt
 
+from core.metrics import Counter, Gauge, Histogram
+
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "dev-secret")
 ALGORITHM = "HS256"
 
@@ -17,6 +22,58 @@ def hash_password(plain_password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+# bcrypt costa centinaia di ms di CPU: gira in un pool dedicato e limitato.
+# Oltre BCRYPT_MAX_PENDING operazioni (in esecuzione + in coda) le nuove
+# richieste vengono rifiutate subito invece di accodarsi senza limite.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "16"))
+
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_pending = 0
+
+BCRYPT_QUEUE_WAIT = Histogram("password_hash_queue_wait_seconds", "Attesa in coda prima dell'hashing", ["op"])
+BCRYPT_TIME = Histogram("password_hash_seconds", "Durata di hash/verify bcrypt", ["op"])
+BCRYPT_PENDING = Gauge("password_hash_pending", "Operazioni bcrypt in esecuzione o in coda")
+BCRYPT_REJECTED = Counter("password_hash_rejected_total", "Operazioni rifiutate per pool saturo", ["op"])
+
+
+class PasswordHashingBusy(Exception):
+    pass
+
+
+async def _run_bcrypt(op: str, fn, *args):
+    global _bcrypt_pending
+    if _bcrypt_pending >= BCRYPT_MAX_PENDING:
+        BCRYPT_REJECTED.inc(op=op)
+        raise PasswordHashingBusy()
+
+    _bcrypt_pending += 1
+    BCRYPT_PENDING.set(_bcrypt_pending)
+    queued = time.perf_counter()
+
+    def timed():
+        start = time.perf_counter()
+        BCRYPT_QUEUE_WAIT.observe(start - queued, op=op)
+        try:
+            return fn(*args)
+        finally:
+            BCRYPT_TIME.observe(time.perf_counter() - start, op=op)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_executor, timed)
+    finally:
+        _bcrypt_pending -= 1
+        BCRYPT_PENDING.set(_bcrypt_pending)
+
+
+async def hash_password_async(plain_password: str) -> str:
+    return await _run_bcrypt("hash", hash_password, plain_password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_bcrypt("verify", verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     now_utc = datetime.now(timezone.utc)
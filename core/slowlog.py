@@ -0,0 +1,174 @@
+"""
+Cattura delle richieste lente.
+
+Ogni richiesta HTTP (SlowRequestMiddleware) e ogni messaggio WebSocket
+tracciato con slow_log.track() che supera SLOW_REQUEST_THRESHOLD_MS finisce
+in un ring in memoria di SLOW_REQUEST_RING_SIZE elementi, con route, durata e
+fasi (pipeline_stage_seconds) osservate durante la richiesta.
+
+Un thread watchdog controlla le richieste in corso: quando una supera la
+soglia ne registra subito lo stack del thread dell'event loop (utile se il
+loop e' bloccato da lavoro CPU) e, appena il loop e' libero, la catena di
+await del task (utile se la richiesta e' ferma su I/O).
+"""
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from core.metrics import Counter, current_stages
+
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+SLOW_REQUEST_RING_SIZE = int(os.getenv("SLOW_REQUEST_RING_SIZE", "200"))
+_STACK_LIMIT = 40
+
+SLOW_REQUESTS = Counter("slow_requests_total", "Richieste oltre la soglia di lentezza", ["kind"])
+
+
+class _InFlight:
+    __slots__ = ("kind", "route", "start", "started_at", "thread_id", "loop", "task", "stages", "stack", "task_stack")
+
+    def __init__(self, kind: str, route: str):
+        self.kind = kind
+        self.route = route
+        self.start = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.thread_id = threading.get_ident()
+        try:
+            self.loop = asyncio.get_running_loop()
+            self.task = asyncio.current_task()
+        except RuntimeError:
+            self.loop = self.task = None
+        self.stages: list = []
+        self.stack: Optional[List[str]] = None
+        self.task_stack: Optional[List[str]] = None
+
+
+def _format_frames(frames) -> List[str]:
+    return [f"{f.f_code.co_filename}:{f.f_lineno} in {f.f_code.co_name}" for f in frames]
+
+
+class SlowRequestLog:
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS, size: int = SLOW_REQUEST_RING_SIZE):
+        self.threshold = threshold_ms / 1000.0
+        self._ring: deque = deque(maxlen=size)
+        self._inflight: Dict[int, _InFlight] = {}
+        self._ids = itertools.count()
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    @contextmanager
+    def track(self, kind: str, route: str):
+        """Traccia il blocco with come una richiesta; l'oggetto restituito permette di aggiornare la route."""
+        if not self.enabled:
+            yield None
+            return
+        entry = _InFlight(kind, route)
+        key = next(self._ids)
+        self._inflight[key] = entry
+        token = current_stages.set(entry.stages)
+        try:
+            yield entry
+        finally:
+            current_stages.reset(token)
+            del self._inflight[key]
+            duration = time.perf_counter() - entry.start
+            if duration >= self.threshold:
+                self._record(entry, duration)
+
+    def _record(self, entry: _InFlight, duration: float) -> None:
+        SLOW_REQUESTS.inc(kind=entry.kind)
+        self._ring.append({
+            "kind": entry.kind,
+            "route": entry.route,
+            "started_at": entry.started_at.isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "stages": [
+                {"pipeline": p, "stage": s, "ms": round(v * 1000, 3)} for p, s, v in entry.stages
+            ],
+            "stack": entry.stack,
+            "task_stack": entry.task_stack,
+        })
+
+    def recent(self, limit: Optional[int] = None) -> List[dict]:
+        """Richieste lente, dalla piu' recente."""
+        items = list(reversed(self._ring))
+        return items[:limit] if limit else items
+
+    def _capture_task_stack(self, entry: _InFlight) -> None:
+        # Gira nel loop: la catena di await del task e' consistente.
+        # Task.get_stack() si ferma alla coroutine esterna, qui si segue cr_await
+        if entry.task is None or entry.task.done():
+            return
+        frames = []
+        coro = entry.task.get_coro()
+        while coro is not None and len(frames) < _STACK_LIMIT:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            frames.append(frame)
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        entry.task_stack = _format_frames(frames)
+
+    def _watch(self) -> None:
+        interval = max(self.threshold / 4, 0.01)
+        while not self._stop.wait(interval):
+            now = time.perf_counter()
+            frames = None
+            for entry in list(self._inflight.values()):
+                if entry.stack is not None or now - entry.start < self.threshold:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(entry.thread_id)
+                entry.stack = [
+                    f"{fs.filename}:{fs.lineno} in {fs.name}" for fs in traceback.extract_stack(frame, limit=_STACK_LIMIT)
+                ] if frame else []
+                if entry.loop is not None and not entry.loop.is_closed():
+                    entry.loop.call_soon_threadsafe(self._capture_task_stack, entry)
+
+    def start(self) -> None:
+        if self.enabled and self._watchdog is None:
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="slow-request-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+
+slow_log = SlowRequestLog()
+
+
+class SlowRequestMiddleware:
+    """Middleware ASGI: traccia ogni richiesta HTTP in slow_log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not slow_log.enabled:
+            await self.app(scope, receive, send)
+            return
+        with slow_log.track("http", f"{scope['method']} {scope['path']}") as entry:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Dopo il routing lo scope contiene la route: raggruppa i path con parametri
+                route = scope.get("route")
+                if route is not None and hasattr(route, "path"):
+                    entry.route = f"{scope['method']} {route.path}"
@@ -0,0 +1,332 @@
+"""
+Archiviazione a freddo dei campioni delle sessioni concluse.
+
+Il job sposta i campioni delle sessioni terminate da piu' di
+ARCHIVE_AFTER_DAYS giorni (da behavior_windows, behaviors e dalla
+time-series collection) in un file .npz colonnare per sessione sotto
+ARCHIVE_DIR, e lascia sul documento di sessione il puntatore "archive".
+Le letture (get_behaviors, rebuild dei rollup) usano il file: gli array
+di un archivio non compresso vengono mappati in memoria direttamente
+dal file, senza copie; con ARCHIVE_COMPRESS=1 i file sono piu' piccoli ma
+vengono decompressi in memoria a ogni lettura.
+
+Ordine delle operazioni per sessione: scrittura del file (atomica),
+puntatore sulla sessione, cancellazione dei campioni da Mongo e infine
+archive.purged_at. Se il job si interrompe, al giro successivo riprende
+dalla cancellazione. ARCHIVE_DIR deve essere condivisa da tutti i worker.
+Una sessione ripristinata riceve restored_at e il job non la archivia piu'.
+
+    python -m db.archive --once                # un giro del job
+    python -m db.archive --restore SESSION_ID  # riporta i campioni in Mongo
+"""
+import argparse
+import asyncio
+import logging
+import os
+import struct
+import time
+import zipfile
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from core.files import file_sha256
+from core.metrics import Counter, Histogram
+from db.behavior_store import (
+    LEGACY_CHUNK_SIZE,
+    LEGACY_COLLECTION,
+    TIMESERIES_COLLECTION,
+    WINDOWS_COLLECTION,
+    decode_window,
+    encode_window,
+    legacy_to_arrays,
+    split_runs,
+    window_insert_ops,
+)
+from db.leases import acquire_lease, release_lease
+from db.mongodb import get_database
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "session_archive"
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Giorni dalla fine della sessione prima dell'archiviazione; 0 disabilita il job
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_COMPRESS = os.getenv("ARCHIVE_COMPRESS", "0") == "1"
+ARCHIVE_JOB_INTERVAL_SEC = float(os.getenv("ARCHIVE_JOB_INTERVAL_SEC", "3600"))
+# Sessioni archiviate per giro
+ARCHIVE_JOB_BATCH_SIZE = int(os.getenv("ARCHIVE_JOB_BATCH_SIZE", "100"))
+ARCHIVE_JOB_LEASE_SEC = float(os.getenv("ARCHIVE_JOB_LEASE_SEC", "1800"))
+# Campioni per documento finestra al ripristino (come db.migrate_behaviors)
+RESTORE_WINDOW_SIZE = 20
+
+JOB_SECONDS = Histogram("archive_job_seconds", "Durata di un giro del job di archiviazione")
+SESSIONS_ARCHIVED = Counter("archive_sessions_total", "Sessioni archiviate su file")
+BYTES_ARCHIVED = Counter("archive_bytes_total", "Byte scritti negli archivi di sessione")
+
+
+class Archive:
+    """Campioni di una sessione archiviata; label e versioni come codici + nomi."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.ts = arrays["t"]
+        self.data = arrays["data"]
+        self._label_codes = arrays["label"]
+        self._label_names = np.asarray(arrays["labels"]).astype(object)
+        self._version_codes = arrays["version"]
+        self._version_names = np.asarray(arrays["versions"]).astype(object)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def labels(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        return self._label_names[self._label_codes[start:end]]
+
+    def versions(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        # "" nel file indica una finestra senza model_version
+        names = self._version_names[self._version_codes[start:end]]
+        return np.where(names == "", None, names)
+
+
+def archive_file(session_id: ObjectId) -> str:
+    """Percorso del file relativo ad ARCHIVE_DIR; le ultime cifre ripartiscono le sessioni in sottocartelle."""
+    sid = str(session_id)
+    return os.path.join(sid[-2:], f"{sid}.npz")
+
+
+def _categorical(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    names, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.uint8 if len(names) <= 256 else np.uint16), names.astype(str)
+
+
+def write_archive(session_id: ObjectId, ts, data, labels, versions, compress: bool = ARCHIVE_COMPRESS) -> dict:
+    """Scrive l'archivio della sessione e restituisce il puntatore da salvare sulla sessione."""
+    path = os.path.join(ARCHIVE_DIR, archive_file(session_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    label_codes, label_names = _categorical(np.asarray(labels, dtype=object).astype(str))
+    version_codes, version_names = _categorical(np.array(["" if v is None else v for v in versions], dtype=object).astype(str))
+    arrays = {
+        "t": np.asarray(ts, dtype="<i8"),
+        "data": np.ascontiguousarray(data, dtype="<f4"),
+        "label": label_codes,
+        "labels": label_names,
+        "version": version_codes,
+        "versions": version_names,
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {
+        "file": archive_file(session_id),
+        "n": int(len(ts)),
+        "bytes": os.path.getsize(path),
+        "sha256": file_sha256(path),
+        "compressed": compress,
+        "archived_at": datetime.utcnow(),
+    }
+
+
+def _mmap_npz(path: str) -> Optional[Dict[str, np.ndarray]]:
+    """Array di un .npz non compresso mappati sul file, o None se compresso."""
+    with zipfile.ZipFile(path) as zf:
+        members = zf.infolist()
+    if any(m.compress_type != zipfile.ZIP_STORED for m in members):
+        return None
+    arrays = {}
+    with open(path, "rb") as f:
+        for member in members:
+            # Il .npy inizia dopo l'header locale dello zip (30 byte + nome + extra)
+            f.seek(member.header_offset)
+            name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(member.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = member.filename[:-len(".npy")]
+            if not np.prod(shape):
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran else "C")
+    return arrays
+
+
+def open_archive(pointer: dict) -> Archive:
+    path = os.path.join(ARCHIVE_DIR, pointer["file"])
+    arrays = _mmap_npz(path)
+    if arrays is None:
+        with np.load(path) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+    return Archive(arrays)
+
+
+async def iter_archive_chunks(
+    pointer: dict,
+    session_id: ObjectId,
+    after: Optional[dict] = None,
+    chunk_size: int = LEGACY_CHUNK_SIZE,
+) -> AsyncIterator[Tuple[np.ndarray, np.ndarray, np.ndarray, dict]]:
+    """Come behavior_store.iter_session_chunks, per una sessione archiviata."""
+    archive = await asyncio.to_thread(open_archive, pointer)
+    if after is None:
+        start = 0
+    elif after["s"] == "archive":
+        start = after["t"]
+    else:
+        # Cursore emesso prima dell'archiviazione: si riprende dal timestamp
+        start = int(np.searchsorted(archive.ts, after.get("e", after["t"]), side="right"))
+    for i in range(start, len(archive), chunk_size):
+        end = min(i + chunk_size, len(archive))
+        yield archive.ts[i:end], archive.data[i:end], archive.labels(i, end), {"s": "archive", "t": end, "id": str(session_id)}
+
+
+def archive_windows(pointer: dict, session_id: ObjectId, window_size: int = RESTORE_WINDOW_SIZE) -> List[dict]:
+    """Documenti finestra ricostruiti dall'archivio (ripristino e rebuild dei rollup)."""
+    archive = open_archive(pointer)
+    labels, versions = archive.labels(), archive.versions()
+    return [
+        encode_window(session_id, archive.ts[start:end], archive.data[start:end], labels[start], versions[start])
+        for start, end in split_runs(labels, window_size)
+    ]
+
+
+async def _raw_samples(db, session_id: ObjectId):
+    """(timestamp, campioni, label, model_version) della sessione da tutti i formati in Mongo."""
+    parts = []
+    async for doc in db[WINDOWS_COLLECTION].find({"session_id": session_id}):
+        ts, data = decode_window(doc)
+        parts.append((ts, data, np.full(len(ts), doc["label"], dtype=object), np.full(len(ts), doc.get("model_version"), dtype=object)))
+    for collection, field in ((LEGACY_COLLECTION, "session_id"), (TIMESERIES_COLLECTION, "meta.session_id")):
+        docs = await db[collection].find({field: session_id}).to_list(length=None)
+        if docs:
+            parts.append((*legacy_to_arrays(docs), np.array([d.get("model_version") for d in docs], dtype=object)))
+    if not parts:
+        return np.empty(0, dtype="<i8"), np.empty((0, 6), dtype="<f4"), np.empty(0, dtype=object), np.empty(0, dtype=object)
+    ts, data, labels, versions = (np.concatenate(p) for p in zip(*parts))
+    order = np.argsort(ts, kind="stable")
+    return ts[order], data[order], labels[order], versions[order]
+
+
+async def _delete_raw(db, session_id: ObjectId) -> None:
+    await db[WINDOWS_COLLECTION].delete_many({"session_id": session_id})
+    await db[LEGACY_COLLECTION].delete_many({"session_id": session_id})
+    await db[TIMESERIES_COLLECTION].delete_many({"meta.session_id": session_id})
+
+
+async def archive_session(db, session: dict) -> int:
+    """Archivia (o completa l'archiviazione di) una sessione; restituisce i campioni archiviati."""
+    sid = session["_id"]
+    pointer = session.get("archive")
+    if pointer is None:
+        ts, data, labels, versions = await _raw_samples(db, sid)
+        pointer = await asyncio.to_thread(write_archive, sid, ts, data, labels, versions)
+        await db.sessions.update_one({"_id": sid, "archive": {"$exists": False}}, {"$set": {"archive": pointer}})
+        SESSIONS_ARCHIVED.inc()
+        BYTES_ARCHIVED.inc(pointer["bytes"])
+    # Prima di cancellare da Mongo il file deve essere integro
+    if await asyncio.to_thread(file_sha256, os.path.join(ARCHIVE_DIR, pointer["file"])) != pointer["sha256"]:
+        raise ValueError(f"Archivio della sessione {sid} corrotto")
+    await _delete_raw(db, sid)
+    await db.sessions.update_one({"_id": sid}, {"$set": {"archive.purged_at": datetime.utcnow()}})
+    return pointer["n"]
+
+
+async def run_archive_once(
+    db,
+    after_days: float = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_JOB_BATCH_SIZE,
+) -> Optional[int]:
+    """Un giro del job; restituisce le sessioni archiviate, o None senza lease."""
+    now = datetime.utcnow()
+    if await acquire_lease(db, JOB_ID, ARCHIVE_JOB_LEASE_SEC, now) is None:
+        return None
+    cursor = db.sessions.find(
+        {
+            "end_time": {"$ne": None, "$lt": now - timedelta(days=after_days)},
+            "archive.purged_at": {"$exists": False},
+            "restored_at": {"$exists": False},
+        },
+        {"archive": 1},
+    ).limit(batch_size)
+    archived = 0
+    async for session in cursor:
+        try:
+            await archive_session(db, session)
+            archived += 1
+        except Exception:
+            logger.exception("Archiviazione della sessione %s non riuscita", session["_id"])
+    await release_lease(db, JOB_ID, last_run_sessions=archived)
+    return archived
+
+
+async def restore_session(db, session_id: ObjectId) -> int:
+    """Riporta in Mongo i campioni di una sessione archiviata e rimuove il file."""
+    session = await db.sessions.find_one({"_id": session_id}, {"archive": 1})
+    if session is None or session.get("archive") is None:
+        raise ValueError(f"Sessione {session_id} non archiviata")
+    pointer = session["archive"]
+    windows = await asyncio.to_thread(archive_windows, pointer, session_id)
+    # Le finestre tornano nel formato corrente (BEHAVIOR_STORAGE); finche' il
+    # puntatore resta, le letture continuano a usare l'archivio
+    await _delete_raw(db, session_id)
+    ops = {}
+    for doc in windows:
+        collection, col_ops = window_insert_ops(doc)
+        ops.setdefault(collection, []).extend(col_ops)
+    for collection, col_ops in ops.items():
+        await db[collection].bulk_write(col_ops, ordered=False)
+    await db.sessions.update_one(
+        {"_id": session_id},
+        {"$unset": {"archive": ""}, "$set": {"restored_at": datetime.utcnow()}},
+    )
+    os.remove(os.path.join(ARCHIVE_DIR, pointer["file"]))
+    return pointer["n"]
+
+
+async def run_archive_job(interval: float = ARCHIVE_JOB_INTERVAL_SEC) -> None:
+    """Loop del job, avviato nel lifespan dell'app se ARCHIVE_AFTER_DAYS > 0."""
+    while True:
+        try:
+            db = await get_database()
+            start = time.perf_counter()
+            archived = await run_archive_once(db)
+            JOB_SECONDS.observe(time.perf_counter() - start)
+            if archived:
+                logger.info("Archiviate %d sessioni", archived)
+        except Exception:
+            logger.exception("Job di archiviazione non riuscito")
+        await asyncio.sleep(interval)
+
+
+async def _main(args) -> None:
+    db = await get_database()
+    if args.once:
+        archived = await run_archive_once(db, args.after_days)
+        logger.info("Sessioni archiviate: %s", archived)
+    for sid in args.restore or []:
+        n = await restore_session(db, ObjectId(sid))
+        logger.info("Sessione %s ripristinata: %d campioni", sid, n)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="esegue un giro del job di archiviazione")
+    parser.add_argument("--after-days", type=float, default=ARCHIVE_AFTER_DAYS or 30)
+    parser.add_argument("--restore", nargs="+", metavar="SESSION_ID", help="ripristina le sessioni in Mongo")
+    args = parser.parse_args()
+    if not args.once and not args.restore:
+        parser.print_help()
+        return
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+Formato colonnare dei dati sensoriali: un documento per finestra nella
+collection behavior_windows, con i sei assi impacchettati come float32 e i
+timestamp come int64 (ms epoch) in campi BSON Binary, la label e alcune
+statistiche precalcolate della finestra.
+
+Con BEHAVIOR_STORAGE=timeseries le finestre ingerite vengono invece salvate
+un documento per campione nella time-series collection behavior_samples
+(timeField timestamp, metaField meta = {session_id, label}), creata
+all'avvio: la compressione in bucket la fa MongoDB.
+
+I documenti per-campione della collection legacy behaviors restano leggibili:
+le funzioni di lettura uniscono in modo trasparente i tre formati.
+"""
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import Binary, ObjectId
+from pymongo import InsertOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from core.features import SENSOR_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+WINDOWS_COLLECTION = "behavior_windows"
+LEGACY_COLLECTION = "behaviors"
+TIMESERIES_COLLECTION = "behavior_samples"
+
+# Formato delle finestre ingerite: "windows" (behavior_windows) o "timeseries"
+BEHAVIOR_STORAGE = os.getenv("BEHAVIOR_STORAGE", "windows")
+
+# Campo del documento di sessione con il conteggio dei campioni per label
+LABEL_COUNT_FIELDS = {
+    "AGGRESSIVE": "count_aggressive",
+    "NORMAL": "count_normal",
+    "SLOW": "count_slow",
+}
+_STAT_KEYS = ("acc_mag_sum", "acc_mag_sumsq", "gyro_mag_sum", "gyro_mag_sumsq")
+
+# Documenti legacy raggruppati in blocchi di questa dimensione in lettura
+LEGACY_CHUNK_SIZE = 500
+
+_TS_DTYPE = np.dtype("<i8")
+_DATA_DTYPE = np.dtype("<f4")
+
+
+def to_epoch_ms(ts) -> int:
+    """Converte un timestamp del client (ms/s epoch, stringa ISO o datetime) in ms epoch UTC."""
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return int(round(ts.timestamp() * 1000))
+    if isinstance(ts, str):
+        try:
+            ts = float(ts)
+        except ValueError:
+            return to_epoch_ms(datetime.fromisoformat(ts.replace("Z", "+00:00")))
+    ts = float(ts)
+    # Valori sotto 1e11 sono secondi (1e11 ms = marzo 1973)
+    return int(round(ts if ts >= 1e11 else ts * 1000))
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    return datetime.fromtimestamp(int(ms) / 1000.0, tz=timezone.utc)
+
+
+def magnitudes(data: np.ndarray) -> np.ndarray:
+    """Magnitudo di accelerazione e giroscopio, array (N, 2)."""
+    data = np.asarray(data, dtype=np.float64)
+    return np.sqrt(np.square(data).reshape(-1, 2, 3).sum(axis=2))
+
+
+def encode_window(
+    session_id: ObjectId,
+    timestamps_ms: Iterable[int],
+    data: np.ndarray,
+    label: str,
+    model_version: Optional[str] = None,
+) -> dict:
+    """
+    Costruisce il documento di una finestra a partire da timestamp (N,) e
+    campioni (N, 6); model_version e' la versione del modello che ha
+    prodotto la label.
+    """
+    ts = np.asarray(timestamps_ms, dtype=_TS_DTYPE)
+    mags = magnitudes(data)
+    return {
+        "session_id": session_id,
+        "start_ts": from_epoch_ms(ts[0]),
+        "end_ts": from_epoch_ms(ts[-1]),
+        "n": int(len(ts)),
+        "label": label,
+        "model_version": model_version,
+        "t": Binary(ts.tobytes()),
+        "data": Binary(np.ascontiguousarray(data, dtype=_DATA_DTYPE).tobytes()),
+        "stats": {
+            "acc_mag_sum": float(mags[:, 0].sum()),
+            "acc_mag_sumsq": float(np.square(mags[:, 0]).sum()),
+            "gyro_mag_sum": float(mags[:, 1].sum()),
+            "gyro_mag_sumsq": float(np.square(mags[:, 1]).sum()),
+        },
+    }
+
+
+class WindowAccumulator:
+    """
+    Raggruppa i campioni etichettati che arrivano a piccoli blocchi (finestre
+    scorrevoli) in documenti finestra: un documento si chiude quando cambia
+    la label (o la versione del modello) o quando raggiunge max_len campioni.
+    """
+
+    def __init__(self, session_id: ObjectId, max_len: int):
+        self.session_id = session_id
+        self.max_len = max(1, int(max_len))
+        self._label = None
+        self._version = None
+        self._ts: List[np.ndarray] = []
+        self._data: List[np.ndarray] = []
+        self._n = 0
+
+    def add(self, timestamps: np.ndarray, data: np.ndarray, label: str, model_version: Optional[str] = None) -> List[dict]:
+        """Aggiunge campioni etichettati; restituisce i documenti completati."""
+        docs = []
+        if self._n and (label != self._label or model_version != self._version):
+            docs.extend(self.flush())
+        self._label = label
+        self._version = model_version
+        self._ts.append(np.asarray(timestamps, dtype=_TS_DTYPE))
+        self._data.append(np.asarray(data))
+        self._n += len(timestamps)
+        if self._n >= self.max_len:
+            docs.extend(self.flush())
+        return docs
+
+    def flush(self) -> List[dict]:
+        if not self._n:
+            return []
+        doc = encode_window(self.session_id, np.concatenate(self._ts), np.concatenate(self._data), self._label, self._version)
+        self._ts, self._data, self._n = [], [], 0
+        return [doc]
+
+    @property
+    def last_label(self):
+        return self._label
+
+    @property
+    def last_version(self):
+        return self._version
+
+
+def window_to_samples(doc: dict) -> List[dict]:
+    """Documenti per-campione della time-series collection a partire da un documento finestra."""
+    ts, data = decode_window(doc)
+    meta = {"session_id": doc["session_id"], "label": doc["label"]}
+    return [
+        {"timestamp": from_epoch_ms(t), "meta": meta, "model_version": doc.get("model_version"), **dict(zip(SENSOR_COLUMNS, row))}
+        for t, row in zip(ts.tolist(), data.tolist())
+    ]
+
+
+def window_insert_ops(doc: dict) -> Tuple[str, list]:
+    """(collection, operazioni) per salvare una finestra nel formato di BEHAVIOR_STORAGE."""
+    if BEHAVIOR_STORAGE == "timeseries":
+        return TIMESERIES_COLLECTION, [InsertOne(sample) for sample in window_to_samples(doc)]
+    return WINDOWS_COLLECTION, [InsertOne(doc)]
+
+
+async def written_samples(db, docs: List[dict]) -> set:
+    """
+    _id dei documenti per-campione di docs gia' presenti nella time-series
+    collection, dove _id non e' unico: db.writer li toglie da un insert
+    ritentato, che altrimenti duplicherebbe i campioni senza errori.
+    """
+    query = {
+        "meta.session_id": {"$in": list({doc["meta"]["session_id"] for doc in docs})},
+        "timestamp": {"$gte": min(doc["timestamp"] for doc in docs), "$lte": max(doc["timestamp"] for doc in docs)},
+        "_id": {"$in": [doc["_id"] for doc in docs]},
+    }
+    return set(await db[TIMESERIES_COLLECTION].distinct("_id", query))
+
+
+def timeseries_granularity(sampling_rate: Optional[float]) -> str:
+    """Granularita' della time-series dall'intervallo tra due campioni."""
+    interval = 1.0 / sampling_rate if sampling_rate else 1.0
+    if interval < 60:
+        return "seconds"
+    if interval < 3600:
+        return "minutes"
+    return "hours"
+
+
+async def ensure_timeseries_collection(db, sampling_rate: Optional[float] = None) -> None:
+    """Crea behavior_samples come time-series collection se non esiste (idempotente)."""
+    existing = await db.list_collections(filter={"name": TIMESERIES_COLLECTION}).to_list(length=None)
+    if existing:
+        if existing[0].get("type") != "timeseries":
+            logger.error("%s esiste ma non e' una time-series collection", TIMESERIES_COLLECTION)
+        return
+    granularity = timeseries_granularity(sampling_rate)
+    try:
+        await db.create_collection(
+            TIMESERIES_COLLECTION,
+            timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": granularity},
+        )
+        logger.info("Creata la time-series collection %s (granularity=%s)", TIMESERIES_COLLECTION, granularity)
+    except (CollectionInvalid, OperationFailure):
+        # Creata nel frattempo da un altro worker
+        pass
+
+
+def decode_window(doc: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Restituisce (timestamp int64 (N,), campioni float32 (N, 6)) senza copie."""
+    ts = np.frombuffer(doc["t"], dtype=_TS_DTYPE)
+    data = np.frombuffer(doc["data"], dtype=_DATA_DTYPE).reshape(-1, len(SENSOR_COLUMNS))
+    return ts, data
+
+
+def legacy_to_arrays(docs: List[dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Array da documenti per-campione, legacy (label nel documento) o time-series (label in meta)."""
+    ts = np.fromiter((to_epoch_ms(d["timestamp"]) for d in docs), dtype=_TS_DTYPE, count=len(docs))
+    data = np.fromiter(
+        (d[c] for d in docs for c in SENSOR_COLUMNS), dtype=np.float64, count=len(docs) * len(SENSOR_COLUMNS)
+    ).reshape(-1, len(SENSOR_COLUMNS))
+    labels = np.array([d["label"] if "label" in d else d["meta"]["label"] for d in docs], dtype=object)
+    return ts, data, labels
+
+
+async def load_session_samples(db, session_id: ObjectId) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Tutti i campioni della sessione ordinati per timestamp, da entrambi i
+    formati: (timestamp ms (M,), campioni (M, 6), label (M,)).
+    """
+    ts_parts, data_parts, label_parts = [], [], []
+    cursor = db[WINDOWS_COLLECTION].find({"session_id": session_id}).sort("start_ts", 1)
+    async for doc in cursor:
+        ts, data = decode_window(doc)
+        ts_parts.append(ts)
+        data_parts.append(data)
+        label_parts.append(np.full(len(ts), doc["label"], dtype=object))
+
+    per_sample = False
+    for collection, field in ((LEGACY_COLLECTION, "session_id"), (TIMESERIES_COLLECTION, "meta.session_id")):
+        docs = await db[collection].find({field: session_id}).sort("timestamp", 1).to_list(length=None)
+        if docs:
+            per_sample = True
+            for part, lst in zip(legacy_to_arrays(docs), (ts_parts, data_parts, label_parts)):
+                lst.append(part)
+
+    if not ts_parts:
+        return np.empty(0, dtype=_TS_DTYPE), np.empty((0, len(SENSOR_COLUMNS))), np.empty(0, dtype=object)
+
+    ts = np.concatenate(ts_parts)
+    data = np.concatenate(data_parts)
+    labels = np.concatenate(label_parts)
+    if per_sample and len(ts_parts) > 1:
+        order = np.argsort(ts, kind="stable")
+        ts, data, labels = ts[order], data[order], labels[order]
+    return ts, data, labels
+
+
+def encode_cursor(position: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(token: str) -> dict:
+    """Decodifica il cursore opaco di paginazione; ValueError se non valido."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if position["s"] not in ("legacy", "windows", "timeseries", "archive"):
+            raise ValueError(position["s"])
+        ObjectId(position["id"])
+        # t (ed e, se presente) sono millisecondi o, per l'archivio, un indice
+        for value in (position["t"], position.get("e", 0)):
+            if type(value) is not int or value < 0:
+                raise ValueError(value)
+        return position
+    except Exception as exc:
+        raise ValueError("Cursore non valido") from exc
+
+
+def _after(field: str, value, oid: str) -> dict:
+    return {"$or": [
+        {field: {"$gt": value}},
+        {field: value, "_id": {"$gt": ObjectId(oid)}},
+    ]}
+
+
+async def iter_session_chunks(
+    db,
+    session_id: ObjectId,
+    after: Optional[dict] = None,
+    batch_size: int = 100,
+) -> AsyncIterator[Tuple[np.ndarray, np.ndarray, np.ndarray, dict]]:
+    """
+    Scorre i campioni della sessione a blocchi, con memoria costante:
+    produce (timestamp ms, campioni (N, 6), label, posizione), dove posizione
+    e' il cursore (da passare come after) per riprendere dopo il blocco.
+
+    I documenti legacy precedono le finestre, che nel tempo li hanno
+    sostituiti, seguite dai campioni della time-series collection;
+    ciascun formato e' ordinato per (timestamp, _id).
+    """
+    if after is None or after["s"] == "legacy":
+        query = {"session_id": session_id}
+        if after is not None:
+            query.update(_after("timestamp", from_epoch_ms(after["t"]), after["id"]))
+        cursor = (
+            db[LEGACY_COLLECTION].find(query)
+            .sort([("timestamp", 1), ("_id", 1)])
+            .batch_size(LEGACY_CHUNK_SIZE)
+        )
+        docs = []
+        async for doc in cursor:
+            docs.append(doc)
+            if len(docs) == LEGACY_CHUNK_SIZE:
+                yield (*legacy_to_arrays(docs), _legacy_position(docs[-1]))
+                docs = []
+        if docs:
+            yield (*legacy_to_arrays(docs), _legacy_position(docs[-1]))
+        after = None
+
+    if after is None or after["s"] == "windows":
+        query = {"session_id": session_id}
+        if after is not None:
+            query.update(_after("start_ts", from_epoch_ms(after["t"]), after["id"]))
+        cursor = db[WINDOWS_COLLECTION].find(query).sort([("start_ts", 1), ("_id", 1)]).batch_size(batch_size)
+        async for doc in cursor:
+            ts, data = decode_window(doc)
+            labels = np.full(len(ts), doc["label"], dtype=object)
+            # "e" (fine della finestra) permette di riprendere anche dopo l'archiviazione (db.archive)
+            yield ts, data, labels, {
+                "s": "windows", "t": to_epoch_ms(doc["start_ts"]), "e": to_epoch_ms(doc["end_ts"]), "id": str(doc["_id"]),
+            }
+        after = None
+
+    query = {"meta.session_id": session_id}
+    if after is not None:
+        query.update(_after("timestamp", from_epoch_ms(after["t"]), after["id"]))
+    cursor = (
+        db[TIMESERIES_COLLECTION].find(query)
+        .sort([("timestamp", 1), ("_id", 1)])
+        .batch_size(LEGACY_CHUNK_SIZE)
+    )
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) == LEGACY_CHUNK_SIZE:
+            yield (*legacy_to_arrays(docs), _sample_position(docs[-1]))
+            docs = []
+    if docs:
+        yield (*legacy_to_arrays(docs), _sample_position(docs[-1]))
+
+
+def _legacy_position(doc: dict) -> dict:
+    return {"s": "legacy", "t": to_epoch_ms(doc["timestamp"]), "id": str(doc["_id"])}
+
+
+def _sample_position(doc: dict) -> dict:
+    return {"s": "timeseries", "t": to_epoch_ms(doc["timestamp"]), "id": str(doc["_id"])}
+
+
+def split_runs(labels: np.ndarray, window_size: int):
+    """Intervalli [start, end) di campioni consecutivi con la stessa label, lunghi al massimo window_size."""
+    start = 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[start] or i - start >= window_size:
+            yield start, i
+            start = i
+
+
+async def iter_timeseries_windows(db, session_id: ObjectId, window_size: int = 20) -> AsyncIterator[dict]:
+    """
+    Campioni della sessione nella time-series collection raggruppati in
+    documenti finestra (come db.migrate_behaviors), per chi lavora sulle finestre.
+    """
+    docs = await (
+        db[TIMESERIES_COLLECTION].find({"meta.session_id": session_id})
+        .sort("timestamp", 1)
+        .to_list(length=None)
+    )
+    if not docs:
+        return
+    ts, data, labels = legacy_to_arrays(docs)
+    for start, end in split_runs(labels, window_size):
+        yield encode_window(session_id, ts[start:end], data[start:end], labels[start], docs[start].get("model_version"))
+
+
+def _sample_summary_pipeline(session_field: str, session_id: ObjectId, label) -> List[dict]:
+    """Pipeline di session_summary sui documenti per-campione (legacy e time-series)."""
+    def mag(prefix):
+        return {"$sqrt": {"$add": [{"$multiply": [f"${prefix}{a}", f"${prefix}{a}"]} for a in "XYZ"]}}
+    return [
+        {"$match": {session_field: session_id}},
+        {"$project": {"label": label, "acc": mag("Acc"), "gyro": mag("Gyro")}},
+        {"$group": {
+            "_id": "$label",
+            "n": {"$sum": 1},
+            "acc_mag_sum": {"$sum": "$acc"},
+            "acc_mag_sumsq": {"$sum": {"$multiply": ["$acc", "$acc"]}},
+            "gyro_mag_sum": {"$sum": "$gyro"},
+            "gyro_mag_sumsq": {"$sum": {"$multiply": ["$gyro", "$gyro"]}},
+        }},
+    ]
+
+
+async def session_summary(db, session_id: ObjectId) -> dict:
+    """
+    Conteggi dei campioni per label e somme delle magnitudo della sessione,
+    calcolati lato Mongo su tutti i formati senza trasferire i campioni.
+    """
+    windows = db[WINDOWS_COLLECTION].aggregate([
+        {"$match": {"session_id": session_id}},
+        {"$group": {
+            "_id": "$label",
+            "n": {"$sum": "$n"},
+            "acc_mag_sum": {"$sum": "$stats.acc_mag_sum"},
+            "acc_mag_sumsq": {"$sum": "$stats.acc_mag_sumsq"},
+            "gyro_mag_sum": {"$sum": "$stats.gyro_mag_sum"},
+            "gyro_mag_sumsq": {"$sum": "$stats.gyro_mag_sumsq"},
+        }},
+    ])
+    per_sample = [
+        db[LEGACY_COLLECTION].aggregate(_sample_summary_pipeline("session_id", session_id, 1)),
+        db[TIMESERIES_COLLECTION].aggregate(_sample_summary_pipeline("meta.session_id", session_id, "$meta.label")),
+    ]
+
+    summary = {"counts": {}, "n": 0, **{key: 0.0 for key in _STAT_KEYS}}
+    for cursor in (windows, *per_sample):
+        async for row in cursor:
+            summary["counts"][row["_id"]] = summary["counts"].get(row["_id"], 0) + row["n"]
+            summary["n"] += row["n"]
+            for key in _STAT_KEYS:
+                summary[key] += row[key]
+    return summary
+
+
+def empty_session_aggregates() -> dict:
+    """Campi iniziali degli aggregati incrementali di una nuova sessione."""
+    return {
+        **{field: 0 for field in LABEL_COUNT_FIELDS.values()},
+        "agg": {"n": 0, **{key: 0.0 for key in _STAT_KEYS}},
+    }
+
+
+def window_increments(window_doc: dict) -> dict:
+    """
+    $inc da applicare al documento di sessione per una finestra ingerita:
+    conteggio della label e somme delle magnitudo. Gli incrementi sono
+    commutativi, quindi le update possono viaggiare in bulk non ordinate.
+    """
+    inc = {f"agg.{key}": window_doc["stats"][key] for key in _STAT_KEYS}
+    inc["agg.n"] = window_doc["n"]
+    field = LABEL_COUNT_FIELDS.get(window_doc["label"])
+    if field:
+        inc[field] = window_doc["n"]
+    return inc
+
+
+def summary_from_session(session_doc: dict):
+    """
+    Riepilogo nello stesso formato di session_summary a partire dagli
+    aggregati incrementali, o None per sessioni che non li hanno.
+    """
+    agg = session_doc.get("agg")
+    if agg is None:
+        return None
+    counts = {label: session_doc.get(field, 0) for label, field in LABEL_COUNT_FIELDS.items()}
+    return {"counts": counts, "n": agg["n"], **{key: agg[key] for key in _STAT_KEYS}}
+
+
+def magnitude_moments(summary: dict) -> Tuple[float, float, float, float]:
+    """(accel_mag_mean, accel_mag_std, gyro_mag_mean, gyro_mag_std) dalle somme di session_summary."""
+    n = summary["n"]
+    if not n:
+        return 0.0, 0.0, 0.0, 0.0
+    out = []
+    for prefix in ("acc", "gyro"):
+        mean = summary[f"{prefix}_mag_sum"] / n
+        var = max(summary[f"{prefix}_mag_sumsq"] / n - mean * mean, 0.0)
+        out.extend([mean, var ** 0.5])
+    return tuple(out)
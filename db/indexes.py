@@ -0,0 +1,171 @@
+"""
+Indici richiesti dalle route e diagnostica dei piani di esecuzione.
+
+    python -m db.indexes            # crea gli indici mancanti
+    python -m db.indexes --explain  # mostra i piani delle query delle route
+"""
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from core.registry import BEHAVIOR_MODEL, ModelUnavailable, model_registry
+from db.behavior_store import (
+    BEHAVIOR_STORAGE,
+    LEGACY_COLLECTION,
+    TIMESERIES_COLLECTION,
+    WINDOWS_COLLECTION,
+    ensure_timeseries_collection,
+)
+from db.mongodb import get_database
+from db.rollups import GRANULARITIES
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        # Solo gli utenti da ricalcolare hanno il campo
+        IndexModel([("urgency_dirty", ASCENDING)], name="urgency_dirty", sparse=True),
+    ],
+    "sessions": [
+        IndexModel([("user_id", ASCENDING), ("start_time", ASCENDING)], name="user_id_start_time"),
+        IndexModel([("end_time", ASCENDING)], name="end_time"),
+    ],
+    WINDOWS_COLLECTION: [
+        IndexModel([("session_id", ASCENDING), ("start_ts", ASCENDING), ("_id", ASCENDING)], name="session_id_start_ts_id"),
+    ],
+    LEGACY_COLLECTION: [
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)], name="session_id_timestamp_id"),
+    ],
+    # Solo in modalita' timeseries: create_indexes creerebbe una collection normale
+    **({
+        TIMESERIES_COLLECTION: [
+            IndexModel([("meta.session_id", ASCENDING), ("timestamp", ASCENDING)], name="meta_session_id_timestamp"),
+        ],
+    } if BEHAVIOR_STORAGE == "timeseries" else {}),
+    **{
+        collection: [
+            IndexModel([("user_id", ASCENDING), ("bucket", ASCENDING)], unique=True, name="user_id_bucket_unique"),
+            IndexModel([("bucket", ASCENDING)], name="bucket"),
+        ]
+        for collection in GRANULARITIES.values()
+    },
+}
+
+_OID = ObjectId()
+
+# Forma delle query delle route. allow_collscan marca le query che per
+# costruzione leggono tutta la collection (es. elenco utenti per l'admin).
+QUERY_SHAPES = [
+    {"route": "POST /api/auth/login, /register", "collection": "users", "filter": {"email": "user@example.com"}},
+    {"route": "get_current_user", "collection": "users", "filter": {"_id": _OID}},
+    {"route": "GET /api/sessions/", "collection": "sessions", "filter": {"user_id": _OID}},
+    {"route": "GET /api/users/{user_id}/sessions", "collection": "sessions",
+     "filter": {"user_id": _OID}, "sort": {"start_time": 1}},
+    {"route": "PATCH /api/sessions/stop", "collection": "sessions", "filter": {"_id": _OID, "user_id": _OID}},
+    {"route": "GET /api/sessions/{session_id}/behaviors", "collection": WINDOWS_COLLECTION,
+     "filter": {"session_id": _OID}, "sort": {"start_ts": 1, "_id": 1}},
+    {"route": "GET /api/sessions/{session_id}/behaviors (legacy)", "collection": LEGACY_COLLECTION,
+     "filter": {"session_id": _OID}, "sort": {"timestamp": 1, "_id": 1}},
+    *([{"route": "GET /api/sessions/{session_id}/behaviors (timeseries)", "collection": TIMESERIES_COLLECTION,
+        "filter": {"meta.session_id": _OID}, "sort": {"timestamp": 1, "_id": 1}}] if BEHAVIOR_STORAGE == "timeseries" else []),
+    {"route": "maintenance job (utenti da ricalcolare)", "collection": "users",
+     "filter": {"urgency_dirty": {"$gt": 0}}},
+    {"route": "maintenance job ($group)", "collection": "sessions",
+     "filter": {"user_id": {"$in": [_OID]}, "maintenance_urgency": {"$ne": None}}},
+    {"route": "archive job", "collection": "sessions",
+     "filter": {"end_time": {"$ne": None, "$lt": datetime(2024, 1, 1)}, "archive.purged_at": {"$exists": False},
+                "restored_at": {"$exists": False}}},
+    {"route": "GET /api/report/rollups", "collection": GRANULARITIES["day"],
+     "filter": {"bucket": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2025, 1, 1)}, "user_id": _OID}},
+    {"route": "GET /api/report/rollups (fleet)", "collection": GRANULARITIES["day"],
+     "filter": {"bucket": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2025, 1, 1)}}},
+    {"route": "GET /api/users/", "collection": "users",
+     "filter": {"email": {"$ne": "admin@admin.com"}}, "allow_collscan": True},
+]
+
+
+async def _sampling_rate():
+    """Frequenza di campionamento del modello di classificazione, se disponibile."""
+    try:
+        return (await model_registry.aget(BEHAVIOR_MODEL)).bundle["sampling_rate"]
+    except ModelUnavailable:
+        return None
+
+
+async def ensure_indexes(db) -> None:
+    """Crea gli indici dichiarati in INDEXES (operazione idempotente)."""
+    if BEHAVIOR_STORAGE == "timeseries":
+        # La time-series collection va creata prima dei suoi indici
+        await ensure_timeseries_collection(db, await _sampling_rate())
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as exc:
+            # Es. indice unique su dati gia' duplicati: l'app resta comunque avviabile
+            logger.error("Creazione indici su %s non riuscita: %s", collection, exc)
+
+
+def _stages(plan) -> List[str]:
+    """Tutti gli stage di un piano, inclusi quelli annidati."""
+    found = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            found.append(plan["stage"])
+        for value in plan.values():
+            found.extend(_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            found.extend(_stages(item))
+    return found
+
+
+async def explain_query_shapes(db) -> List[dict]:
+    """Esegue explain() su ogni forma di QUERY_SHAPES e segnala le scansioni complete."""
+    report = []
+    for shape in QUERY_SHAPES:
+        find = {"find": shape["collection"], "filter": shape["filter"]}
+        if "sort" in shape:
+            find["sort"] = shape["sort"]
+        result = await db.command({"explain": find, "verbosity": "queryPlanner"})
+        winning = result["queryPlanner"]["winningPlan"]
+        stages = _stages(winning)
+        collscan = "COLLSCAN" in stages
+        report.append({
+            "route": shape["route"],
+            "collection": shape["collection"],
+            "stages": stages,
+            "collscan": collscan,
+            "flagged": collscan and not shape.get("allow_collscan", False),
+        })
+    return report
+
+
+async def _main(explain: bool) -> None:
+    db = await get_database()
+    await ensure_indexes(db)
+    if explain:
+        report = await explain_query_shapes(db)
+        print(json.dumps(report, indent=2))
+        flagged = [r["route"] for r in report if r["flagged"]]
+        if flagged:
+            raise SystemExit(f"Collection scan su: {', '.join(flagged)}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--explain", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(_main(args.explain))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Lease sui job in background: con piu' worker uvicorn un solo processo alla
+volta esegue ciascun job. Lo stato del job (lease e campi propri del job)
+sta in un documento della collection job_state con _id = nome del job.
+"""
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+JOB_STATE_COLLECTION = "job_state"
+
+# Identifica questo processo come detentore dei lease
+_owner = uuid.uuid4().hex
+
+
+async def acquire_lease(db, job_id: str, lease_sec: float, now: Optional[datetime] = None) -> Optional[dict]:
+    """Stato del job job_id se il lease e' stato ottenuto, altrimenti None."""
+    now = now or datetime.utcnow()
+    try:
+        return await db[JOB_STATE_COLLECTION].find_one_and_update(
+            {"_id": job_id, "$or": [{"lease_until": {"$lt": now}}, {"lease_owner": _owner}]},
+            {"$set": {"lease_owner": _owner, "lease_until": now + timedelta(seconds=lease_sec)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Il documento esiste ed e' in lease a un altro processo
+        return None
+
+
+async def release_lease(db, job_id: str, **state) -> None:
+    """Rilascia il lease, se ancora posseduto, salvando state nel documento del job."""
+    await db[JOB_STATE_COLLECTION].update_one(
+        {"_id": job_id, "lease_owner": _owner},
+        {"$set": {**state, "lease_until": datetime.utcnow()}},
+    )
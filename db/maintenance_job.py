@@ -0,0 +1,118 @@
+"""
+Ricalcolo periodico dell'urgenza di manutenzione degli utenti.
+
+L'urgenza di un utente e' la media delle urgenze delle sue sessioni.
+stop_session, dopo aver scritto l'urgenza della sessione, incrementa il
+contatore urgency_dirty dell'utente; a ogni giro il job prende gli utenti
+con il contatore, ricalcola la media con un $group per blocco di utenti e la
+scrive con bulk UpdateOne che rimuovono il contatore solo se non e' cambiato
+nel frattempo: uno stop concorrente lascia l'utente da ricalcolare al giro
+successivo. Non dipende dagli orologi dei worker.
+Il primo giro ricalcola tutta la flotta.
+
+Con piu' worker uvicorn un solo processo alla volta esegue il job, grazie a
+un lease (db.leases). on_updated riceve l'id di ogni utente aggiornato, ad
+esempio per invalidare la cache degli utenti del processo.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from core.metrics import Counter, Histogram
+from db.leases import acquire_lease, release_lease
+from db.mongodb import get_database
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "maintenance_urgency"
+
+MAINTENANCE_JOB_INTERVAL_SEC = float(os.getenv("MAINTENANCE_JOB_INTERVAL_SEC", "60"))
+# Utenti per aggregazione e numero di aggregazioni in parallelo
+MAINTENANCE_JOB_BATCH_SIZE = int(os.getenv("MAINTENANCE_JOB_BATCH_SIZE", "500"))
+MAINTENANCE_JOB_CONCURRENCY = int(os.getenv("MAINTENANCE_JOB_CONCURRENCY", "4"))
+# Durata del lease: oltre, un altro worker puo' riprendere il job
+MAINTENANCE_JOB_LEASE_SEC = float(os.getenv("MAINTENANCE_JOB_LEASE_SEC", "300"))
+
+JOB_SECONDS = Histogram("maintenance_job_seconds", "Durata di un giro del job di manutenzione")
+USERS_UPDATED = Counter("maintenance_job_users_updated_total", "Utenti con urgenza ricalcolata")
+
+async def _recompute(db, dirty: List[Tuple[ObjectId, Optional[int]]], on_updated: Optional[Callable[[str], None]]) -> int:
+    """dirty: (utente, valore letto di urgency_dirty, o None nel ricalcolo completo)."""
+    user_ids = [uid for uid, _ in dirty]
+    rows = await db.sessions.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}, "maintenance_urgency": {"$ne": None}}},
+        {"$group": {"_id": "$user_id", "score": {"$avg": "$maintenance_urgency"}}},
+    ]).to_list(length=None)
+    scores = {r["_id"]: r["score"] for r in rows}
+    # Utenti senza sessioni valutate tornano a None, come nel calcolo originale
+    ops = []
+    for uid, seen in dirty:
+        if seen is None:
+            ops.append(UpdateOne({"_id": uid}, {"$set": {"maintenance_urgency": scores.get(uid)}}))
+        else:
+            ops.append(UpdateOne(
+                {"_id": uid, "urgency_dirty": seen},
+                {"$set": {"maintenance_urgency": scores.get(uid)}, "$unset": {"urgency_dirty": ""}},
+            ))
+    await db.users.bulk_write(ops, ordered=False)
+    if on_updated is not None:
+        for uid in user_ids:
+            on_updated(str(uid))
+    return len(ops)
+
+
+async def run_maintenance_once(
+    db,
+    batch_size: int = MAINTENANCE_JOB_BATCH_SIZE,
+    concurrency: int = MAINTENANCE_JOB_CONCURRENCY,
+    on_updated: Optional[Callable[[str], None]] = None,
+) -> Optional[int]:
+    """Un giro del job; restituisce gli utenti aggiornati, o None senza lease."""
+    now = datetime.utcnow()
+    state = await acquire_lease(db, JOB_ID, MAINTENANCE_JOB_LEASE_SEC, now)
+    if state is None:
+        return None
+
+    if state.get("initialized_at") is None:
+        dirty = [(uid, None) for uid in await db.sessions.distinct("user_id")]
+    else:
+        users = db.users.find({"urgency_dirty": {"$gt": 0}}, {"urgency_dirty": 1})
+        dirty = [(u["_id"], u["urgency_dirty"]) async for u in users]
+
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_batch(batch):
+        async with slots:
+            return await _recompute(db, batch, on_updated)
+
+    batches = [dirty[i:i + batch_size] for i in range(0, len(dirty), batch_size)]
+    updated = sum(await asyncio.gather(*(run_batch(b) for b in batches)))
+
+    # Il ricalcolo completo si considera fatto solo a giro completato
+    await release_lease(db, JOB_ID, initialized_at=state.get("initialized_at") or now, last_run_users=updated)
+    USERS_UPDATED.inc(updated)
+    return updated
+
+
+async def run_maintenance_job(
+    interval: float = MAINTENANCE_JOB_INTERVAL_SEC,
+    on_updated: Optional[Callable[[str], None]] = None,
+) -> None:
+    """Loop del job, avviato nel lifespan dell'app."""
+    while True:
+        try:
+            db = await get_database()
+            start = time.perf_counter()
+            updated = await run_maintenance_once(db, on_updated=on_updated)
+            JOB_SECONDS.observe(time.perf_counter() - start)
+            if updated:
+                logger.info("Urgenza di manutenzione ricalcolata per %d utenti", updated)
+        except Exception:
+            logger.exception("Job di manutenzione non riuscito")
+        await asyncio.sleep(interval)
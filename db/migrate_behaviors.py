@@ -0,0 +1,66 @@
+"""
+Migrazione dei documenti per-campione della collection behaviors nel
+formato a finestre di behavior_windows.
+
+    python -m db.migrate_behaviors [--window-size 20] [--dry-run]
+
+Per ogni sessione i campioni vengono ordinati per timestamp e raggruppati in
+finestre di campioni consecutivi con la stessa label (al massimo
+--window-size campioni ciascuna). Le finestre create portano il flag
+"migrated": se la migrazione si interrompe, al rilancio quelle della
+sessione vengono ricreate da capo e i documenti legacy sono rimossi solo
+dopo l'inserimento completo delle finestre. Durante lo spostamento di una
+sessione i lettori possono vederne i campioni due volte: conviene eseguirla
+a servizio fermo o in una finestra di manutenzione.
+"""
+import argparse
+import asyncio
+import logging
+
+from db.behavior_store import LEGACY_COLLECTION, WINDOWS_COLLECTION, legacy_to_arrays, encode_window, split_runs
+from db.mongodb import get_database
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate_session(db, session_id, window_size: int, dry_run: bool = False) -> int:
+    docs = await db[LEGACY_COLLECTION].find({"session_id": session_id}).sort("timestamp", 1).to_list(length=None)
+    if not docs:
+        return 0
+    ts, data, labels = legacy_to_arrays(docs)
+    windows = []
+    for start, end in split_runs(labels, window_size):
+        doc = encode_window(session_id, ts[start:end], data[start:end], labels[start])
+        doc["migrated"] = True
+        windows.append(doc)
+    if dry_run:
+        return len(windows)
+
+    await db[WINDOWS_COLLECTION].delete_many({"session_id": session_id, "migrated": True})
+    await db[WINDOWS_COLLECTION].insert_many(windows, ordered=True)
+    await db[LEGACY_COLLECTION].delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    return len(windows)
+
+
+async def migrate(window_size: int, dry_run: bool = False) -> None:
+    db = await get_database()
+    session_ids = await db[LEGACY_COLLECTION].distinct("session_id")
+    total_windows = 0
+    for i, sid in enumerate(session_ids, 1):
+        n = await migrate_session(db, sid, window_size, dry_run)
+        total_windows += n
+        logger.info("[%d/%d] sessione %s: %d finestre", i, len(session_ids), sid, n)
+    logger.info("Migrazione completata: %d sessioni, %d finestre", len(session_ids), total_windows)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--window-size", type=int, default=20)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.window_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,53 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 import os
 
+from core.metrics import Counter, Histogram
+
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "driving_app_db")
 
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_seconds", "Latenza dei comandi Mongo", ["collection", "command"],
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Comandi Mongo falliti", ["collection", "command"],
+)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Latenza di ogni comando per collection, dagli eventi di monitoring di
+    pymongo (la durata e' misurata dal driver, qui si registra soltanto).
+    """
+
+    def __init__(self):
+        # (request_id, connessione) -> collection, tra started e succeeded/failed
+        self._pending = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self._pending[(event.request_id, event.connection_id)] = target if isinstance(target, str) else ""
+
+    def _finish(self, event):
+        return self._pending.pop((event.request_id, event.connection_id), "")
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        MONGO_COMMAND_FAILURES.inc(collection=collection, command=event.command_name)
+
+
 _client: AsyncIOMotorClient = None
 
 async def get_database():
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(MONGODB_URI)
-    return _client[DB_NAME]
\ No newline at end of file
+        _client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[CommandMetrics()])
+    return _client[DB_NAME]
@@ -0,0 +1,223 @@
+"""
+Rollup orari e giornalieri per utente, per le analisi sulla flotta.
+
+Ogni bucket (user_id, bucket) contiene solo somme, aggiornate con $inc:
+campioni per label, somme delle magnitudo, secondi di guida, sessioni e
+somma delle urgenze. Le finestre le aggiornano all'ingestione, stop_session
+aggiunge durata e urgenza della sessione. Medie e deviazioni standard si
+ricavano in lettura, anche su intervalli arbitrari.
+
+    python -m db.rollups --rebuild   # ricostruisce i rollup dai dati grezzi
+
+Il rebuild legge le finestre di behavior_windows, i campioni della
+time-series collection e gli archivi delle sessioni archiviate (db.archive):
+i campioni legacy vanno prima convertiti con python -m db.migrate_behaviors.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from db.archive import archive_windows
+from db.behavior_store import WINDOWS_COLLECTION, iter_timeseries_windows, magnitude_moments, window_increments
+from db.mongodb import get_database
+
+HOURLY_COLLECTION = "rollups_hourly"
+DAILY_COLLECTION = "rollups_daily"
+GRANULARITIES = {"hour": HOURLY_COLLECTION, "day": DAILY_COLLECTION}
+
+
+def naive_utc(dt: datetime) -> datetime:
+    """datetime UTC senza tzinfo, come quelli letti da Mongo."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def truncate(dt: datetime, granularity: str) -> datetime:
+    """Inizio del bucket che contiene dt."""
+    dt = naive_utc(dt).replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0) if granularity == "day" else dt
+
+
+def _step(granularity: str) -> timedelta:
+    return timedelta(days=1) if granularity == "day" else timedelta(hours=1)
+
+
+def _update_ops(increments: Dict[tuple, Dict[str, float]], user_id: ObjectId) -> Dict[str, List[UpdateOne]]:
+    ops = defaultdict(list)
+    for (granularity, bucket), inc in increments.items():
+        ops[GRANULARITIES[granularity]].append(
+            UpdateOne({"user_id": user_id, "bucket": bucket}, {"$inc": inc}, upsert=True)
+        )
+    return ops
+
+
+def window_rollup_ops(user_id: ObjectId, window_docs: Iterable[dict]) -> Dict[str, List[UpdateOne]]:
+    """
+    Update per collection dei bucket toccati dalle finestre; le finestre
+    dello stesso bucket diventano un solo $inc.
+    """
+    increments: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+    for doc in window_docs:
+        inc = {
+            # Stessi incrementi del documento di sessione, senza il prefisso "agg."
+            ("samples" if key == "agg.n" else key.replace("agg.", "")): value
+            for key, value in window_increments(doc).items()
+        }
+        for granularity in GRANULARITIES:
+            bucket_inc = increments[(granularity, truncate(doc["start_ts"], granularity))]
+            for key, value in inc.items():
+                bucket_inc[key] += value
+    return _update_ops(increments, user_id)
+
+
+def session_rollup_ops(
+    user_id: ObjectId,
+    start_time: datetime,
+    end_time: datetime,
+    maintenance_urgency: Optional[float],
+) -> Dict[str, List[UpdateOne]]:
+    """
+    Update per collection alla chiusura di una sessione: la durata e'
+    ripartita tra i bucket attraversati, la sessione conta nel bucket di
+    inizio e l'urgenza in quello di fine.
+    """
+    increments: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+    for granularity in GRANULARITIES:
+        bucket = truncate(start_time, granularity)
+        increments[(granularity, bucket)]["sessions"] += 1
+        while bucket < end_time:
+            nxt = bucket + _step(granularity)
+            seconds = (min(nxt, end_time) - max(bucket, start_time)).total_seconds()
+            if seconds > 0:
+                increments[(granularity, bucket)]["driving_seconds"] += seconds
+            bucket = nxt
+        if maintenance_urgency is not None:
+            end_inc = increments[(granularity, truncate(end_time, granularity))]
+            end_inc["urgency_sum"] += maintenance_urgency
+            end_inc["urgency_count"] += 1
+    return _update_ops(increments, user_id)
+
+
+_SUM_FIELDS = [
+    "count_aggressive", "count_normal", "count_slow", "samples",
+    "acc_mag_sum", "acc_mag_sumsq", "gyro_mag_sum", "gyro_mag_sumsq",
+    "driving_seconds", "sessions", "urgency_sum", "urgency_count",
+]
+
+
+def rollup_view(doc: dict) -> dict:
+    """Statistiche leggibili da un bucket (o da una somma di bucket)."""
+    acc_mean, acc_std, gyro_mean, gyro_std = magnitude_moments({"n": doc.get("samples", 0), **doc})
+    urgency_count = doc.get("urgency_count", 0)
+    return {
+        "count_aggressive": int(doc.get("count_aggressive", 0)),
+        "count_normal": int(doc.get("count_normal", 0)),
+        "count_slow": int(doc.get("count_slow", 0)),
+        "sessions": int(doc.get("sessions", 0)),
+        "driving_minutes": doc.get("driving_seconds", 0) / 60.0,
+        "accel_mag_mean": acc_mean,
+        "accel_mag_std": acc_std,
+        "gyro_mag_mean": gyro_mean,
+        "gyro_mag_std": gyro_std,
+        "avg_urgency": doc["urgency_sum"] / urgency_count if urgency_count else None,
+    }
+
+
+def _sum_stage(group_id) -> dict:
+    return {"$group": {"_id": group_id, **{f: {"$sum": f"${f}"} for f in _SUM_FIELDS}}}
+
+
+async def rollup_series(
+    db,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    user_id: Optional[ObjectId] = None,
+) -> List[dict]:
+    """Bucket in [start, end) di un utente, o della flotta sommando gli utenti."""
+    match = {"bucket": {"$gte": truncate(start, granularity), "$lt": end}}
+    if user_id is not None:
+        match["user_id"] = user_id
+    pipeline = [{"$match": match}, _sum_stage("$bucket"), {"$sort": {"_id": 1}}]
+    rows = await db[GRANULARITIES[granularity]].aggregate(pipeline).to_list(length=None)
+    return [{"bucket": r["_id"], **rollup_view(r)} for r in rows]
+
+
+async def rollup_by_user(db, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    """Totali per utente su [start, end)."""
+    pipeline = [
+        {"$match": {"bucket": {"$gte": truncate(start, granularity), "$lt": end}}},
+        _sum_stage("$user_id"),
+    ]
+    rows = await db[GRANULARITIES[granularity]].aggregate(pipeline).to_list(length=None)
+    return [{"user_id": r["_id"], **rollup_view(r)} for r in rows]
+
+
+async def rebuild_rollups(db) -> int:
+    """Ricalcola da zero i rollup da sessioni e finestre; restituisce le sessioni lette."""
+    for collection in GRANULARITIES.values():
+        await db[collection].delete_many({})
+
+    n_sessions = 0
+    projection = {"user_id": 1, "start_time": 1, "end_time": 1, "maintenance_urgency": 1, "archive": 1}
+    async for session in db.sessions.find({}, projection):
+        n_sessions += 1
+        ops = defaultdict(list)
+        async for batch in _session_windows(db, session):
+            for collection, col_ops in window_rollup_ops(session["user_id"], batch).items():
+                ops[collection].extend(col_ops)
+        if session.get("end_time"):
+            rollup = session_rollup_ops(
+                session["user_id"], session["start_time"], session["end_time"], session.get("maintenance_urgency")
+            )
+            for collection, col_ops in rollup.items():
+                ops[collection].extend(col_ops)
+        for collection, col_ops in ops.items():
+            if col_ops:
+                await db[collection].bulk_write(col_ops, ordered=False)
+    return n_sessions
+
+
+async def _session_windows(db, session: dict):
+    """Finestre della sessione a blocchi, dall'archivio se la sessione e' archiviata."""
+    if session.get("archive"):
+        # Eventuali campioni ancora in Mongo sono copie in attesa di cancellazione
+        yield await asyncio.to_thread(archive_windows, session["archive"], session["_id"])
+        return
+    windows = db[WINDOWS_COLLECTION].find({"session_id": session["_id"]}, {"t": 0, "data": 0})
+    for source in (windows, iter_timeseries_windows(db, session["_id"])):
+        async for batch in _batches(source, 1000):
+            yield batch
+
+
+async def _batches(cursor, size: int):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="ricostruisce i rollup dai dati grezzi")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    db = await get_database()
+    n = await rebuild_rollups(db)
+    print(f"Rollup ricostruiti da {n} sessioni")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,56 @@
+"""
+Viste materializzate usate dai report della dashboard.
+
+user_behavior_counts contiene, per ogni utente, la somma dei conteggi per
+label di tutte le sue sessioni. Viene ricalcolata con $merge a partire dai
+contatori incrementali dei documenti di sessione: per un singolo utente alla
+chiusura di una sessione e per l'intera flotta a intervalli regolari, cosi'
+da includere anche le sessioni in corso. Il refresh della flotta gira in un
+solo worker alla volta (db.leases).
+"""
+import asyncio
+import logging
+import os
+from typing import Iterable, Optional
+
+from bson import ObjectId
+
+from db.behavior_store import LABEL_COUNT_FIELDS
+from db.leases import acquire_lease
+from db.mongodb import get_database
+
+logger = logging.getLogger(__name__)
+
+USER_COUNTS_COLLECTION = "user_behavior_counts"
+JOB_ID = "views_refresh"
+VIEWS_REFRESH_INTERVAL_SEC = float(os.getenv("VIEWS_REFRESH_INTERVAL_SEC", "60"))
+
+
+async def refresh_user_behavior_counts(db, user_ids: Optional[Iterable[ObjectId]] = None) -> None:
+    """Ricalcola la vista per gli utenti indicati, o per tutti se user_ids e' None."""
+    pipeline = []
+    if user_ids is not None:
+        pipeline.append({"$match": {"user_id": {"$in": list(user_ids)}}})
+    pipeline += [
+        {"$group": {
+            "_id": "$user_id",
+            **{field: {"$sum": {"$ifNull": [f"${field}", 0]}} for field in LABEL_COUNT_FIELDS.values()},
+        }},
+        {"$set": {"updated_at": "$$NOW"}},
+        {"$merge": {"into": USER_COUNTS_COLLECTION, "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    await db.sessions.aggregate(pipeline).to_list(length=None)
+
+
+async def run_views_refresh(interval: float = VIEWS_REFRESH_INTERVAL_SEC) -> None:
+    """Loop di refresh periodico dell'intera flotta, avviato nel lifespan dell'app."""
+    while True:
+        try:
+            db = await get_database()
+            # Il lease non viene rilasciato: scade dopo un intervallo, quindi
+            # la flotta viene ricalcolata una volta per intervallo in tutto il deployment
+            if await acquire_lease(db, JOB_ID, interval) is not None:
+                await refresh_user_behavior_counts(db)
+        except Exception:
+            logger.exception("Refresh di %s non riuscito", USER_COUNTS_COLLECTION)
+        await asyncio.sleep(interval)
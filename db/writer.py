@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from core.metrics import Counter, Gauge, Histogram
+from db.behavior_store import TIMESERIES_COLLECTION, written_samples
+from db.mongodb import get_database
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_MAX_OPS = int(os.getenv("WRITE_BUFFER_MAX_OPS", "20000"))
+WRITE_FLUSH_SIZE = int(os.getenv("WRITE_FLUSH_SIZE", "1000"))
+WRITE_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_FLUSH_INTERVAL_MS", "250"))
+WRITE_RETRY_DELAY_SEC = 1.0
+
+FLUSH_SIZE = Histogram(
+    "bulk_writer_flush_ops", "Operazioni per bulk_write", ["collection"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+WRITE_LATENCY = Histogram("bulk_writer_write_seconds", "Durata delle bulk_write", ["collection"])
+QUEUE_DEPTH = Gauge("bulk_writer_queue_depth", "Operazioni bufferizzate in attesa di scrittura")
+WRITE_ERRORS = Counter("bulk_writer_errors_total", "Operazioni scartate per errori non recuperabili", ["collection"])
+
+
+class BulkWriter:
+    """
+    Buffer write-behind condiviso tra le connessioni: le operazioni vengono
+    accumulate e scritte con bulk_write non ordinate quando si supera
+    flush_size oppure ogni flush_interval_ms. Il buffer e' limitato a
+    max_ops operazioni; oltre, write() attende che un flush liberi spazio.
+    """
+
+    def __init__(
+        self,
+        max_ops: int = WRITE_BUFFER_MAX_OPS,
+        flush_size: int = WRITE_FLUSH_SIZE,
+        flush_interval_ms: float = WRITE_FLUSH_INTERVAL_MS,
+    ):
+        self.max_ops = max(1, max_ops)
+        self.flush_size = max(1, min(flush_size, self.max_ops))
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._buffer: List[Tuple[str, object]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def write(self, collection: str, ops: list) -> None:
+        """Accoda operazioni pymongo (InsertOne, UpdateOne, ...) per la collection."""
+        if not ops:
+            return
+        self._ensure_started()
+        async with self._space:
+            while self._buffer and len(self._buffer) + len(ops) > self.max_ops:
+                self._wakeup.set()
+                await self._space.wait()
+            self._buffer.extend((collection, op) for op in ops)
+        QUEUE_DEPTH.set(len(self._buffer))
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Scrive subito tutto il contenuto del buffer."""
+        if self._task is None:
+            return
+        async with self._flush_lock:
+            while self._buffer:
+                batch, self._buffer = self._buffer, []
+                QUEUE_DEPTH.set(0)
+                failed = await self._write_batch(batch)
+                async with self._space:
+                    if failed:
+                        # Errore transitorio: le operazioni tornano in testa al buffer
+                        self._buffer[:0] = failed
+                        QUEUE_DEPTH.set(len(self._buffer))
+                    self._space.notify_all()
+                if failed:
+                    raise ConnectionError("Scrittura su MongoDB non riuscita")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.flush()
+        except ConnectionError:
+            logger.error("Chiusura con %d operazioni non scritte", len(self._buffer))
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except ConnectionError:
+                await asyncio.sleep(WRITE_RETRY_DELAY_SEC)
+
+    async def _write_batch(self, batch: List[Tuple[str, object]]) -> List[Tuple[str, object]]:
+        """Scrive il batch raggruppato per collection; restituisce le operazioni da ritentare."""
+        db = await get_database()
+        by_collection = {}
+        for collection, op in batch:
+            by_collection.setdefault(collection, []).append(op)
+
+        failed = []
+        for collection, ops in by_collection.items():
+            if collection == TIMESERIES_COLLECTION:
+                try:
+                    ops = await _unwritten_samples(db, ops)
+                except PyMongoError:
+                    logger.exception("Verifica degli insert ritentati su %s non riuscita", collection)
+                    failed.extend((collection, op) for op in ops)
+                    continue
+                if not ops:
+                    continue
+            FLUSH_SIZE.observe(len(ops), collection=collection)
+            start = time.perf_counter()
+            try:
+                await db[collection].bulk_write(ops, ordered=False)
+            except BulkWriteError as exc:
+                # Errori sui singoli documenti: ritentare non servirebbe. I duplicate
+                # key (11000) derivano da un retry di insert gia' andati a buon fine,
+                # dato che pymongo assegna l'_id al documento alla prima esecuzione.
+                # Nelle time-series _id non e' unico: li filtra _unwritten_samples.
+                errors = [e for e in exc.details.get("writeErrors", []) if e.get("code") != 11000]
+                if errors:
+                    WRITE_ERRORS.inc(len(errors), collection=collection)
+                    logger.error("bulk_write su %s: %d operazioni fallite", collection, len(errors))
+            except PyMongoError:
+                logger.exception("bulk_write su %s non riuscita, verra' ritentata", collection)
+                failed.extend((collection, op) for op in ops)
+            WRITE_LATENCY.observe(time.perf_counter() - start, collection=collection)
+        return failed
+
+
+async def _unwritten_samples(db, ops: list) -> list:
+    """
+    Insert per la time-series collection esclusi quelli gia' scritti da un
+    tentativo precedente, finito con un errore transitorio dopo aver applicato
+    parte del batch: senza indice unico su _id verrebbero inseriti di nuovo.
+    Gli insert gia' tentati si riconoscono dall'_id assegnato da pymongo.
+    """
+    retried = [op._doc for op in ops if isinstance(op, InsertOne) and "_id" in op._doc]
+    if not retried:
+        return ops
+    written = await written_samples(db, retried)
+    return [op for op in ops if not (isinstance(op, InsertOne) and op._doc.get("_id") in written)]
+
+
+bulk_writer = BulkWriter()
@@ -1,14 +1,58 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api import auth, sessions, behavior, report, users
+from fastapi.responses import PlainTextResponse
+from api import auth, sessions, behavior, report, users, admin, live, dependencies
+from core.executor import inference_executor
+from core.metrics import render_latest
+from core.pubsub import live_hub
+from core.slowlog import SlowRequestMiddleware, slow_log
+from db.archive import ARCHIVE_AFTER_DAYS, run_archive_job
+from db.indexes import ensure_indexes
+from db.maintenance_job import run_maintenance_job
+from db.mongodb import get_database
+from db.views import run_views_refresh
+from db.writer import bulk_writer
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    try:
+        await ensure_indexes(await get_database())
+    except Exception:
+        logger.exception("Bootstrap degli indici non riuscito")
+    views_task = asyncio.create_task(run_views_refresh())
+    # La cache degli utenti sta nel layer API: il job la invalida tramite callback
+    maintenance_task = asyncio.create_task(run_maintenance_job(on_updated=dependencies.invalidate_user))
+    archive_task = asyncio.create_task(run_archive_job()) if ARCHIVE_AFTER_DAYS > 0 else None
+    await live_hub.start()
+    slow_log.start()
+    yield
+    slow_log.stop()
+    views_task.cancel()
+    maintenance_task.cancel()
+    if archive_task is not None:
+        archive_task.cancel()
+    await live_hub.stop()
+    await behavior.inference_batcher.stop()
+    inference_executor.shutdown()
+    await bulk_writer.stop()
 
-app = FastAPI(title="Driving App Server")
+
+app = FastAPI(title="Driving App Server", lifespan=lifespan)
 app.include_router(auth.router)
 app.include_router(sessions.router)
 app.include_router(behavior.router)
 app.include_router(report.router)
 app.include_router(users.router)
+app.include_router(admin.router)
+app.include_router(live.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +60,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(SlowRequestMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+
+class RollupStats(BaseModel):
+    count_aggressive: int
+    count_normal: int
+    count_slow: int
+    sessions: int
+    driving_minutes: float
+    accel_mag_mean: float
+    accel_mag_std: float
+    gyro_mag_mean: float
+    gyro_mag_std: float
+    avg_urgency: Optional[float] = None
+
+
+class RollupBucket(RollupStats):
+    bucket: datetime
+
+
+class UserRollup(RollupStats):
+    user_id: str
+    full_name: Optional[str] = None
@@ -20,3 +20,16 @@ class SessionResp(BaseModel):
     count_slow: Optional[int] = None
     maintenance_urgency: Optional[float] = None
 
+
+def session_row(doc: dict) -> dict:
+    """Documento di sessione proiettato sui campi di SessionResp, senza validazione."""
+    return {
+        "id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]),
+        "start_time": doc["start_time"],
+        "end_time": doc.get("end_time"),
+        "count_aggressive": doc.get("count_aggressive"),
+        "count_normal": doc.get("count_normal"),
+        "count_slow": doc.get("count_slow"),
+        "maintenance_urgency": doc.get("maintenance_urgency"),
+    }
@@ -19,6 +19,16 @@ class UserPublic(BaseModel):
     maintenance_urgency: Optional[float] = None
 
 
+def user_row(doc: dict) -> dict:
+    """Documento utente proiettato sui campi di UserPublic, senza validazione."""
+    return {
+        "id": str(doc["_id"]),
+        "email": doc["email"],
+        "full_name": doc["full_name"],
+        "registration_date": doc["registration_date"],
+        "maintenance_urgency": doc.get("maintenance_urgency"),
+    }
+
 
 class UserRegister(BaseModel):
     email: EmailStr
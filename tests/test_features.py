@@ -0,0 +1,66 @@
+"""
+core.features deve restituire le stesse feature dell'implementazione
+originale basata su pandas (benchmarks.bench_features.pandas_reference).
+
+    python -m pytest tests
+"""
+import joblib
+import numpy as np
+import pytest
+
+from benchmarks.bench_features import pandas_reference, random_window
+from core.features import N_FEATURES, SENSOR_COLUMNS, extract_features_from_window
+from core.registry import BEHAVIOR_MODEL_PATH
+
+
+def _window(rows):
+    return [
+        {"timestamp": 1_700_000_000_000 + i * 500, **dict(zip(SENSOR_COLUMNS, map(float, row)))}
+        for i, row in enumerate(rows)
+    ]
+
+
+def _assert_parity(window):
+    expected = np.asarray(pandas_reference(window))
+    got = extract_features_from_window(window)
+    assert got.shape == (N_FEATURES,)
+    assert np.allclose(got, expected, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("n", [2, 20, 41])
+def test_random_windows(n):
+    rng = np.random.default_rng(n)
+    for _ in range(200):
+        _assert_parity(random_window(rng, n))
+
+
+def test_constant_window():
+    # std nulla su tutte le colonne
+    _assert_parity(_window(np.tile([0.0, 0.0, 1.0, 0.5, -0.5, 0.0], (20, 1))))
+    _assert_parity(_window(np.zeros((20, 6))))
+
+
+def test_single_sample():
+    _assert_parity(_window([[0.1, -0.2, 0.98, 12.0, -3.0, 0.5]]))
+
+
+def test_feature_order():
+    # Colonna i costante a i: mean = min = max = i, std = 0, nell'ordine mean, std, min, max
+    window = _window(np.tile(np.arange(1.0, 7.0), (5, 1)))
+    features = extract_features_from_window(window).reshape(-1, 4)
+    assert features[:6].tolist() == [[float(i), 0.0, float(i), float(i)] for i in range(1, 7)]
+    assert np.allclose(features[6], np.sqrt(1 + 4 + 9) * np.array([1, 0, 1, 1]))
+    assert np.allclose(features[7], np.sqrt(16 + 25 + 36) * np.array([1, 0, 1, 1]))
+
+
+def test_bundled_model_predictions():
+    try:
+        model = joblib.load(BEHAVIOR_MODEL_PATH)["model"]
+    except FileNotFoundError:
+        pytest.skip(f"{BEHAVIOR_MODEL_PATH} non presente")
+    assert model.n_features_in_ == N_FEATURES
+    rng = np.random.default_rng(0)
+    windows = [random_window(rng, 20) for _ in range(500)]
+    expected = np.array([pandas_reference(w) for w in windows])
+    got = np.array([extract_features_from_window(w) for w in windows])
+    assert (model.predict(got) == model.predict(expected)).all()
@@ -0,0 +1,92 @@
+"""
+FlatForest (core.forest) deve dare le stesse predizioni di sklearn.
+
+    python -m pytest tests
+"""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+from core.forest import FlatForest, _probe_inputs, compile_forest, verify
+from core.registry import BEHAVIOR_MODEL_PATH
+
+
+def _flat(estimator):
+    compiled = compile_forest(estimator)
+    return compiled, FlatForest(compiled["arrays"], compiled["meta"])
+
+
+def _threshold_inputs(compiled, n, seed=0):
+    """Input con ogni feature esattamente uguale a una soglia dei suoi nodi."""
+    rng = np.random.default_rng(seed)
+    arrays = compiled["arrays"]
+    split = np.isfinite(arrays["threshold"])
+    X = np.zeros((n, compiled["meta"]["n_features"]))
+    for f in range(X.shape[1]):
+        thr = arrays["threshold"][split & (arrays["feature"] == f)]
+        if len(thr):
+            X[:, f] = rng.choice(thr, n)
+    return X
+
+
+@pytest.fixture(scope="module")
+def bundled_classifier():
+    try:
+        bundle = joblib.load(BEHAVIOR_MODEL_PATH)
+    except FileNotFoundError:
+        pytest.skip(f"{BEHAVIOR_MODEL_PATH} non presente")
+    return bundle["model"] if isinstance(bundle, dict) else bundle
+
+
+@pytest.fixture(scope="module")
+def regressor():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 5))
+    y = X[:, 0] * 2 - X[:, 1] ** 2 + rng.normal(scale=0.1, size=300)
+    return RandomForestRegressor(n_estimators=15, max_depth=6, random_state=0).fit(X, y)
+
+
+def test_bundled_classifier(bundled_classifier):
+    compiled, forest = _flat(bundled_classifier)
+    verify(bundled_classifier, forest, _probe_inputs(compiled, 2000))
+
+
+def test_regressor(regressor):
+    compiled, forest = _flat(regressor)
+    verify(regressor, forest, _probe_inputs(compiled, 2000))
+
+
+@pytest.mark.parametrize("model", ["bundled_classifier", "regressor"])
+def test_inputs_equal_to_thresholds(model, request):
+    estimator = request.getfixturevalue(model)
+    compiled, forest = _flat(estimator)
+    verify(estimator, forest, _threshold_inputs(compiled, 2000))
+
+
+def test_argmax_ties():
+    # Etichette diverse per lo stesso input: ogni foglia ha probabilita' alla pari
+    X = np.repeat(np.arange(4.0), 3).reshape(-1, 1)
+    y = np.tile([2, 0, 1], 4)
+    clf = RandomForestClassifier(n_estimators=4, bootstrap=False, random_state=0).fit(X, y)
+    _, forest = _flat(clf)
+    probe = np.linspace(-1, 4, 50).reshape(-1, 1)
+    assert np.allclose(forest.predict_proba(probe), 1 / 3)
+    verify(clf, forest, probe)
+
+
+def test_dataframe_with_feature_names():
+    rng = np.random.default_rng(1)
+    columns = ["speed", "acc", "gyro", "jerk"]
+    df = pd.DataFrame(rng.normal(size=(200, 4)), columns=columns)
+    y = np.where(df["acc"] + df["jerk"] > 0, "AGGRESSIVE", "NORMAL")
+    clf = RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0).fit(df, y)
+    compiled, forest = _flat(clf)
+    assert forest.feature_names == columns
+
+    probe = pd.DataFrame(_probe_inputs(compiled, 500), columns=columns)
+    # Le colonne vengono riordinate secondo feature_names
+    shuffled = probe[columns[::-1]]
+    assert (forest.predict(shuffled) == clf.predict(probe)).all()
+    assert np.allclose(forest.predict_proba(shuffled), clf.predict_proba(probe), rtol=0, atol=1e-12)
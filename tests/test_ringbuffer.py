@@ -0,0 +1,101 @@
+"""
+Finestra scorrevole (core.ringbuffer) e sua gestione nel WebSocket.
+
+    python -m pytest tests
+"""
+import asyncio
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+import api.behavior as behavior
+from core.executor import ExecutorBusy
+from core.features import SENSOR_COLUMNS, extract_features
+from core.ringbuffer import SlidingWindow
+from db.behavior_store import WindowAccumulator
+
+
+def _stream(n, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(n, len(SENSOR_COLUMNS))) * [1, 1, 1, 50, 50, 50] + [0, 0, 9.81, 0, 0, 0]
+    return np.arange(n, dtype=np.int64), data
+
+
+@pytest.mark.parametrize("window_len,hop", [(20, 1), (20, 3), (20, 20), (40, 7)])
+def test_features_match_core_features(window_len, hop):
+    ts, data = _stream(6000)
+    ring = SlidingWindow(window_len, hop)
+    rng = np.random.default_rng(1)
+    start, emitted = 0, 0
+    # Blocchi di lunghezza variabile, oltre RESYNC_EVERY campioni
+    while start < len(ts):
+        end = min(start + int(rng.integers(1, 30)), len(ts))
+        for features, chunk_ts, _ in ring.push(ts[start:end], data[start:end]):
+            last = int(chunk_ts[-1])
+            expected = extract_features(data[last - window_len + 1:last + 1])
+            assert np.allclose(features, expected, rtol=1e-9, atol=1e-9)
+            emitted += 1
+        start = end
+    assert emitted == (len(ts) - window_len) // hop + 1
+
+
+def test_features_with_constant_window():
+    ring = SlidingWindow(20, 5)
+    data = np.tile([0.1, -0.2, 9.81, 3.0, 0.0, -1.0], (40, 1))
+    emitted = ring.push(np.arange(40), data)
+    assert emitted
+    assert np.allclose(emitted[-1][0], extract_features(data[-20:]), rtol=0, atol=1e-6)
+
+
+def test_requeue_restores_order():
+    ring = SlidingWindow(4, 2)
+    ts, data = _stream(7)
+    emitted = ring.push(ts[:6], data[:6])
+    assert len(emitted) == 2
+    assert ring.push(ts[6:], data[6:]) == []
+    for _, chunk_ts, chunk in reversed(emitted):
+        ring.requeue(chunk_ts, chunk)
+    drained_ts, drained = ring.drain()
+    assert drained_ts.tolist() == list(range(7))
+    assert np.array_equal(drained, data)
+
+
+class _BusyBatcher:
+    async def submit(self, features):
+        raise ExecutorBusy()
+
+
+def _classify_busy(monkeypatch, acc_label=None):
+    stored = []
+
+    async def store(docs, owners, pending):
+        stored.extend(docs)
+
+    monkeypatch.setattr(behavior, "inference_batcher", _BusyBatcher())
+    monkeypatch.setattr(behavior, "_store_windows", store)
+    sid = ObjectId()
+    ring, acc = SlidingWindow(20, 10), WindowAccumulator(sid, 20)
+    if acc_label is not None:
+        acc.add(np.empty(0, dtype=np.int64), np.empty((0, 6)), acc_label, "v1")
+    streams = {sid: (ring, acc)}
+    ts, data = _stream(45)
+    with pytest.raises(ExecutorBusy):
+        asyncio.run(behavior._classify_chunk(streams, {}, set(), sid, ts, data))
+    return ring, acc, stored, ts, data
+
+
+def test_busy_chunk_keeps_samples_without_label(monkeypatch):
+    ring, _, stored, ts, data = _classify_busy(monkeypatch)
+    assert stored == []
+    drained_ts, drained = ring.drain()
+    assert drained_ts.tolist() == ts.tolist()
+    assert np.array_equal(drained, data)
+
+
+def test_busy_chunk_stores_samples_with_last_label(monkeypatch):
+    ring, acc, stored, ts, _ = _classify_busy(monkeypatch, acc_label="SLOW")
+    # Finestre complete gia' restituite, il resto nell'accumulatore o nel ring
+    kept = sum(len(doc["t"]) // 8 for doc in stored) + sum(len(t) for t in acc._ts) + len(ring.drain()[0])
+    assert kept == len(ts)
+    assert all(doc["label"] == "SLOW" for doc in stored)
@@ -0,0 +1,97 @@
+"""
+Stop di una sessione (api.sessions.stop_session) su un database mongomock.
+
+    python -m pytest tests
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import api.sessions as sessions
+from core.executor import ExecutorBusy
+from db.behavior_store import empty_session_aggregates
+from models.session_model import SessionStop
+from models.user_model import UserPublic
+
+
+class _Writer:
+    """Al posto di bulk_writer: registra le operazioni accodate."""
+
+    def __init__(self):
+        self.ops = []
+
+    async def write(self, collection, ops):
+        self.ops.extend((collection, op) for op in ops)
+
+    async def flush(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+
+    async def get_database():
+        return db
+
+    async def refresh(db, user_ids=None):
+        pass
+
+    monkeypatch.setattr(sessions, "get_database", get_database)
+    # mongomock non implementa $merge
+    monkeypatch.setattr(sessions, "refresh_user_behavior_counts", refresh)
+    return db
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_stop_retried_after_executor_busy_finalizes(db, monkeypatch):
+    writer = _Writer()
+    monkeypatch.setattr(sessions, "bulk_writer", writer)
+    calls = []
+
+    async def predict(db, session_doc, summary):
+        calls.append(session_doc["_id"])
+        if len(calls) == 1:
+            raise ExecutorBusy()
+        return 0.7, "v1"
+
+    monkeypatch.setattr(sessions, "_predict_maintenance", predict)
+
+    uid, sid = ObjectId(), ObjectId()
+    _run(db.users.insert_one({"_id": uid}))
+    _run(db.sessions.insert_one({
+        "_id": sid, "user_id": uid, "start_time": datetime(2025, 1, 1, 8), "end_time": None,
+        **empty_session_aggregates(),
+    }))
+    user = UserPublic(id=str(uid), email="u@example.com", full_name="u", registration_date=datetime(2025, 1, 1))
+    body = SessionStop(session_id=str(sid))
+
+    with pytest.raises(HTTPException) as exc:
+        _run(sessions.stop_session(body, user))
+    assert exc.value.status_code == 503
+    stored = _run(db.sessions.find_one({"_id": sid}))
+    assert stored["end_time"] is not None and "finalized_at" not in stored
+    assert writer.ops == []
+
+    # Il retry consigliato dal 503 completa la finalizzazione
+    resp = _run(sessions.stop_session(body, user))
+    assert resp.maintenance_urgency == 0.7
+    assert resp.end_time == stored["end_time"]
+    stored = _run(db.sessions.find_one({"_id": sid}))
+    assert stored["maintenance_urgency"] == 0.7 and stored["finalized_at"] is not None
+    assert _run(db.users.find_one({"_id": uid}))["urgency_dirty"] == 1
+    rollup_ops = len(writer.ops)
+    assert rollup_ops > 0
+
+    # Uno stop successivo restituisce i valori salvati senza rifare nulla
+    again = _run(sessions.stop_session(body, user))
+    assert again == resp
+    assert len(calls) == 2 and len(writer.ops) == rollup_ops
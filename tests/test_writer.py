@@ -0,0 +1,69 @@
+"""
+Buffer write-behind (db.writer) su un database mongomock.
+
+    python -m pytest tests
+"""
+import asyncio
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import db.writer as writer
+from db.behavior_store import TIMESERIES_COLLECTION, encode_window, window_to_samples
+
+
+class _FlakyCollection:
+    """Applica meta' del primo bulk_write e poi perde la connessione."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.sent = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, ops, ordered=True):
+        self.sent.append(len(ops))
+        if len(self.sent) == 1:
+            await self._collection.bulk_write(ops[:len(ops) // 2], ordered=ordered)
+            raise AutoReconnect("connessione persa")
+        return await self._collection.bulk_write(ops, ordered=ordered)
+
+
+class _Database:
+    def __init__(self, db, flaky):
+        self._db = db
+        self._flaky = flaky
+
+    def __getitem__(self, name):
+        return self._flaky if name == TIMESERIES_COLLECTION else self._db[name]
+
+
+def test_retried_timeseries_batch_skips_written_samples(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    flaky = _FlakyCollection(db[TIMESERIES_COLLECTION])
+
+    async def get_database():
+        return _Database(db, flaky)
+
+    monkeypatch.setattr(writer, "get_database", get_database)
+    window = encode_window(ObjectId(), np.arange(20) * 500 + 1_700_000_000_000, np.ones((20, 6)), "SLOW")
+    ops = [InsertOne(sample) for sample in window_to_samples(window)]
+
+    async def run():
+        bulk_writer = writer.BulkWriter(flush_interval_ms=60_000)
+        await bulk_writer.write(TIMESERIES_COLLECTION, ops)
+        with pytest.raises(ConnectionError):
+            await bulk_writer.flush()
+        await bulk_writer.flush()
+        await bulk_writer.stop()
+
+    asyncio.run(run())
+    # Il retry rimanda solo i campioni non scritti dal primo tentativo
+    assert flaky.sent == [20, 10]
+    assert asyncio.run(db[TIMESERIES_COLLECTION].count_documents({})) == 20